@@ -1,4 +1,5 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils import timezone
 from .models import (
     FiscalYear,
     AccountType,
@@ -8,6 +9,7 @@ from .models import (
     JournalEntryLine,
     Vendor,
     Customer,
+    CreditExposure,
     Bill,
     BillLine,
     BillPayment,
@@ -17,7 +19,12 @@ from .models import (
     TaxRate,
     FinancialPeriod,
     FinancialStatement,
+    AccountBalance,
+    PostingJob,
+    DocumentSequence,
 )
+from . import closing
+from .statements import regenerate_statement
 
 
 class FinancialPeriodInline(admin.TabularInline):
@@ -30,6 +37,16 @@ class FiscalYearAdmin(admin.ModelAdmin):
     list_filter = ("is_active", "is_closed")
     search_fields = ("name",)
     inlines = [FinancialPeriodInline]
+    actions = ["close_fiscal_years"]
+
+    def close_fiscal_years(self, request, queryset):
+        for fiscal_year in queryset.filter(is_closed=False).order_by("start_date"):
+            try:
+                fiscal_year.close(request.user)
+            except ValueError as exc:
+                self.message_user(request, f"{fiscal_year}: {exc}", messages.ERROR)
+
+    close_fiscal_years.short_description = "Close selected fiscal years"
 
 
 class AccountAdmin(admin.ModelAdmin):
@@ -350,6 +367,70 @@ class FinancialPeriodAdmin(admin.ModelAdmin):
         ("Date Range", {"fields": ("start_date", "end_date")}),
         ("Closing Information", {"fields": ("closed_by", "closed_at")}),
     )
+    actions = ["close_periods"]
+
+    def close_periods(self, request, queryset):
+        closing.close_periods(queryset, request.user)
+
+    close_periods.short_description = "Close selected periods"
+
+
+class AccountBalanceAdmin(admin.ModelAdmin):
+    list_display = (
+        "account",
+        "period",
+        "debit_total",
+        "credit_total",
+        "closing_balance",
+        "updated_at",
+    )
+    list_filter = ("period__fiscal_year", "period")
+    search_fields = ("account__code", "account__name")
+    readonly_fields = (
+        "account",
+        "period",
+        "period_end",
+        "debit_total",
+        "credit_total",
+        "closing_balance",
+        "updated_at",
+    )
+
+
+class PostingJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "document_type",
+        "object_id",
+        "status",
+        "attempts",
+        "enqueued_at",
+        "available_at",
+        "processed_at",
+    )
+    list_filter = ("status", "document_type")
+    search_fields = ("object_id", "last_error")
+    readonly_fields = ("enqueued_at", "processed_at", "last_error")
+    actions = ["retry_jobs"]
+
+    def retry_jobs(self, request, queryset):
+        queryset.update(
+            status="pending", attempts=0, available_at=timezone.now(), last_error=""
+        )
+
+    retry_jobs.short_description = "Retry selected jobs"
+
+
+class CreditExposureAdmin(admin.ModelAdmin):
+    list_display = ("user", "open_orders")
+    search_fields = ("user__email",)
+    readonly_fields = ("user", "open_orders")
+
+
+class DocumentSequenceAdmin(admin.ModelAdmin):
+    # next_value is editable to continue numbering from an earlier system;
+    # running processes keep handing out the blocks they already reserved
+    list_display = ("name", "next_value")
+    search_fields = ("name",)
 
 
 class FinancialStatementAdmin(admin.ModelAdmin):
@@ -364,7 +445,8 @@ class FinancialStatementAdmin(admin.ModelAdmin):
     )
     list_filter = ("statement_type", "fiscal_year", "as_of_date")
     search_fields = ("title", "notes")
-    readonly_fields = ("generated_at", "generated_by")
+    readonly_fields = ("generated_at", "generated_by", "high_water_mark")
+    actions = ["regenerate_statements"]
     fieldsets = (
         (
             None,
@@ -379,9 +461,18 @@ class FinancialStatementAdmin(admin.ModelAdmin):
             },
         ),
         ("Data", {"fields": ("data", "notes")}),
-        ("Generation Information", {"fields": ("generated_by", "generated_at")}),
+        (
+            "Generation Information",
+            {"fields": ("generated_by", "generated_at", "high_water_mark")},
+        ),
     )
 
+    def regenerate_statements(self, request, queryset):
+        for statement in queryset.select_related("fiscal_year", "period"):
+            regenerate_statement(statement)
+
+    regenerate_statements.short_description = "Regenerate selected statements"
+
 
 # Register all models
 admin.site.register(FiscalYear, FiscalYearAdmin)
@@ -391,8 +482,12 @@ admin.site.register(Journal, JournalAdmin)
 admin.site.register(JournalEntry, JournalEntryAdmin)
 admin.site.register(Vendor, VendorAdmin)
 admin.site.register(Customer, CustomerAdmin)
+admin.site.register(CreditExposure, CreditExposureAdmin)
 admin.site.register(Bill, BillAdmin)
 admin.site.register(Invoice, InvoiceAdmin)
 admin.site.register(TaxRate, TaxRateAdmin)
 admin.site.register(FinancialPeriod, FinancialPeriodAdmin)
+admin.site.register(AccountBalance, AccountBalanceAdmin)
+admin.site.register(PostingJob, PostingJobAdmin)
+admin.site.register(DocumentSequence, DocumentSequenceAdmin)
 admin.site.register(FinancialStatement, FinancialStatementAdmin)
@@ -0,0 +1,133 @@
+from datetime import timedelta
+
+from django.db.models import (
+    Case,
+    CharField,
+    F,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .posting import ZERO
+
+# Bucket key, label and the range of days past due it covers
+BUCKETS = (
+    ("current", "Current", None, 0),
+    ("days_1_30", "1-30", 1, 30),
+    ("days_31_60", "31-60", 31, 60),
+    ("days_61_90", "61-90", 61, 90),
+    ("days_90_plus", "90+", 91, None),
+)
+
+# Per ledger: document model, party field, issue date field, party name
+# lookups for the report, relations for the drill-down and open statuses
+LEDGERS = {
+    "receivables": {
+        "model": "Invoice",
+        "party": "customer",
+        "date": "invoice_date",
+        "names": {
+            "email": F("customer__user__email"),
+            "first_name": F("customer__user__first_name"),
+            "last_name": F("customer__user__last_name"),
+        },
+        "related": ("customer__user",),
+        "statuses": ("sent", "partially_paid", "overdue"),
+    },
+    "payables": {
+        "model": "Bill",
+        "party": "vendor",
+        "date": "bill_date",
+        "names": {"name": F("vendor__procurement_vendor__supplier__name")},
+        "related": ("vendor__procurement_vendor__supplier",),
+        "statuses": ("verified", "approved", "partial"),
+    },
+}
+
+
+def bucket_filter(bucket, as_of_date):
+    """Q on due_date selecting the documents of one bucket at ``as_of_date``"""
+    for key, _, first_day, last_day in BUCKETS:
+        if key != bucket:
+            continue
+        # Days past due = as_of_date - due_date
+        if first_day is None:
+            return Q(due_date__gte=as_of_date)
+        condition = Q(due_date__lte=as_of_date - timedelta(days=first_day))
+        if last_day is not None:
+            condition &= Q(due_date__gte=as_of_date - timedelta(days=last_day))
+        return condition
+    raise ValueError(f"Unknown aging bucket {bucket!r}")
+
+
+def open_documents(ledger, as_of_date=None):
+    """Issued, open documents of a ledger with an outstanding balance"""
+    from . import models
+
+    config = LEDGERS[ledger]
+    model = getattr(models, config["model"])
+    documents = model.objects.filter(status__in=config["statuses"])
+    if as_of_date is not None:
+        documents = documents.filter(**{f"{config['date']}__lte": as_of_date})
+    return documents.with_totals().filter(remaining__gt=0)
+
+
+def aging_report(ledger, as_of_date=None):
+    """
+    Outstanding balance per customer or vendor split into aging buckets.
+
+    ``ledger`` is "receivables" (invoices) or "payables" (bills). Every bucket
+    is a conditional SUM over due_date ranges, so the whole report is one
+    grouped query served by the (status, due_date) index no matter how many
+    documents are open. Returns (rows, totals); each row carries the party
+    id, its name fields, one amount per bucket key and ``total``.
+    """
+    as_of_date = as_of_date or timezone.localdate()
+    config = LEDGERS[ledger]
+    remaining = F("remaining")
+
+    buckets = {
+        key: Coalesce(Sum(remaining, filter=bucket_filter(key, as_of_date)), ZERO)
+        for key, _, _, _ in BUCKETS
+    }
+    rows = list(
+        open_documents(ledger, as_of_date)
+        .values(party_id=F(config["party"]), **config["names"])
+        .annotate(**buckets, total=Coalesce(Sum(remaining), ZERO))
+        .order_by("-total")
+    )
+
+    totals = {
+        key: sum((row[key] for row in rows), ZERO.value) for key in (*buckets, "total")
+    }
+    return rows, totals
+
+
+def aging_detail(ledger, as_of_date=None, party_id=None, bucket=None):
+    """
+    Drill-down: the open documents behind a report cell.
+
+    Documents are annotated with ``remaining`` and their ``bucket`` key and
+    ordered by due date; filter by party and/or bucket to match a cell.
+    """
+    as_of_date = as_of_date or timezone.localdate()
+    config = LEDGERS[ledger]
+
+    documents = open_documents(ledger, as_of_date).annotate(
+        bucket=Case(
+            *(
+                When(bucket_filter(key, as_of_date), then=Value(key))
+                for key, _, _, _ in BUCKETS
+            ),
+            output_field=CharField(),
+        )
+    )
+    if party_id is not None:
+        documents = documents.filter(**{f"{config['party']}_id": party_id})
+    if bucket:
+        documents = documents.filter(bucket_filter(bucket, as_of_date))
+    return documents.select_related(*config["related"]).order_by("due_date", "id")
@@ -0,0 +1,287 @@
+from datetime import date, timedelta
+
+from django.db.models import (
+    BigIntegerField,
+    Case,
+    DateField,
+    DecimalField,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+from .posting import DEBIT_BALANCE_TYPES, ZERO, balance_delta
+
+MONEY = DecimalField(max_digits=15, decimal_places=2)
+
+
+def signed_balance(net, type_field="account_type__type"):
+    """Turn a debit-minus-credit expression into a normal-balance amount."""
+    return Case(
+        When(**{f"{type_field}__in": DEBIT_BALANCE_TYPES}, then=net),
+        default=-net,
+        output_field=MONEY,
+    )
+
+
+def balances_as_of(as_of_date, accounts=None):
+    """
+    Annotate accounts with ``balance``: their posted balance at the end of
+    ``as_of_date``.
+
+    Each account starts from its nearest AccountBalance snapshot on or before
+    the date and adds only the lines posted after that snapshot, so the cost
+    does not grow with the age of the ledger.
+    """
+    from .models import Account, AccountBalance, JournalEntryLine
+
+    if accounts is None:
+        accounts = Account.objects.all()
+
+    snapshots = AccountBalance.objects.filter(
+        account=OuterRef("pk"), period_end__lte=as_of_date
+    ).order_by("-period_end")
+
+    delta = (
+        JournalEntryLine.objects.filter(
+            account=OuterRef("pk"),
+            journal_entry__status="posted",
+            entry_date__gt=OuterRef("snapshot_date"),
+            entry_date__lte=as_of_date,
+        )
+        .values("account")
+        .annotate(net=Sum(F("debit_amount") - F("credit_amount")))
+        .values("net")
+    )
+
+    return accounts.annotate(
+        snapshot_balance=Coalesce(
+            Subquery(snapshots.values("closing_balance")[:1]), ZERO
+        ),
+        snapshot_date=Coalesce(
+            Subquery(snapshots.values("period_end")[:1]),
+            Value(date.min, output_field=DateField()),
+        ),
+        delta_net=Coalesce(Subquery(delta, output_field=MONEY), ZERO),
+    ).annotate(balance=F("snapshot_balance") + signed_balance(F("delta_net")))
+
+
+def record_postings(totals):
+    """
+    Fold posted line totals into the period snapshots.
+
+    ``totals`` holds one row per (account, entry date) as built by
+    ``post_many``. Must run inside the posting transaction while the entries
+    are still drafts: missing snapshots are seeded from the already-posted
+    ledger and then every snapshot at or after each line's date is moved by
+    the delta.
+    """
+    from .models import AccountBalance, FinancialPeriod
+
+    if not totals:
+        return
+
+    dates = [row["journal_entry__date"] for row in totals]
+    periods = list(
+        FinancialPeriod.objects.filter(
+            start_date__lte=max(dates), end_date__gte=min(dates)
+        ).order_by("start_date")
+    )
+
+    def period_for(day):
+        for period in periods:
+            if period.start_date <= day <= period.end_date:
+                return period
+        return None
+
+    # Collapse lines into one change per (account, period) or per
+    # (account, date) when the date falls outside every period
+    changes = {}
+    for row in totals:
+        day = row["journal_entry__date"]
+        period = period_for(day)
+        key = (row["account_id"], period.pk if period else day)
+        change = changes.setdefault(
+            key,
+            {"period": period, "date": day, "debits": 0, "credits": 0, "delta": 0},
+        )
+        change["date"] = min(change["date"], day)
+        change["debits"] += row["debits"]
+        change["credits"] += row["credits"]
+        change["delta"] += balance_delta(
+            row["account__account_type__type"], row["debits"], row["credits"]
+        )
+
+    seed_snapshots(
+        {
+            (account_id, c["period"])
+            for (account_id, _), c in changes.items()
+            if c["period"]
+        }
+    )
+
+    # Only accounts that already have snapshots at or after the lines need updates
+    tracked = set(
+        AccountBalance.objects.filter(
+            account_id__in={account_id for account_id, _ in changes},
+            period_end__gte=min(dates),
+        )
+        .order_by()
+        .values_list("account_id", flat=True)
+        .distinct()
+    )
+
+    for (account_id, _), change in sorted(changes.items(), key=lambda item: item[0][0]):
+        if account_id not in tracked:
+            continue
+        period = change["period"]
+        if period:
+            AccountBalance.objects.filter(account_id=account_id, period=period).update(
+                debit_total=F("debit_total") + change["debits"],
+                credit_total=F("credit_total") + change["credits"],
+            )
+        if change["delta"]:
+            AccountBalance.objects.filter(
+                account_id=account_id, period_end__gte=change["date"]
+            ).update(closing_balance=F("closing_balance") + change["delta"])
+
+
+def seed_snapshots(pairs):
+    """Create the missing (account, period) snapshots from the posted ledger."""
+    from .models import Account, AccountBalance
+
+    if not pairs:
+        return
+
+    account_ids = {account_id for account_id, _ in pairs}
+    existing = set(
+        AccountBalance.objects.filter(
+            account_id__in=account_ids, period__in={period for _, period in pairs}
+        ).values_list("account_id", "period_id")
+    )
+
+    missing = {}
+    for account_id, period in pairs:
+        if (account_id, period.pk) not in existing:
+            missing.setdefault(period, []).append(account_id)
+
+    snapshots = []
+    for period, ids in missing.items():
+        movement = period_movements(period, ids)
+        closing = balances_as_of(period.end_date, Account.objects.filter(id__in=ids))
+        for account_id, balance in closing.values_list("id", "balance"):
+            debits, credits = movement.get(account_id, (0, 0))
+            snapshots.append(
+                AccountBalance(
+                    account_id=account_id,
+                    period=period,
+                    period_end=period.end_date,
+                    debit_total=debits,
+                    credit_total=credits,
+                    closing_balance=balance,
+                )
+            )
+    AccountBalance.objects.bulk_create(snapshots, ignore_conflicts=True)
+
+
+def period_movements(period, account_ids=None):
+    """Return {account_id: (debits, credits)} posted within ``period``."""
+    from .models import JournalEntryLine
+
+    lines = JournalEntryLine.objects.filter(
+        journal_entry__status="posted",
+        entry_date__range=(period.start_date, period.end_date),
+    )
+    if account_ids is not None:
+        lines = lines.filter(account_id__in=account_ids)
+
+    return {
+        row["account_id"]: (row["debits"], row["credits"])
+        for row in lines.values("account_id").annotate(
+            debits=Coalesce(Sum("debit_amount"), ZERO),
+            credits=Coalesce(Sum("credit_amount"), ZERO),
+        )
+    }
+
+
+def snapshot_periods(periods):
+    """
+    Write a snapshot for every account at the end of each of ``periods``.
+
+    The movement of all periods comes from one grouped query, each line
+    bucketed by a CASE on its date into the first period ending on or after
+    it; closing balances run forward from the balances before the first
+    period. Lines between periods count towards the next closing balance but
+    not its debit and credit totals.
+    """
+    from .models import AccountBalance, JournalEntryLine
+
+    periods = sorted(periods, key=lambda period: period.end_date)
+    if not periods:
+        return 0
+    first = min(period.start_date for period in periods)
+
+    opening = balances_as_of(first - timedelta(days=1)).values_list(
+        "id", "account_type__type", "balance"
+    )
+    within = Q()
+    for period in periods:
+        within |= Q(entry_date__range=(period.start_date, period.end_date))
+    movements = {
+        (row["account_id"], row["period_id"]): row
+        for row in JournalEntryLine.objects.filter(
+            journal_entry__status="posted",
+            entry_date__range=(first, periods[-1].end_date),
+        )
+        .annotate(
+            period_id=Case(
+                *(
+                    When(entry_date__lte=period.end_date, then=Value(period.pk))
+                    for period in periods
+                ),
+                output_field=BigIntegerField(),
+            )
+        )
+        .values("account_id", "period_id")
+        .annotate(
+            debits=Coalesce(Sum("debit_amount"), ZERO),
+            credits=Coalesce(Sum("credit_amount"), ZERO),
+            debit_total=Coalesce(Sum("debit_amount", filter=within), ZERO),
+            credit_total=Coalesce(Sum("credit_amount", filter=within), ZERO),
+        )
+        .order_by()
+    }
+
+    snapshots = []
+    for account_id, account_type, balance in opening:
+        for period in periods:
+            row = movements.get((account_id, period.pk))
+            if row:
+                balance += balance_delta(account_type, row["debits"], row["credits"])
+            snapshots.append(
+                AccountBalance(
+                    account_id=account_id,
+                    period=period,
+                    period_end=period.end_date,
+                    debit_total=row["debit_total"] if row else 0,
+                    credit_total=row["credit_total"] if row else 0,
+                    closing_balance=balance,
+                )
+            )
+    AccountBalance.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=["account", "period"],
+        update_fields=["period_end", "debit_total", "credit_total", "closing_balance"],
+    )
+    return len(snapshots)
+
+
+def snapshot_period(period):
+    """Write a snapshot for every account at the end of ``period``."""
+    return snapshot_periods([period])
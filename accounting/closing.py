@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from .balances import snapshot_periods
+from .counters import reset_ytd
+from .posting import ZERO, post_many
+from .posting_rules import get_rule
+
+# Account types whose balances the year-end entry moves to retained earnings
+INCOME_TYPES = ("revenue", "expense")
+
+
+def close_periods(periods, user):
+    """
+    Close several periods at once.
+
+    Balances of every account are frozen for all periods in one snapshot
+    pass and the periods are marked closed with one UPDATE. Periods that
+    are already closed are skipped; returns the periods closed.
+    """
+    from .models import FinancialPeriod
+
+    ids = [period.pk for period in periods]
+    with transaction.atomic():
+        periods = list(
+            FinancialPeriod.objects.select_for_update().filter(
+                pk__in=ids, status="open"
+            )
+        )
+        snapshot_periods(periods)
+        now = timezone.now()
+        FinancialPeriod.objects.filter(pk__in=[p.pk for p in periods]).update(
+            status="closed", closed_by=user, closed_at=now
+        )
+    for period in periods:
+        period.status, period.closed_by, period.closed_at = "closed", user, now
+    return periods
+
+
+def closing_lines(fiscal_year):
+    """
+    (account_id, debit, credit) zeroing each revenue and expense account.
+
+    One grouped query nets the posted lines of the year per account and
+    turns the net into the opposite side in SQL.
+    """
+    from .models import JournalEntryLine
+
+    return (
+        JournalEntryLine.objects.filter(
+            journal_entry__status="posted",
+            entry_date__range=(fiscal_year.start_date, fiscal_year.end_date),
+            account__account_type__type__in=INCOME_TYPES,
+        )
+        .values("account_id")
+        .annotate(net=Sum(F("debit_amount") - F("credit_amount")))
+        .exclude(net=0)
+        .annotate(
+            debit=Case(When(net__lt=0, then=-F("net")), default=ZERO),
+            credit=Case(When(net__gt=0, then=F("net")), default=ZERO),
+        )
+        .order_by("account_id")
+        .values_list("account_id", "debit", "credit")
+    )
+
+
+def close_fiscal_year(fiscal_year, user, retained_earnings=None):
+    """
+    Close a fiscal year: post its closing entry and close all its periods.
+
+    The closing entry, dated on the last day of the year, moves the balance
+    of every revenue and expense account to ``retained_earnings`` (by
+    default the account of the year_end posting rule). Draft entries in
+    the year must be posted or cancelled first. Customer and vendor
+    year-to-date counters are reset to the current year. Returns the
+    closing entry, or None when the year had no income to close.
+    """
+    from .models import FiscalYear, JournalEntry, JournalEntryLine
+
+    rule = get_rule("year_end")
+    if retained_earnings is None:
+        retained_earnings = rule["accounts"].get("retained_earnings")
+        if retained_earnings is None:
+            raise ValueError("No retained earnings account to close into")
+    elif not isinstance(retained_earnings, int):
+        retained_earnings = retained_earnings.pk
+
+    with transaction.atomic():
+        locked = FiscalYear.objects.select_for_update().get(pk=fiscal_year.pk)
+        if locked.is_closed:
+            raise ValueError("Fiscal year is already closed")
+        if JournalEntry.objects.filter(
+            status="draft",
+            date__range=(fiscal_year.start_date, fiscal_year.end_date),
+        ).exists():
+            raise ValueError("Post or cancel the draft entries of the year first")
+
+        lines = list(closing_lines(fiscal_year))
+        entry = None
+        if lines:
+            entry = JournalEntry.objects.create(
+                journal_id=rule["journal_id"],
+                fiscal_year=fiscal_year,
+                date=fiscal_year.end_date,
+                description=f"Year-end closing {fiscal_year.name}",
+                reference=f"CLOSE-{fiscal_year.pk}",
+                created_by=user,
+            )
+            # Closing debits minus credits is the year's net income
+            net_income = sum(debit - credit for _, debit, credit in lines)
+            if net_income:
+                lines.append(
+                    (retained_earnings, max(-net_income, 0), max(net_income, 0))
+                )
+            JournalEntryLine.objects.bulk_create(
+                JournalEntryLine(
+                    journal_entry=entry,
+                    entry_date=entry.date,
+                    account_id=account_id,
+                    description="Year-end closing",
+                    debit_amount=debit,
+                    credit_amount=credit,
+                )
+                for account_id, debit, credit in lines
+            )
+            # Its last period may already be closed
+            post_many([entry], user, check_closed=False)
+
+        close_periods(fiscal_year.periods.all(), user)
+        FiscalYear.objects.filter(pk=fiscal_year.pk).update(is_closed=True)
+        # Years are closed after the next one started; in case the
+        # rollover job did not run, year-to-date counters start over here
+        reset_ytd()
+    fiscal_year.is_closed = True
+    return entry
@@ -0,0 +1,93 @@
+import struct
+import sys
+import zipfile
+from array import array
+from datetime import date
+
+# NumPy .npy format 1.0: magic, version, little-endian header length, then a
+# dict literal describing the array padded so the data starts 64-byte aligned
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_ALIGN = 64
+
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+class Int64Column:
+    """int64 values, e.g. ids or fixed-point amounts in cents"""
+
+    descr = "<i8"
+
+    def __init__(self):
+        self.values = array("q")
+
+    def extend(self, values):
+        self.values.extend(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def tobytes(self):
+        values = self.values
+        if sys.byteorder == "big":
+            values = array("q", values)
+            values.byteswap()
+        return values.tobytes()
+
+
+class DateColumn(Int64Column):
+    """Dates as days since 1970-01-01, NumPy's datetime64[D]"""
+
+    descr = "<M8[D]"
+
+    def extend(self, values):
+        self.values.extend(value.toordinal() - EPOCH for value in values)
+
+
+class StringColumn:
+    """Short strings as fixed-width UTF-32, NumPy's unicode dtype"""
+
+    def __init__(self):
+        self.values = []
+
+    def extend(self, values):
+        self.values.extend(value or "" for value in values)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def width(self):
+        return max(map(len, set(self.values)), default=0) or 1
+
+    @property
+    def descr(self):
+        return f"<U{self.width}"
+
+    def tobytes(self):
+        # Codes and names repeat a lot, encode each distinct one once
+        size = self.width * 4
+        encoded = {
+            value: value.encode("utf-32-le").ljust(size, b"\0")
+            for value in set(self.values)
+        }
+        return b"".join(map(encoded.__getitem__, self.values))
+
+
+def npy_header(descr, length):
+    """The .npy header of a one-dimensional array"""
+    header = repr({"descr": descr, "fortran_order": False, "shape": (length,)})
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_ALIGN
+    header = (header + " " * padding + "\n").encode("latin1")
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header
+
+
+def write_npz(path, columns):
+    """
+    Write {name: column} as a compressed .npz archive, one .npy per column,
+    loadable with ``numpy.load(path)``.
+    """
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, column in columns.items():
+            with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                member.write(npy_header(column.descr, len(column)))
+                member.write(column.tobytes())
@@ -0,0 +1,147 @@
+from datetime import date
+
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from django_project import deltas
+from django_project.deltas import chunks
+
+from .balances import MONEY
+from .posting import ZERO
+from .posting_rules import fiscal_years
+
+# Per ledger: document model, party model and field, the document date and
+# the party's year-to-date counter; current_balance is the other counter
+COUNTERS = {
+    "receivables": {
+        "model": "Invoice",
+        "party_model": "Customer",
+        "party": "customer",
+        "date": "invoice_date",
+        "ytd": "ytd_sales",
+    },
+    "payables": {
+        "model": "Bill",
+        "party_model": "Vendor",
+        "party": "vendor",
+        "date": "bill_date",
+        "ytd": "ytd_purchases",
+    },
+}
+
+# Drafts are not owed yet and cancelled documents no longer are
+UNBILLED = ("draft", "cancelled")
+
+# Parties updated per statement; each costs a few parameters
+PARTY_CHUNK = 200
+
+
+def ytd_range(day=None):
+    """First and last day of the fiscal (else calendar) year covering ``day``"""
+    day = day or timezone.localdate()
+    for start, end, _ in fiscal_years():
+        if start <= day <= end:
+            return start, end
+    return date(day.year, 1, 1), date(day.year, 12, 31)
+
+
+def counter_sums(config, day=None):
+    """
+    Aggregates of a party's documents: the open balance of everything
+    billed and the net amount billed in the year covering ``day``.
+    """
+    billed = ~Q(status__in=UNBILLED)
+    in_year = Q(**{f"{config['date']}__range": ytd_range(day)})
+    return {
+        "balance": Coalesce(
+            Sum(F("amount") + F("tax_amount") - F("paid_amount"), filter=billed),
+            ZERO,
+        ),
+        "ytd": Coalesce(Sum("amount", filter=billed & in_year), ZERO),
+    }
+
+
+def party_totals(ledger, document_ids):
+    """{party_id: (balance, ytd)} the given documents contribute"""
+    from . import models
+
+    config = COUNTERS[ledger]
+    model = getattr(models, config["model"])
+    totals = {}
+    for ids in chunks(document_ids):
+        rows = (
+            model.objects.filter(pk__in=ids)
+            .values(config["party"])
+            .annotate(**counter_sums(config))
+            .order_by()
+            .values_list(config["party"], "balance", "ytd")
+        )
+        for party_id, balance, ytd in rows:
+            previous = totals.get(party_id, (0, 0))
+            totals[party_id] = (previous[0] + balance, previous[1] + ytd)
+    return totals
+
+
+def apply_changes(ledger, before, after):
+    """
+    Move the counters of the parties by ``after`` minus ``before``, both
+    party_totals results.
+    """
+    from . import models
+
+    config = COUNTERS[ledger]
+    return deltas.apply_changes(
+        getattr(models, config["party_model"]),
+        ("current_balance", config["ytd"]),
+        before,
+        after,
+        size=PARTY_CHUNK,
+    )
+
+
+def tracking(ledger, document_ids):
+    """Apply the counter changes the block makes to the documents"""
+    return deltas.tracking(
+        lambda ids: party_totals(ledger, ids),
+        lambda before, after: apply_changes(ledger, before, after),
+        document_ids,
+    )
+
+
+def rebuild_counters(ledger, party_ids=None, ytd_only=False, day=None):
+    """
+    Recompute the counters of ``party_ids`` (all parties by default) from
+    their documents with one UPDATE of correlated subqueries.
+
+    ``ytd_only`` resets just the year-to-date counter to the year covering
+    ``day``, which is what a fiscal-year rollover needs.
+    Returns the number of parties updated.
+    """
+    from . import models
+
+    config = COUNTERS[ledger]
+    model = getattr(models, config["model"])
+    party_model = getattr(models, config["party_model"])
+    sums = (
+        model.objects.filter(**{config["party"]: OuterRef("pk")})
+        .order_by()
+        .values(config["party"])
+        .annotate(**counter_sums(config, day))
+    )
+    fields = {
+        config["ytd"]: Coalesce(Subquery(sums.values("ytd"), output_field=MONEY), ZERO)
+    }
+    if not ytd_only:
+        fields["current_balance"] = Coalesce(
+            Subquery(sums.values("balance"), output_field=MONEY), ZERO
+        )
+    parties = party_model.objects.all()
+    if party_ids is not None:
+        parties = parties.filter(pk__in=party_ids)
+    return parties.update(**fields)
+
+
+def reset_ytd(day=None):
+    """Start the year-to-date counters of every party over at a new year"""
+    return sum(rebuild_counters(ledger, ytd_only=True, day=day) for ledger in COUNTERS)
@@ -0,0 +1,148 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Sum
+
+from django_project import deltas
+from django_project.deltas import chunks
+
+# Order statuses whose amount is owed but not invoiced yet; invoiced
+# orders count through the customer's current_balance instead
+IN_FLIGHT = ("pending", "processing", "shipped", "delivered")
+
+# Seconds a customer's limit and exposure are served from this process
+CACHE_TTL = 5
+
+# user_id -> [expires at, credit limit, exposure]
+_cache = {}
+
+
+class CreditLimitExceeded(ValidationError):
+    pass
+
+
+def in_flight_totals(**lookup):
+    """(user_id, total) of the in-flight orders matching ``lookup``, per user"""
+    from shop.models import Order
+
+    from .models import Invoice
+
+    return (
+        Order.objects.filter(
+            ~Exists(Invoice.objects.filter(order=OuterRef("pk"))),
+            status__in=IN_FLIGHT,
+            user__isnull=False,
+            **lookup,
+        )
+        .values("user")
+        .annotate(
+            total=Sum(
+                F("total_amount")
+                + F("shipping_amount")
+                + F("tax_amount")
+                - F("discount_amount")
+            )
+        )
+        .order_by()
+        .values_list("user", "total")
+    )
+
+
+def order_amounts(order_ids):
+    """{user_id: total} of the given orders that are in flight"""
+    totals = {}
+    for ids in chunks(order_ids):
+        for user_id, total in in_flight_totals(pk__in=ids):
+            totals[user_id] = totals.get(user_id, 0) + total
+    return totals
+
+
+def apply_changes(before, after):
+    """Move open_orders of the users by ``after`` minus ``before``"""
+    from .models import CreditExposure
+
+    return deltas.apply_changes(
+        CreditExposure,
+        ("open_orders",),
+        {user_id: (total,) for user_id, total in before.items()},
+        {user_id: (total,) for user_id, total in after.items()},
+        create=True,
+    )
+
+
+def tracking(order_ids):
+    """Apply the exposure changes the block makes to the orders"""
+    return deltas.tracking(order_amounts, apply_changes, order_ids)
+
+
+def rebuild_exposure():
+    """Recompute every user's open_orders from the orders in flight"""
+    from .models import CreditExposure
+
+    totals = dict(in_flight_totals())
+    with transaction.atomic():
+        CreditExposure.objects.exclude(open_orders=0).update(open_orders=0)
+        CreditExposure.objects.bulk_create(
+            (
+                CreditExposure(user_id=user_id, open_orders=total)
+                for user_id, total in totals.items()
+            ),
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=["open_orders"],
+        )
+    _cache.clear()
+    return len(totals)
+
+
+def exposure(user_id):
+    """
+    (credit limit, current exposure) of a user, or None if they are not a
+    customer.
+
+    One lookup by the customer's unique user index joined to the user's
+    CreditExposure row, however much history the customer has. Results are
+    kept in this process for CACHE_TTL seconds.
+    """
+    from .models import Customer
+
+    now = time.monotonic()
+    cached = _cache.get(user_id)
+    if cached and cached[0] > now:
+        return cached[1], cached[2]
+
+    row = (
+        Customer.objects.filter(user_id=user_id)
+        .values_list(
+            "credit_limit", "current_balance", "user__credit_exposure__open_orders"
+        )
+        .first()
+    )
+    if row is None:
+        _cache.pop(user_id, None)
+        return None
+    credit_limit, balance, open_orders = row
+    _cache[user_id] = [now + CACHE_TTL, credit_limit, balance + (open_orders or 0)]
+    return credit_limit, balance + (open_orders or 0)
+
+
+def check_credit(user_id, amount):
+    """
+    Raise CreditLimitExceeded if ordering ``amount`` would take the user's
+    exposure over their credit limit; a limit of 0 means no limit.
+    """
+    found = exposure(user_id)
+    if found is None:
+        return
+    credit_limit, current = found
+    if credit_limit and current + amount > credit_limit:
+        raise CreditLimitExceeded(
+            f"Order of {amount} exceeds the credit limit of {credit_limit} "
+            f"({current} already open)",
+            code="credit_limit",
+        )
+    # Orders placed from this process count before the cache expires
+    if user_id in _cache:
+        _cache[user_id][2] += amount
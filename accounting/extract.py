@@ -0,0 +1,121 @@
+import json
+from itertools import islice
+from pathlib import Path
+
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+
+from .columnar import DateColumn, Int64Column, StringColumn, write_npz
+
+# Column name, type and the JournalEntryLine field it is read from
+LEDGER_COLUMNS = (
+    ("id", Int64Column, "id"),
+    ("entry_id", Int64Column, "journal_entry_id"),
+    ("entry_date", DateColumn, "entry_date"),
+    ("account_id", Int64Column, "account_id"),
+    ("account_code", StringColumn, "account__code"),
+    ("account_type", StringColumn, "account__account_type__type"),
+    ("journal", StringColumn, "journal_entry__journal__code"),
+    ("debit_cents", Int64Column, "debit_cents"),
+    ("credit_cents", Int64Column, "credit_cents"),
+)
+
+MANIFEST = "manifest.json"
+ROWS_PER_FILE = 1_000_000
+CHUNK_SIZE = 10_000
+
+
+def read_manifest(directory):
+    path = Path(directory) / MANIFEST
+    if not path.exists():
+        return {"last_version": None, "parts": []}
+    return json.loads(path.read_text())
+
+
+def export_lines(after=None, through=None, chunk_size=CHUNK_SIZE):
+    """
+    Lines of the entries posted after ledger version ``after`` up to
+    ``through``, streamed in posting order.
+
+    Entries get their version when they are posted, so drafts that are
+    never posted hold nothing back, and entries posted late are picked up
+    by the next incremental export whatever their line ids.
+    """
+    from .models import JournalEntryLine
+
+    lines = JournalEntryLine.objects.filter(journal_entry__status="posted")
+    if after is not None:
+        lines = lines.filter(journal_entry__posted_version__gt=after)
+    if through is not None:
+        lines = lines.filter(journal_entry__posted_version__lte=through)
+    # Amounts leave the database as fixed-point cents, no Decimal per value
+    return (
+        lines.order_by("journal_entry__posted_version", "id")
+        .annotate(
+            debit_cents=Cast(Round(F("debit_amount") * 100), BigIntegerField()),
+            credit_cents=Cast(Round(F("credit_amount") * 100), BigIntegerField()),
+        )
+        .values_list(*(field for _, _, field in LEDGER_COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def new_columns():
+    return {name: column() for name, column, _ in LEDGER_COLUMNS}
+
+
+def export_ledger(
+    directory, incremental=False, rows_per_file=ROWS_PER_FILE, chunk_size=CHUNK_SIZE
+):
+    """
+    Write the posted journal lines as columnar .npz files in ``directory``.
+
+    Rows are streamed through a server-side cursor and buffered as typed
+    columns of at most ``rows_per_file`` rows, so memory stays bounded.
+    manifest.json records the files and the ledger version exported up to;
+    with ``incremental`` only entries posted since are exported, otherwise
+    (or when the manifest has no version) the previous files are replaced.
+    Returns the new manifest parts.
+    """
+    from .posting import ledger_version
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(directory)
+    if not incremental or manifest.get("last_version") is None:
+        for part in manifest["parts"]:
+            (directory / part["file"]).unlink(missing_ok=True)
+        manifest = {"last_version": None, "parts": []}
+    version = ledger_version()
+
+    parts = []
+
+    def flush(columns):
+        name = f"ledger-{len(manifest['parts']) + len(parts) + 1:05d}.npz"
+        write_npz(directory / name, columns)
+        ids = columns["id"].values
+        parts.append(
+            {"file": name, "rows": len(ids), "first_id": ids[0], "last_id": ids[-1]}
+        )
+
+    rows = export_lines(manifest["last_version"], version, chunk_size)
+    columns = new_columns()
+    while True:
+        space = rows_per_file - len(columns["id"])
+        batch = list(islice(rows, min(chunk_size, space)))
+        if not batch:
+            break
+        # Transpose the fetched rows once and extend every column with its part
+        for column, values in zip(columns.values(), zip(*batch)):
+            column.extend(values)
+        if len(columns["id"]) >= rows_per_file:
+            flush(columns)
+            columns = new_columns()
+    if len(columns["id"]):
+        flush(columns)
+
+    manifest["parts"] += parts
+    manifest["last_version"] = version
+    manifest["columns"] = [name for name, _, _ in LEDGER_COLUMNS]
+    (directory / MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return parts
@@ -0,0 +1,144 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+from .posting import ZERO, balance_delta, bump_ledger_version
+
+
+def account_ranges(parts):
+    """Split the accounts into ``parts`` (first id, last id) ranges"""
+    from .models import Account
+
+    ids = list(Account.objects.order_by("id").values_list("id", flat=True))
+    size = max(1, -(-len(ids) // max(1, parts)))
+    return [
+        (ids[i], ids[min(i + size, len(ids)) - 1]) for i in range(0, len(ids), size)
+    ]
+
+
+def posted_balances(**lookup):
+    """{account_id: balance} recomputed from posted lines matching ``lookup``"""
+    from .models import JournalEntryLine
+
+    totals = (
+        JournalEntryLine.objects.filter(journal_entry__status="posted", **lookup)
+        .values("account_id", "account__account_type__type")
+        .annotate(
+            debits=Coalesce(Sum("debit_amount"), ZERO),
+            credits=Coalesce(Sum("credit_amount"), ZERO),
+        )
+        .order_by()
+    )
+    return {
+        row["account_id"]: balance_delta(
+            row["account__account_type__type"], row["debits"], row["credits"]
+        )
+        for row in totals
+    }
+
+
+def setup_worker():
+    """Process pool initializer for start methods that do not fork"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def verify_range(bounds):
+    """
+    Drift of the accounts with ids in ``bounds``.
+
+    Runs in a worker process: one grouped query over the range's lines, one
+    over its accounts. Returns (accounts checked, [(id, code, name, stored,
+    expected)]).
+    """
+    from .models import Account
+
+    expected = posted_balances(account__id__range=bounds)
+    accounts = (
+        Account.objects.filter(id__range=bounds)
+        .order_by("id")
+        .values_list("id", "code", "name", "current_balance")
+    )
+    drift = []
+    checked = 0
+    for account_id, code, name, stored in accounts:
+        checked += 1
+        balance = expected.get(account_id, ZERO.value)
+        if stored != balance:
+            drift.append((account_id, code, name, stored, balance))
+    return checked, drift
+
+
+def unbalanced_entries():
+    """Posted entries whose debits differ from their credits, one HAVING query"""
+    from .models import JournalEntryLine
+
+    return (
+        JournalEntryLine.objects.filter(journal_entry__status="posted")
+        .values("journal_entry_id", entry_number=F("journal_entry__entry_number"))
+        .annotate(
+            debits=Coalesce(Sum("debit_amount"), ZERO),
+            credits=Coalesce(Sum("credit_amount"), ZERO),
+        )
+        .exclude(debits=F("credits"))
+        .order_by("journal_entry_id")
+    )
+
+
+def verify_balances(workers=None):
+    """
+    Recompute every account's balance and compare it with current_balance.
+
+    Account id ranges are spread over a pool of ``workers`` processes (the
+    CPU count by default); with a single worker everything runs in this
+    process. Returns (accounts checked, drift rows sorted by account id).
+    """
+    workers = workers or os.cpu_count() or 1
+    # A few ranges per worker so one busy range does not hold up the rest
+    ranges = account_ranges(workers * 4 if workers > 1 else 1)
+    if workers == 1:
+        results = [verify_range(bounds) for bounds in ranges]
+    else:
+        # Workers must open connections of their own rather than share ours
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=setup_worker) as pool:
+            results = list(pool.map(verify_range, ranges))
+
+    checked = sum(count for count, _ in results)
+    drift = sorted((row for _, rows in results for row in rows), key=lambda r: r[0])
+    return checked, drift
+
+
+def rebuild_balances(account_ids):
+    """
+    Rewrite current_balance of ``account_ids`` from their posted lines.
+
+    The accounts are locked in id order like post_many does and recomputed
+    under the lock, so postings made since the check are not lost; all of
+    them are written with one bulk update. Returns the number rewritten.
+    """
+    from .models import Account
+
+    with transaction.atomic():
+        accounts = list(
+            Account.objects.select_for_update()
+            .filter(id__in=account_ids)
+            .order_by("id")
+        )
+        expected = posted_balances(account__in=[a.id for a in accounts])
+        changed = []
+        for account in accounts:
+            balance = expected.get(account.id, ZERO.value)
+            if account.current_balance != balance:
+                account.current_balance = balance
+                changed.append(account)
+        Account.objects.bulk_update(changed, ["current_balance"], batch_size=500)
+        if changed:
+            bump_ledger_version()
+    return len(changed)
@@ -0,0 +1,190 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import credit
+from .counters import apply_changes, party_totals
+from .posting_queue import enqueue_many
+from .posting_rules import POSTING_RULES, get_rule
+from .sequences import next_numbers
+
+# Days between the invoice date and the due date of invoiced orders
+PAYMENT_TERMS = 30
+
+# Orders invoiced per transaction
+BATCH_SIZE = 1000
+
+ORDER_FIELDS = (
+    "id",
+    "user_id",
+    "order_number",
+    "shipping_amount",
+    "tax_amount",
+    "discount_amount",
+)
+
+
+class InvoicingError(Exception):
+    pass
+
+
+def uninvoiced_orders(after=0):
+    """
+    Completed orders without an invoice and with an id above ``after``.
+
+    Guest orders have no customer to invoice and are left out.
+    """
+    from shop.models import Order
+
+    from .models import Invoice
+
+    return (
+        Order.objects.filter(
+            ~Exists(Invoice.objects.filter(order=OuterRef("pk"))),
+            status=POSTING_RULES["order"]["status"],
+            user__isnull=False,
+            id__gt=after,
+        )
+        .order_by("id")
+        .only(*ORDER_FIELDS)
+    )
+
+
+def customer_accounts(user_ids, accounts):
+    """
+    {user_id: (customer id, revenue account id)} for the users of a batch.
+
+    Users without accounting record get one on the default receivable
+    account; customers without a revenue account use the default one.
+    """
+    from .models import Customer
+
+    def load():
+        return {
+            user_id: (customer_id, revenue_id or accounts.get("revenue"))
+            for user_id, customer_id, revenue_id in Customer.objects.filter(
+                user_id__in=user_ids
+            ).values_list("user_id", "id", "revenue_account_id")
+        }
+
+    found = load()
+    missing = set(user_ids) - set(found)
+    if missing:
+        if "receivable" not in accounts:
+            raise InvoicingError("missing receivable account")
+        Customer.objects.bulk_create(
+            (
+                Customer(user_id=user_id, receivable_account_id=accounts["receivable"])
+                for user_id in missing
+            ),
+            ignore_conflicts=True,
+        )
+        found = load()
+    return found
+
+
+def order_lines(order_ids):
+    """{order_id: [(description, quantity, unit price)]} of the order items"""
+    from shop.models import OrderItem
+
+    lines = defaultdict(list)
+    items = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .order_by("id")
+        .values_list("order_id", "product_name", "variation_name", "quantity", "price")
+    )
+    for order_id, name, variation, quantity, price in items:
+        description = f"{name} ({variation})" if variation else name
+        lines[order_id].append((description[:255], quantity, price))
+    return lines
+
+
+def invoice_batch(orders, accounts, day, user):
+    """
+    Invoice a batch of orders: build everything in memory, then write the
+    invoices and their lines with one bulk_create each, move the customer
+    counters and credit exposure and queue the journal entries with one
+    upsert each. Returns the number of lines written.
+    """
+    from .models import Invoice, InvoiceLine
+
+    customers = customer_accounts({order.user_id for order in orders}, accounts)
+    items = order_lines([order.id for order in orders])
+    numbers = next_numbers("invoice", len(orders), day)
+    invoices, invoice_lines = [], []
+    for order, number in zip(orders, numbers):
+        customer_id, revenue_id = customers[order.user_id]
+        if revenue_id is None:
+            raise InvoicingError("missing revenue account")
+        lines = list(items.get(order.id, ()))
+        if order.shipping_amount:
+            lines.append(("Shipping", 1, order.shipping_amount))
+        if order.discount_amount:
+            lines.append(("Discount", -1, order.discount_amount))
+        invoices.append(
+            Invoice(
+                customer_id=customer_id,
+                order_id=order.id,
+                invoice_number=number,
+                reference=order.order_number,
+                invoice_date=day,
+                due_date=day + timedelta(days=PAYMENT_TERMS),
+                amount=sum(quantity * price for _, quantity, price in lines),
+                tax_amount=order.tax_amount,
+                status=POSTING_RULES["invoice"]["status"],
+                created_by=user,
+            )
+        )
+        invoice_lines.append([(revenue_id, *line) for line in lines])
+
+    with credit.tracking([order.id for order in orders]):
+        Invoice.objects.bulk_create(invoices)
+    InvoiceLine.objects.bulk_create(
+        (
+            InvoiceLine(
+                invoice_id=invoice.id,
+                account_id=account_id,
+                description=description,
+                quantity=quantity,
+                unit_price=price,
+            )
+            for invoice, lines in zip(invoices, invoice_lines)
+            for account_id, description, quantity, price in lines
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    invoice_ids = [invoice.id for invoice in invoices]
+    apply_changes("receivables", {}, party_totals("receivables", invoice_ids))
+    enqueue_many("invoice", invoice_ids)
+    return sum(len(lines) for lines in invoice_lines)
+
+
+def invoice_orders(day=None, user=None, batch_size=BATCH_SIZE):
+    """
+    Invoice every completed order that has no invoice yet.
+
+    Orders are walked by id in batches of ``batch_size``, each invoiced in
+    its own transaction; rows another run holds locked are skipped, so
+    concurrent runs do not invoice an order twice. Invoices are dated
+    ``day`` (today by default) and posted by the posting worker.
+    Returns {"invoices": ..., "lines": ...}.
+    """
+    day = day or timezone.localdate()
+    accounts = get_rule("invoice")["accounts"]
+    stats = {"invoices": 0, "lines": 0}
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            orders = list(
+                uninvoiced_orders(last_id).select_for_update(skip_locked=True)[
+                    :batch_size
+                ]
+            )
+            if not orders:
+                return stats
+            stats["lines"] += invoice_batch(orders, accounts, day, user)
+        stats["invoices"] += len(orders)
+        last_id = orders[-1].id
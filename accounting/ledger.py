@@ -0,0 +1,344 @@
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db.models import (
+    Count,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    RowRange,
+    Subquery,
+    Sum,
+    Window,
+)
+from django.db.models.functions import Coalesce
+
+from .posting import DEBIT_BALANCE_TYPES, ZERO, balance_delta, ledger_version
+
+# Old versions' entries just expire; a new posting changes the key
+DASHBOARD_CACHE_TIMEOUT = 60 * 60
+
+ACCOUNT_FIELDS = {
+    "code": F("account__code"),
+    "name": F("account__name"),
+    "parent_id": F("account__parent_id"),
+    "type": F("account__account_type__type"),
+    "type_name": F("account__account_type__name"),
+}
+
+
+def finish_row(row):
+    """Add the trial balance debit/credit columns for a row's balance."""
+    balance = row["balance"]
+    if (balance >= 0) == (row["type"] in DEBIT_BALANCE_TYPES):
+        row["debit_amount"], row["credit_amount"] = abs(balance), 0
+    else:
+        row["debit_amount"], row["credit_amount"] = 0, abs(balance)
+    return row
+
+
+def account_totals(
+    start_date=None,
+    end_date=None,
+    statuses=("posted",),
+    types=None,
+    posted_after=None,
+    posted_through=None,
+):
+    """
+    Debit and credit totals per account with one grouped query.
+
+    Lines are filtered by their journal entry date and status and grouped
+    per account together with its code, name and type, so callers never
+    touch Account or AccountType rows individually. Each row is a dict with
+    ``debit_total``, ``credit_total``, the signed ``balance`` movement and
+    ``debit_amount``/``credit_amount`` trial balance columns, ordered by code.
+    ``posted_after`` and ``posted_through`` limit the totals to entries
+    posted within that range of ledger versions.
+    """
+    from .models import JournalEntryLine
+
+    lines = JournalEntryLine.objects.filter(journal_entry__status__in=statuses)
+    if start_date:
+        lines = lines.filter(journal_entry__date__gte=start_date)
+    if end_date:
+        lines = lines.filter(journal_entry__date__lte=end_date)
+    if types:
+        lines = lines.filter(account__account_type__type__in=types)
+    if posted_after is not None:
+        lines = lines.filter(journal_entry__posted_version__gt=posted_after)
+    if posted_through is not None:
+        lines = lines.filter(journal_entry__posted_version__lte=posted_through)
+
+    rows = (
+        lines.values("account_id", **ACCOUNT_FIELDS)
+        .annotate(
+            debit_total=Coalesce(Sum("debit_amount"), ZERO),
+            credit_total=Coalesce(Sum("credit_amount"), ZERO),
+        )
+        .order_by("code")
+    )
+
+    result = []
+    for row in rows:
+        row["balance"] = balance_delta(
+            row["type"], row["debit_total"], row["credit_total"]
+        )
+        result.append(finish_row(row))
+    return result
+
+
+def account_balances(as_of_date, types=None, posted_through=None):
+    """
+    Posted balance of every active account at the end of ``as_of_date``.
+
+    Built on ``balances_as_of`` (nearest snapshot plus the lines after it),
+    so reports agree with the balance views; accounts without lines are
+    listed with a zero balance. ``posted_through`` takes back whatever was
+    posted after that ledger version.
+    """
+    from .balances import balances_as_of
+    from .models import Account
+
+    accounts = Account.objects.filter(is_active=True)
+    if types:
+        accounts = accounts.filter(account_type__type__in=types)
+
+    rows = {}
+    for row in balances_as_of(as_of_date, accounts).values(
+        "id",
+        "code",
+        "name",
+        "parent_id",
+        "balance",
+        type=F("account_type__type"),
+        type_name=F("account_type__name"),
+    ):
+        row["account_id"] = row.pop("id")
+        rows[row["account_id"]] = row
+
+    if posted_through is not None:
+        for row in account_totals(
+            end_date=as_of_date, types=types, posted_after=posted_through
+        ):
+            if row["account_id"] in rows:
+                rows[row["account_id"]]["balance"] -= row["balance"]
+
+    return [finish_row(row) for row in sorted(rows.values(), key=lambda r: r["code"])]
+
+
+def subtree_of(code):
+    """Q matching the account with ``code`` and every account below it"""
+    return Q(path__startswith=f"{code}/") | Q(path__contains=f"/{code}/")
+
+
+def dashboard_kpis():
+    """
+    Dashboard figures from one conditional aggregation over active accounts.
+
+    Receivables and payables are the subtrees of the accounts the posting
+    rules use for those roles. Results are cached per ledger version, which
+    every posting bumps, so repeated dashboard hits between postings never
+    touch the accounts table.
+    """
+    from .models import Account
+    from .posting_rules import POSTING_RULES
+
+    key = f"accounting:dashboard:{ledger_version()}"
+    kpis = cache.get(key)
+    if kpis is not None:
+        return kpis
+
+    def total(condition):
+        return Coalesce(Sum("current_balance", filter=condition), ZERO)
+
+    def of_type(account_type):
+        return Q(account_type__type=account_type)
+
+    kpis = Account.objects.filter(is_active=True).aggregate(
+        accounts_count=Count("id"),
+        receivable_balance=total(
+            of_type("asset")
+            & subtree_of(POSTING_RULES["invoice"]["accounts"]["receivable"])
+        ),
+        payable_balance=total(
+            of_type("liability")
+            & subtree_of(POSTING_RULES["bill"]["accounts"]["payable"])
+        ),
+        total_assets=total(of_type("asset")),
+        total_liabilities=total(of_type("liability")),
+        total_equity=total(of_type("equity")),
+        total_revenue=total(of_type("revenue")),
+        total_expenses=total(of_type("expense")),
+    )
+    kpis["profit_loss"] = kpis["total_revenue"] - kpis["total_expenses"]
+    cache.set(key, kpis, DASHBOARD_CACHE_TIMEOUT)
+    return kpis
+
+
+def encode_cursor(line_date, line_id):
+    return f"{line_date.isoformat()}.{line_id}"
+
+
+def decode_cursor(value):
+    """(date, line id) from a ledger cursor; ValueError if malformed"""
+    line_date, line_id = value.split(".", 1)
+    return date.fromisoformat(line_date), int(line_id)
+
+
+def position_balance(account, delta, line_date, line_id, through):
+    """
+    Posted balance of ``account`` at a keyset position: its balance at the
+    end of the day before ``line_date`` plus that day's lines before
+    ``line_id``, or up to and including it if ``through``.
+
+    One query, starting from the nearest AccountBalance snapshot and summing
+    the lines after it on the (account, entry_date, id) index.
+    """
+    from .balances import balances_as_of
+    from .models import Account, JournalEntryLine
+
+    same_day = (
+        JournalEntryLine.objects.filter(
+            account=OuterRef("pk"),
+            journal_entry__status="posted",
+            entry_date=line_date,
+            **{"id__lte" if through else "id__lt": line_id},
+        )
+        .values("account")
+        .annotate(net=Sum(delta))
+        .values("net")
+    )
+    return (
+        balances_as_of(
+            line_date - timedelta(days=1), Account.objects.filter(pk=account.pk)
+        )
+        .annotate(
+            position=F("balance")
+            + Coalesce(Subquery(same_day, output_field=ZERO.output_field), ZERO)
+        )
+        .values_list("position", flat=True)
+        .get()
+    )
+
+
+def posted_lines(account, start_date=None, end_date=None):
+    """An account's posted lines dated within the range"""
+    from .models import JournalEntryLine
+
+    lines = JournalEntryLine.objects.filter(
+        account=account, journal_entry__status="posted"
+    )
+    if start_date:
+        lines = lines.filter(entry_date__gte=start_date)
+    if end_date:
+        lines = lines.filter(entry_date__lte=end_date)
+    return lines
+
+
+def range_totals(account, start_date=None, end_date=None):
+    """
+    Debit and credit totals of an account's posted lines within the range,
+    however many pages account_ledger() splits them into; one aggregate.
+    """
+    return posted_lines(account, start_date, end_date).aggregate(
+        debit_total=Coalesce(Sum("debit_amount"), ZERO),
+        credit_total=Coalesce(Sum("credit_amount"), ZERO),
+    )
+
+
+def account_ledger(
+    account, start_date=None, end_date=None, after=None, before=None, page_size=50
+):
+    """
+    One page of an account's posted lines with a running balance.
+
+    Lines are ordered by (entry_date, id) and the running balance comes from
+    a ``SUM(...) OVER (ORDER BY entry_date, id)`` window on top of the
+    balance at the cursor's position, which position_balance() works out
+    from the ledger, so every page is an index seek on (account, entry_date,
+    id) followed by ``page_size`` rows, however deep it is. ``after`` and
+    ``before`` are cursors returned by a previous call; they only hold the
+    position.
+
+    Returns a dict with ``opening_balance`` (balance before ``start_date``),
+    ``lines`` annotated with ``running_balance`` and the ``next_cursor`` and
+    ``previous_cursor`` of the neighbouring pages, or None at either end.
+    """
+    from .balances import balances_as_of
+    from .models import Account
+
+    if account.account_type.type in DEBIT_BALANCE_TYPES:
+        delta = F("debit_amount") - F("credit_amount")
+    else:
+        delta = F("credit_amount") - F("debit_amount")
+    delta = ExpressionWrapper(delta, output_field=ZERO.output_field)
+
+    opening_balance = ZERO.value
+    if start_date:
+        opening_balance = (
+            balances_as_of(
+                start_date - timedelta(days=1), Account.objects.filter(pk=account.pk)
+            )
+            .values_list("balance", flat=True)
+            .get()
+        )
+
+    lines = posted_lines(account, start_date, end_date)
+    backwards = before is not None
+    if backwards:
+        cursor_date, cursor_id = decode_cursor(before)
+        lines = lines.filter(
+            Q(entry_date__lt=cursor_date) | Q(entry_date=cursor_date, id__lt=cursor_id)
+        )
+        base = position_balance(account, delta, cursor_date, cursor_id, False)
+        ordering = [F("entry_date").desc(), F("id").desc()]
+    else:
+        base = opening_balance
+        if after is not None:
+            cursor_date, cursor_id = decode_cursor(after)
+            lines = lines.filter(
+                Q(entry_date__gt=cursor_date)
+                | Q(entry_date=cursor_date, id__gt=cursor_id)
+            )
+            base = position_balance(account, delta, cursor_date, cursor_id, True)
+        ordering = [F("entry_date").asc(), F("id").asc()]
+
+    page = list(
+        lines.select_related("journal_entry")
+        .annotate(
+            delta=delta,
+            cumulative=Window(
+                Sum(delta), order_by=ordering, frame=RowRange(start=None, end=0)
+            ),
+        )
+        .order_by(*ordering)[: page_size + 1]
+    )
+    has_more = len(page) > page_size
+    page = page[:page_size]
+
+    for line in page:
+        if backwards:
+            # Walking back from the cursor, each line's balance excludes
+            # the lines after it
+            line.running_balance = base - line.cumulative + line.delta
+        else:
+            line.running_balance = base + line.cumulative
+    if backwards:
+        page.reverse()
+
+    next_cursor = previous_cursor = None
+    if page:
+        first, last = page[0], page[-1]
+        if backwards or has_more:
+            next_cursor = encode_cursor(last.entry_date, last.id)
+        if after is not None or (backwards and has_more):
+            previous_cursor = encode_cursor(first.entry_date, first.id)
+
+    return {
+        "opening_balance": opening_balance,
+        "lines": page,
+        "next_cursor": next_cursor,
+        "previous_cursor": previous_cursor,
+    }
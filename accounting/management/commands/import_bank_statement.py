@@ -0,0 +1,113 @@
+import csv
+import time
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.payments import CENT, import_transactions, read_camt, read_csv
+from accounts.models import CustomUser
+
+UNMATCHED_COLUMNS = ("line", "date", "amount", "id", "reference", "text", "reason")
+
+
+class Command(BaseCommand):
+    help = (
+        "Match the transactions of a bank statement (CSV or camt.053-like "
+        "JSON) to open invoices and bills and record them as payments. "
+        "Money in pays invoices, money out pays bills."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSON bank statement")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "json"],
+            help="Statement format (defaults to the file extension)",
+        )
+        parser.add_argument(
+            "--tolerance",
+            default=str(CENT),
+            help="Largest difference between a transaction and the open "
+            "amount of the document it is matched to by amount",
+        )
+        parser.add_argument(
+            "--unmatched",
+            help="Where to write unmatched transactions "
+            "(defaults to <path>.unmatched.csv)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Match and report without recording any payment",
+        )
+        parser.add_argument("--user", help="Email of the user recorded as creator")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"{path} does not exist")
+
+        file_format = options["format"] or path.suffix.lstrip(".").lower()
+        readers = {"csv": read_csv, "json": read_camt}
+        if file_format not in readers:
+            raise CommandError("Use --format to choose between csv and json")
+
+        try:
+            tolerance = Decimal(options["tolerance"])
+        except InvalidOperation:
+            raise CommandError(f"Invalid tolerance {options['tolerance']!r}")
+
+        user = None
+        if options["user"]:
+            try:
+                user = CustomUser.objects.get(email=options["user"])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']}")
+
+        started = time.perf_counter()
+        transactions, unmatched = [], []
+        for row in readers[file_format](path):
+            if "error" in row:
+                unmatched.append(
+                    {"line": row["line"], "reason": row["error"], **row["raw"]}
+                )
+            else:
+                transactions.append(row)
+
+        stats, no_match = import_transactions(
+            transactions, tolerance, user, options["dry_run"]
+        )
+        unmatched += no_match
+        elapsed = time.perf_counter() - started
+        rate = stats["transactions"] / elapsed if elapsed else 0
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Matched {stats['matched']} of {stats['transactions']} transactions "
+                f"({stats['reference']} by reference, {stats['amount']} by amount) "
+                f"in {elapsed:.2f}s ({rate:,.0f} transactions/s)"
+            )
+        )
+        documents = stats["documents"]
+        self.stdout.write(
+            f"{'Would pay' if options['dry_run'] else 'Paid'} "
+            f"{documents.get('receivables', 0)} invoices and "
+            f"{documents.get('payables', 0)} bills; "
+            f"skipped {stats['duplicates']} already imported"
+        )
+
+        unmatched_path = Path(options["unmatched"] or f"{path}.unmatched.csv")
+        if unmatched:
+            with open(unmatched_path, "w", newline="", encoding="utf-8") as handle:
+                writer = csv.writer(handle)
+                writer.writerow(UNMATCHED_COLUMNS)
+                for row in unmatched:
+                    writer.writerow(
+                        [row.get(column, "") for column in UNMATCHED_COLUMNS]
+                    )
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{len(unmatched)} transactions unmatched, see {unmatched_path}"
+                )
+            )
@@ -0,0 +1,326 @@
+import csv
+import json
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounting.models import (
+    Account,
+    FiscalYear,
+    Journal,
+    JournalEntry,
+    JournalEntryLine,
+)
+from accounting.posting import post_many
+from accounts.models import CustomUser
+
+CENT = Decimal("0.01")
+
+# Columns read for every line; entry-level columns come from the entry's first line
+COLUMNS = (
+    "entry_number",
+    "date",
+    "journal",
+    "description",
+    "reference",
+    "account",
+    "line_description",
+    "debit",
+    "credit",
+)
+
+
+# Rows per INSERT of bulk_create, and entry numbers per lookup; both stay
+# below SQLite's default limit on query parameters
+INSERT_BATCH = 500
+LOOKUP_CHUNK = 900
+
+
+class RejectedEntry(Exception):
+    pass
+
+
+def existing_numbers(numbers):
+    """The given entry numbers that already exist"""
+    existing = set()
+    for start in range(0, len(numbers), LOOKUP_CHUNK):
+        existing.update(
+            JournalEntry.objects.filter(
+                entry_number__in=numbers[start : start + LOOKUP_CHUNK]
+            ).values_list("entry_number", flat=True)
+        )
+    return existing
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as handle:
+        yield from csv.DictReader(handle)
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_amount(value):
+    if value in (None, ""):
+        return Decimal("0.00")
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise RejectedEntry(f"invalid amount {value!r}")
+    if amount < 0 or amount != amount.quantize(CENT):
+        raise RejectedEntry(f"invalid amount {value!r}")
+    return amount.quantize(CENT)
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream journal lines from a CSV or JSONL file, group them into "
+        "journal entries and bulk insert them in batched transactions. "
+        "Lines of one entry must be contiguous and share an entry_number."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", help="CSV or JSONL file with one journal line per row"
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Input format (defaults to the file extension)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=20000,
+            help="Number of lines written per transaction",
+        )
+        parser.add_argument(
+            "--rejects",
+            help="Where to write rejected lines (defaults to <path>.rejects.csv)",
+        )
+        parser.add_argument(
+            "--post",
+            action="store_true",
+            help="Post the imported entries and update account balances",
+        )
+        parser.add_argument("--user", help="Email of the user recorded as creator")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"{path} does not exist")
+
+        file_format = options["format"] or path.suffix.lstrip(".").lower()
+        readers = {"csv": read_csv, "jsonl": read_jsonl, "json": read_jsonl}
+        if file_format not in readers:
+            raise CommandError("Use --format to choose between csv and jsonl")
+
+        self.user = None
+        if options["user"]:
+            try:
+                self.user = CustomUser.objects.get(email=options["user"])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']}")
+
+        self.post = options["post"]
+        self.batch_size = options["batch_size"]
+        self.verbosity = options["verbosity"]
+
+        # Everything lines refer to is resolved from in-memory maps
+        self.accounts = dict(Account.objects.values_list("code", "id"))
+        self.journals = dict(Journal.objects.values_list("code", "id"))
+        self.fiscal_years = list(
+            FiscalYear.objects.values_list("start_date", "end_date", "id")
+        )
+        self.fiscal_year_cache = {}
+
+        rejects_path = Path(options["rejects"] or f"{path}.rejects.csv")
+        self.stats = {
+            "lines": 0,
+            "entries": 0,
+            "rejected_lines": 0,
+            "rejected_entries": 0,
+        }
+        started = time.perf_counter()
+
+        with open(rejects_path, "w", newline="", encoding="utf-8") as rejects:
+            self.rejects = csv.writer(rejects)
+            self.rejects.writerow([*COLUMNS, "error"])
+            self.import_rows(readers[file_format](path))
+
+        elapsed = time.perf_counter() - started
+        rate = self.stats["lines"] / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {self.stats['entries']} entries / {self.stats['lines']} lines "
+                f"in {elapsed:.2f}s ({rate:,.0f} lines/s)"
+            )
+        )
+        if self.stats["rejected_entries"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Rejected {self.stats['rejected_entries']} entries / "
+                    f"{self.stats['rejected_lines']} lines, see {rejects_path}"
+                )
+            )
+        elif rejects_path.exists():
+            rejects_path.unlink()
+
+    def import_rows(self, rows):
+        batch = []
+        batch_lines = 0
+        seen = set()
+        current = []
+
+        def close_entry():
+            nonlocal batch_lines
+            if not current:
+                return
+            number = current[0].get("entry_number")
+            if number in seen:
+                self.reject(current, "entry_number is not contiguous in the file")
+            else:
+                seen.add(number)
+                built = self.build_entry(current)
+                if built:
+                    batch.append((*built, list(current)))
+                    batch_lines += len(current)
+            current.clear()
+
+        for row in rows:
+            if current and row.get("entry_number") != current[0].get("entry_number"):
+                close_entry()
+                if batch_lines >= self.batch_size:
+                    self.flush(batch)
+                    # Numbers of earlier batches are found in the database
+                    batch, batch_lines = [], 0
+                    seen.clear()
+            current.append(row)
+
+        close_entry()
+        if batch:
+            self.flush(batch)
+
+    def build_entry(self, rows):
+        """Validate one entry's rows, returning (entry fields, [line fields])"""
+        head = rows[0]
+        try:
+            if not head.get("entry_number"):
+                raise RejectedEntry("missing entry_number")
+            try:
+                entry_date = date.fromisoformat(str(head.get("date")))
+            except ValueError:
+                raise RejectedEntry(f"invalid date {head.get('date')!r}")
+            journal_id = self.journals.get(head.get("journal"))
+            if journal_id is None:
+                raise RejectedEntry(f"unknown journal {head.get('journal')!r}")
+            fiscal_year_id = self.fiscal_year_for(entry_date)
+            if fiscal_year_id is None:
+                raise RejectedEntry(f"no fiscal year covers {entry_date}")
+
+            lines = []
+            debits = credits = Decimal("0.00")
+            for row in rows:
+                account_id = self.accounts.get(row.get("account"))
+                if account_id is None:
+                    raise RejectedEntry(f"unknown account {row.get('account')!r}")
+                debit = parse_amount(row.get("debit"))
+                credit = parse_amount(row.get("credit"))
+                if (debit > 0) == (credit > 0):
+                    raise RejectedEntry("each line needs either a debit or a credit")
+                debits += debit
+                credits += credit
+                lines.append(
+                    {
+                        "account_id": account_id,
+                        "description": row.get("line_description") or None,
+                        "debit_amount": debit,
+                        "credit_amount": credit,
+                        "entry_date": entry_date,
+                    }
+                )
+
+            if debits != credits:
+                raise RejectedEntry(f"unbalanced: debits {debits} != credits {credits}")
+        except RejectedEntry as exc:
+            self.reject(rows, str(exc))
+            return None
+
+        entry = {
+            "journal_id": journal_id,
+            "fiscal_year_id": fiscal_year_id,
+            "entry_number": head["entry_number"],
+            "date": entry_date,
+            "description": head.get("description") or "",
+            "reference": head.get("reference") or None,
+            "status": "draft",
+            "created_by": self.user,
+        }
+        return entry, lines
+
+    def fiscal_year_for(self, day):
+        if day not in self.fiscal_year_cache:
+            self.fiscal_year_cache[day] = next(
+                (fy for start, end, fy in self.fiscal_years if start <= day <= end),
+                None,
+            )
+        return self.fiscal_year_cache[day]
+
+    def flush(self, batch):
+        numbers = [entry["entry_number"] for entry, _, _ in batch]
+        existing = existing_numbers(numbers)
+        if existing:
+            for entry, _, rows in batch:
+                if entry["entry_number"] in existing:
+                    self.reject(rows, "entry_number already exists")
+            batch = [item for item in batch if item[0]["entry_number"] not in existing]
+        if not batch:
+            return
+
+        try:
+            with transaction.atomic():
+                self.stats["lines"] += self.write(batch)
+            self.stats["entries"] += len(batch)
+        except ValueError:
+            # Posting refused an entry, e.g. one dated in a closed period, and
+            # the batch was rolled back: write it again entry by entry and
+            # reject just the entries that fail
+            for item in batch:
+                try:
+                    with transaction.atomic():
+                        self.stats["lines"] += self.write([item])
+                    self.stats["entries"] += 1
+                except ValueError as exc:
+                    self.reject(item[2], str(exc))
+        if self.verbosity > 1:
+            self.stdout.write(f"  {self.stats['lines']} lines written")
+
+    def write(self, batch):
+        """Insert (and with --post, post) entries; returns the lines written"""
+        entries = [JournalEntry(**entry) for entry, _, _ in batch]
+        JournalEntry.objects.bulk_create(entries, batch_size=INSERT_BATCH)
+        lines = JournalEntryLine.objects.bulk_create(
+            [
+                JournalEntryLine(journal_entry=entry, **line)
+                for entry, (_, entry_lines, _) in zip(entries, batch)
+                for line in entry_lines
+            ],
+            batch_size=INSERT_BATCH,
+        )
+        if self.post:
+            post_many(entries, self.user)
+        return len(lines)
+
+    def reject(self, rows, error):
+        for row in rows:
+            self.rejects.writerow([row.get(column, "") for column in COLUMNS] + [error])
+        self.stats["rejected_lines"] += len(rows)
+        self.stats["rejected_entries"] += 1
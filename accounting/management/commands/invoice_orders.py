@@ -0,0 +1,57 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.invoicing import BATCH_SIZE, InvoicingError, invoice_orders
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Invoice every completed order that has no invoice yet and queue "
+        "the invoices' journal entries for the posting worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date", help="Invoice date as YYYY-MM-DD (defaults to today)"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Number of orders invoiced per transaction",
+        )
+        parser.add_argument("--user", help="Email of the user recorded as creator")
+
+    def handle(self, *args, **options):
+        day = None
+        if options["date"]:
+            try:
+                day = date.fromisoformat(options["date"])
+            except ValueError:
+                raise CommandError(f"Invalid date {options['date']!r}")
+
+        user = None
+        if options["user"]:
+            try:
+                user = CustomUser.objects.get(email=options["user"])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']}")
+
+        started = time.perf_counter()
+        try:
+            stats = invoice_orders(day, user, options["batch_size"])
+        except InvoicingError as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+        rate = stats["invoices"] / elapsed if elapsed else 0
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Invoiced {stats['invoices']} orders ({stats['lines']} lines) "
+                f"in {elapsed:.2f}s ({rate:,.0f} orders/s); "
+                "their entries are queued for run_posting_worker"
+            )
+        )
@@ -0,0 +1,53 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.counters import COUNTERS, rebuild_counters, reset_ytd
+from accounting.credit import rebuild_exposure
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the balance and year-to-date counters of every customer "
+        "and vendor from their invoices and bills, and the open orders of "
+        "every user's credit exposure. Run with --ytd on the "
+        "first day of a fiscal year to start the year-to-date figures over."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ytd",
+            action="store_true",
+            help="Only reset the year-to-date counters",
+        )
+        parser.add_argument(
+            "--date",
+            help="Day whose fiscal year the year-to-date counters cover "
+            "as YYYY-MM-DD (defaults to today)",
+        )
+
+    def handle(self, *args, **options):
+        day = None
+        if options["date"]:
+            try:
+                day = date.fromisoformat(options["date"])
+            except ValueError:
+                raise CommandError(f"Invalid date {options['date']!r}")
+
+        started = time.perf_counter()
+        if options["ytd"]:
+            updated = reset_ytd(day)
+        else:
+            updated = sum(rebuild_counters(ledger, day=day) for ledger in COUNTERS)
+            exposed = rebuild_exposure()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Reset' if options['ytd'] else 'Rebuilt'} the counters of "
+                f"{updated} customers and vendors in {elapsed:.2f}s"
+            )
+        )
+        if not options["ytd"]:
+            self.stdout.write(f"{exposed} users have orders awaiting invoice")
@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounting.posting_queue import MAX_ATTEMPTS, process_batch, queue_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Drain the posting queue: write and post the journal entries of "
+        "queued orders, purchase orders, bills and invoices in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of jobs processed per transaction",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2.0,
+            help="Seconds to sleep when the queue is empty",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=MAX_ATTEMPTS,
+            help="Failed attempts before a job is dead-lettered",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no job is due instead of polling",
+        )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="Print queue depth and lag and exit",
+        )
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            self.report()
+            return
+
+        totals = {"done": 0, "failed": 0}
+        try:
+            while True:
+                result = process_batch(options["batch_size"], options["max_attempts"])
+                totals["done"] += result["done"]
+                totals["failed"] += result["failed"]
+                if result["done"] or result["failed"]:
+                    if options["verbosity"] > 1:
+                        self.stdout.write(
+                            f"  {result['done']} done, {result['failed']} failed"
+                        )
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {totals['done']} jobs, {totals['failed']} failed"
+            )
+        )
+        self.report()
+
+    def report(self):
+        stats = queue_stats()
+        self.stdout.write(
+            f"Queue depth {stats['depth']} ({stats['due']} due), "
+            f"lag {stats['lag_seconds']:.1f}s, dead-lettered {stats['failed']}"
+        )
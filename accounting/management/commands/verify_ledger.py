@@ -0,0 +1,64 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounting.integrity import rebuild_balances, unbalanced_entries, verify_balances
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every account balance from the posted journal lines, "
+        "report accounts whose current_balance drifted and posted entries "
+        "that do not balance. Use --fix to rewrite drifted balances."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of processes recomputing account id ranges",
+        )
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Rewrite the current_balance of drifted accounts",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=50,
+            help="Most drifted accounts and unbalanced entries listed",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        checked, drift = verify_balances(options["workers"])
+        unbalanced = list(unbalanced_entries())
+        elapsed = time.perf_counter() - started
+
+        limit = options["limit"]
+        for _, code, name, stored, expected in drift[:limit]:
+            self.stdout.write(
+                f"  {code} {name}: stored {stored:.2f}, posted {expected:.2f} "
+                f"(drift {stored - expected:.2f})"
+            )
+        for row in unbalanced[:limit]:
+            self.stdout.write(
+                f"  Entry {row['entry_number']}: debits {row['debits']:.2f} "
+                f"!= credits {row['credits']:.2f}"
+            )
+
+        summary = (
+            f"Checked {checked} accounts in {elapsed:.2f}s: "
+            f"{len(drift)} drifted, {len(unbalanced)} unbalanced entries"
+        )
+        if drift or unbalanced:
+            self.stdout.write(self.style.WARNING(summary))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+        if options["fix"] and drift:
+            fixed = rebuild_balances([row[0] for row in drift])
+            self.stdout.write(self.style.SUCCESS(f"Rewrote {fixed} account balances"))
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_end', models.DateField()),
+                ('debit_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('credit_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('closing_balance', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_balances', to='accounting.account')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='account_balances', to='accounting.financialperiod')),
+            ],
+            options={
+                'ordering': ['account', 'period_end'],
+                'indexes': [models.Index(fields=['account', 'period_end'], name='accounting__account_344849_idx')],
+                'unique_together': {('account', 'period')},
+            },
+        ),
+    ]
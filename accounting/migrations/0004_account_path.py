@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:10
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Account = apps.get_model("accounting", "Account")
+    accounts = {
+        account.pk: account
+        for account in Account.objects.only("code", "parent_id", "path", "depth")
+    }
+
+    def resolve(account):
+        if account.path:
+            return account
+        if account.parent_id:
+            parent = resolve(accounts[account.parent_id])
+            account.path = f"{parent.path}{account.code}/"
+            account.depth = parent.depth + 1
+        else:
+            account.path = f"{account.code}/"
+            account.depth = 0
+        return account
+
+    for account in accounts.values():
+        resolve(account)
+    Account.objects.bulk_update(accounts.values(), ["path", "depth"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0003_account_balance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
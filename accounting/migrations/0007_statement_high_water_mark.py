@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def stamp_posted_entries(apps, schema_editor):
+    # Entries posted before versions existed count as version 0
+    JournalEntry = apps.get_model("accounting", "JournalEntry")
+    JournalEntry.objects.filter(status="posted").update(posted_version=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0006_ledger_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='financialstatement',
+            name='high_water_mark',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='journalentry',
+            name='posted_version',
+            field=models.PositiveBigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(stamp_posted_entries, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='financialstatement',
+            index=models.Index(fields=['statement_type', 'fiscal_year', 'as_of_date'], name='accounting__stateme_296d2c_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0007_statement_high_water_mark'),
+        ('inventory', '0001_initial'),
+        ('shop', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['status', 'due_date'], name='accounting__status_e3eec5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'due_date'], name='accounting__status_24bfcd_idx'),
+        ),
+    ]
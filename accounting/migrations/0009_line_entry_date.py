@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:41
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_entry_dates(apps, schema_editor):
+    JournalEntry = apps.get_model("accounting", "JournalEntry")
+    JournalEntryLine = apps.get_model("accounting", "JournalEntryLine")
+    JournalEntryLine.objects.update(
+        entry_date=Subquery(
+            JournalEntry.objects.filter(pk=OuterRef("journal_entry_id")).values("date")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounting", "0008_aging_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="journalentryline",
+            name="entry_date",
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(copy_entry_dates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="journalentryline",
+            name="entry_date",
+            field=models.DateField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="journalentryline",
+            index=models.Index(
+                fields=["account", "entry_date", "id"],
+                name="accounting__account_c536d9_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounting", "0009_line_entry_date"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentSequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("next_value", models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="invoice",
+            name="invoice_number",
+            field=models.CharField(blank=True, max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="journalentry",
+            name="entry_number",
+            field=models.CharField(blank=True, max_length=50, unique=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounting", "0010_document_sequence"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="financialperiod",
+            index=models.Index(
+                fields=["status", "end_date"], name="accounting__status_2aa54d_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="fiscalyear",
+            index=models.Index(
+                fields=["is_closed", "end_date"], name="accounting__is_clos_b4f0a1_idx"
+            ),
+        ),
+    ]
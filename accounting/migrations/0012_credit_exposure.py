@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounting", "0011_closing_indexes"),
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CreditExposure",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="credit_exposure",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "open_orders",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=15),
+                ),
+            ],
+        ),
+    ]
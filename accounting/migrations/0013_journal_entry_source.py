@@ -0,0 +1,69 @@
+# Generated by Django 5.1.7 on 2026-10-17 11:31
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def link_sources(apps, schema_editor):
+    """
+    Link the entries the posting queue wrote, found by their reference, to
+    their documents. Bill numbers used by more than one vendor stay unlinked.
+    """
+    JournalEntry = apps.get_model("accounting", "JournalEntry")
+    Invoice = apps.get_model("accounting", "Invoice")
+    Bill = apps.get_model("accounting", "Bill")
+
+    entries = JournalEntry.objects.filter(entry_number=models.F("reference"))
+    entries.filter(reference__startswith="SO-", order__isnull=False).update(
+        source_type="order", source_id=models.F("order_id")
+    )
+    entries.filter(reference__startswith="PO-", purchase_order__isnull=False).update(
+        source_type="purchase_order", source_id=models.F("purchase_order_id")
+    )
+
+    invoices = dict(Invoice.objects.values_list("invoice_number", "id"))
+    bills = dict(Bill.objects.values_list("bill_number", "id"))
+    shared = {
+        number
+        for number, count in Counter(
+            Bill.objects.values_list("bill_number", flat=True)
+        ).items()
+        if count > 1
+    }
+    for entry in entries.filter(source_id__isnull=True).only("reference"):
+        prefix, _, number = entry.reference.partition("-")
+        if prefix == "INV" and number in invoices:
+            source = ("invoice", invoices[number])
+        elif prefix == "BILL" and number in bills and number not in shared:
+            source = ("bill", bills[number])
+        else:
+            continue
+        JournalEntry.objects.filter(pk=entry.pk).update(
+            source_type=source[0], source_id=source[1]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounting", "0012_credit_exposure"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="journalentry",
+            name="source_id",
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="journalentry",
+            name="source_type",
+            field=models.CharField(blank=True, default="", max_length=20),
+        ),
+        migrations.RunPython(link_sources, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="journalentry",
+            unique_together={("source_type", "source_id")},
+        ),
+    ]
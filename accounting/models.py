@@ -1,4 +1,19 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (
+    BooleanField,
+    Case,
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.conf import settings
@@ -7,6 +22,9 @@ from shop.models import Order
 from inventory.models import PurchaseOrder, Supplier
 from procurement.models import Vendor
 
+from .closing import close_fiscal_year, close_periods
+from .posting import DEBIT_BALANCE_TYPES, ZERO, post_many
+
 
 class FiscalYear(models.Model):
     name = models.CharField(max_length=100)
@@ -18,10 +36,15 @@ class FiscalYear(models.Model):
 
     class Meta:
         ordering = ["-start_date"]
+        indexes = [models.Index(fields=["is_closed", "end_date"])]
 
     def __str__(self):
         return self.name
 
+    def close(self, user, retained_earnings=None):
+        """Post the year-end closing entry and close every period of the year"""
+        return close_fiscal_year(self, user, retained_earnings)
+
     def save(self, *args, **kwargs):
         # Ensure only one active fiscal year
         if self.is_active:
@@ -48,6 +71,56 @@ class AccountType(models.Model):
         return f"{self.name} ({self.get_type_display()})"
 
 
+class AccountQuerySet(models.QuerySet):
+    def subtree(self, account):
+        """The account and all of its descendants"""
+        return self.filter(path__startswith=account.path)
+
+    def tree(self):
+        """Accounts in depth-first tree order, siblings ordered by code"""
+        return self.select_related("account_type").order_by("path")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._subtree_balance = False
+
+    def with_subtree_balance(self):
+        """
+        Set subtree_balance, own balance plus every descendant's, on the
+        accounts fetched.
+
+        The totals are summed in Python over one query of every account's
+        path and balance, rather than a correlated sum per account.
+        """
+        clone = self.annotate(child_count=Count("children"))
+        clone._subtree_balance = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._subtree_balance = self._subtree_balance
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super()._fetch_all()
+        if fetched or not self._subtree_balance:
+            return
+        if self._iterable_class is not models.query.ModelIterable:
+            return
+
+        # Each balance counts towards every prefix of its path
+        totals = {}
+        for path, balance in Account.objects.values_list("path", "current_balance"):
+            end = path.find("/")
+            while end != -1:
+                prefix = path[: end + 1]
+                totals[prefix] = totals.get(prefix, 0) + balance
+                end = path.find("/", end + 1)
+        for account in self._result_cache:
+            account.subtree_balance = totals.get(account.path, 0)
+
+
 class Account(models.Model):
     code = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=100)
@@ -65,24 +138,65 @@ class Account(models.Model):
     # Balance fields (calculated and cached)
     current_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
 
+    # Materialized path of ancestor codes, e.g. "1000/1200/1210/"
+    path = models.CharField(max_length=255, db_index=True, editable=False, default="")
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = AccountQuerySet.as_manager()
+
     class Meta:
         ordering = ["code"]
 
     def __str__(self):
         return f"{self.code} - {self.name}"
 
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        if self.parent_id:
+            parent = Account.objects.only("path", "depth").get(pk=self.parent_id)
+            if old_path and parent.path.startswith(old_path):
+                raise ValueError("An account cannot be moved below its own subtree")
+            self.path = f"{parent.path}{self.code}/"
+            self.depth = parent.depth + 1
+        else:
+            self.path = f"{self.code}/"
+            self.depth = 0
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # Re-root the whole subtree with one UPDATE after a move or code change
+            if old_path and old_path != self.path:
+                Account.objects.filter(path__startswith=old_path).exclude(
+                    pk=self.pk
+                ).update(
+                    path=Concat(Value(self.path), Substr("path", len(old_path) + 1)),
+                    depth=F("depth") + (self.depth - old_path.count("/") + 1),
+                )
+
     @property
     def is_debit_balance(self):
         """
         Determine if the account normally has a debit balance.
         Asset and Expense accounts normally have debit balances.
         """
-        return self.account_type.type in ["asset", "expense"]
+        return self.account_type.type in DEBIT_BALANCE_TYPES
 
     @property
     def has_children(self):
+        if hasattr(self, "child_count"):
+            return self.child_count > 0
         return self.children.exists()
 
+    @property
+    def balance_with_descendants(self):
+        """Current balance of the account and all of its sub-accounts"""
+        if hasattr(self, "subtree_balance"):
+            return self.subtree_balance
+        return Account.objects.subtree(self).aggregate(total=Sum("current_balance"))[
+            "total"
+        ]
+
 
 class Journal(models.Model):
     code = models.CharField(max_length=20, unique=True)
@@ -107,7 +221,7 @@ class JournalEntry(models.Model):
     fiscal_year = models.ForeignKey(
         FiscalYear, on_delete=models.PROTECT, related_name="journal_entries"
     )
-    entry_number = models.CharField(max_length=50, unique=True)
+    entry_number = models.CharField(max_length=50, unique=True, blank=True)
     date = models.DateField()
     description = models.TextField()
     reference = models.CharField(max_length=100, blank=True, null=True)
@@ -144,60 +258,51 @@ class JournalEntry(models.Model):
         related_name="approved_journal_entries",
     )
     posted_at = models.DateTimeField(blank=True, null=True)
+    # Ledger version of the posting, so readers can find what was posted since
+    posted_version = models.PositiveBigIntegerField(
+        blank=True, null=True, db_index=True, editable=False
+    )
+    # Document the posting queue wrote the entry for, as on its PostingJob
+    source_type = models.CharField(max_length=20, blank=True, default="")
+    source_id = models.PositiveBigIntegerField(blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-date", "-entry_number"]
         verbose_name_plural = "Journal Entries"
+        unique_together = ("source_type", "source_id")
 
     def __str__(self):
         return f"{self.entry_number} - {self.date}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Keep the lines' copy of the date in step
+            if not adding:
+                self.lines.exclude(entry_date=self.date).update(entry_date=self.date)
+
     @property
     def is_balanced(self):
         """Check if debits equal credits"""
-        total_debits = sum(line.debit_amount for line in self.lines.all())
-        total_credits = sum(line.credit_amount for line in self.lines.all())
-        return total_debits == total_credits
+        totals = self.lines.aggregate(
+            debits=Sum("debit_amount"), credits=Sum("credit_amount")
+        )
+        return (totals["debits"] or 0) == (totals["credits"] or 0)
 
     @property
     def total_amount(self):
         """Return the total amount of the journal entry (sum of debits or credits)"""
-        return sum(line.debit_amount for line in self.lines.all())
+        return self.lines.aggregate(total=Sum("debit_amount"))["total"] or 0
 
     def post(self, user):
         """Post the journal entry, updating account balances"""
         if self.status != "draft":
             raise ValueError("Only draft journal entries can be posted")
 
-        if not self.is_balanced:
-            raise ValueError("Journal entry must be balanced before posting")
-
-        # Update account balances
-        for line in self.lines.all():
-            account = line.account
-
-            # Adjust balance based on debit/credit and account type
-            if line.debit_amount > 0:
-                if account.is_debit_balance:
-                    account.current_balance += line.debit_amount
-                else:
-                    account.current_balance -= line.debit_amount
-
-            if line.credit_amount > 0:
-                if account.is_debit_balance:
-                    account.current_balance -= line.credit_amount
-                else:
-                    account.current_balance += line.credit_amount
-
-            account.save()
-
-        # Update journal entry status and metadata
-        self.status = "posted"
-        self.approved_by = user
-        self.posted_at = timezone.now()
-        self.save()
+        post_many([self], user)
 
 
 class JournalEntryLine(models.Model):
@@ -218,14 +323,23 @@ class JournalEntryLine(models.Model):
     # Optional reference fields for detailed record keeping
     reference = models.CharField(max_length=100, blank=True, null=True)
 
+    # Copy of journal_entry.date so account ledgers can seek by date on an index
+    entry_date = models.DateField(editable=False)
+
     class Meta:
         ordering = ["id"]
+        indexes = [models.Index(fields=["account", "entry_date", "id"])]
 
     def __str__(self):
         if self.debit_amount > 0:
             return f"{self.account.name} - Dr. {self.debit_amount}"
         return f"{self.account.name} - Cr. {self.credit_amount}"
 
+    def save(self, *args, **kwargs):
+        if not self.entry_date:
+            self.entry_date = self.journal_entry.date
+        super().save(*args, **kwargs)
+
     def clean(self):
         if self.debit_amount > 0 and self.credit_amount > 0:
             raise ValueError(
@@ -263,6 +377,10 @@ class Vendor(models.Model):
     def __str__(self):
         return f"Accounting for {self.procurement_vendor.supplier.name}"
 
+    @property
+    def name(self):
+        return self.procurement_vendor.supplier.name
+
 
 class Customer(models.Model):
     """Financial accounting for customers"""
@@ -291,6 +409,149 @@ class Customer(models.Model):
     def __str__(self):
         return f"Accounting for {self.user.email}"
 
+    @property
+    def name(self):
+        return self.user.get_full_name() or self.user.email
+
+
+class CreditExposure(models.Model):
+    """
+    Total of a user's orders that are placed but not invoiced yet.
+
+    With the customer's current_balance it makes up the credit exposure
+    checked at order placement, see accounting.credit.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="credit_exposure",
+    )
+    open_orders = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Open orders of {self.user_id}: {self.open_orders}"
+
+
+# Output fields of the SQL totals: money as stored, line amounts and taxes
+# with every decimal the multiplication produces
+MONEY = DecimalField(max_digits=15, decimal_places=2)
+LINE_AMOUNT = DecimalField(max_digits=27, decimal_places=4)
+LINE_TAX = DecimalField(max_digits=33, decimal_places=8)
+
+
+def line_tax(amount):
+    """SQL twin of the lines' tax_amount property"""
+    return ExpressionWrapper(amount * F("tax_rate") / Value(100), output_field=LINE_TAX)
+
+
+class DocumentQuerySet(models.QuerySet):
+    """Invoice and bill totals computed in SQL"""
+
+    # Line expressions summed by with_line_totals(), set per document type
+    line_amount = None
+
+    def with_totals(self):
+        """
+        Annotate ``total``, ``remaining`` and ``paid_in_full``, the SQL
+        counterparts of total_amount, remaining_amount and is_paid.
+        """
+        total = ExpressionWrapper(F("amount") + F("tax_amount"), output_field=MONEY)
+        return self.annotate(
+            total=total,
+            remaining=ExpressionWrapper(total - F("paid_amount"), output_field=MONEY),
+            paid_in_full=ExpressionWrapper(
+                Q(paid_amount__gte=total), output_field=BooleanField()
+            ),
+        )
+
+    def with_line_totals(self):
+        """
+        Annotate ``lines_amount``, ``lines_tax_amount`` and ``lines_total``
+        summed over the document's lines, one correlated subquery each.
+        """
+        field = self.model._meta.get_field("lines")
+        lines = (
+            field.related_model.objects.filter(**{field.field.name: OuterRef("pk")})
+            .order_by()
+            .values(field.field.name)
+        )
+        amount = self.line_amount()
+
+        def line_sum(expression, output_field):
+            return Coalesce(
+                Subquery(
+                    lines.annotate(total=Sum(expression)).values("total"),
+                    output_field=output_field,
+                ),
+                ZERO,
+                output_field=output_field,
+            )
+
+        return self.annotate(
+            lines_amount=line_sum(amount, LINE_AMOUNT),
+            lines_tax_amount=line_sum(line_tax(amount), LINE_TAX),
+            lines_total=line_sum(
+                ExpressionWrapper(amount + line_tax(amount), output_field=LINE_TAX),
+                LINE_TAX,
+            ),
+        )
+
+
+class BillQuerySet(DocumentQuerySet):
+    @staticmethod
+    def line_amount():
+        return ExpressionWrapper(F("amount"), output_field=LINE_AMOUNT)
+
+    def with_totals(self):
+        """Also annotate ``overdue`` like Bill.is_overdue"""
+        return (
+            super()
+            .with_totals()
+            .annotate(
+                overdue=Case(
+                    When(status__in=("paid", "cancelled"), then=Value(False)),
+                    When(due_date__lt=timezone.localdate(), then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField(),
+                )
+            )
+        )
+
+
+class InvoiceQuerySet(DocumentQuerySet):
+    @staticmethod
+    def line_amount():
+        return ExpressionWrapper(
+            F("quantity") * F("unit_price"), output_field=LINE_AMOUNT
+        )
+
+
+class BillLineQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate ``line_tax_amount`` and ``line_total``"""
+        amount = ExpressionWrapper(F("amount"), output_field=LINE_AMOUNT)
+        return self.annotate(
+            line_tax_amount=line_tax(amount),
+            line_total=ExpressionWrapper(
+                amount + line_tax(amount), output_field=LINE_TAX
+            ),
+        )
+
+
+class InvoiceLineQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate ``line_amount``, ``line_tax_amount`` and ``line_total``"""
+        amount = InvoiceQuerySet.line_amount()
+        return self.annotate(
+            line_amount=amount,
+            line_tax_amount=line_tax(amount),
+            line_total=ExpressionWrapper(
+                amount + line_tax(amount), output_field=LINE_TAX
+            ),
+        )
+
 
 class Bill(models.Model):
     """Supplier invoice (bill to be paid)"""
@@ -345,9 +606,12 @@ class Bill(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BillQuerySet.as_manager()
+
     class Meta:
         ordering = ["-bill_date", "-id"]
         unique_together = ("vendor", "bill_number")
+        indexes = [models.Index(fields=["status", "due_date"])]
 
     def __str__(self):
         return f"{self.vendor.procurement_vendor.supplier.name} - {self.bill_number}"
@@ -384,6 +648,8 @@ class BillLine(models.Model):
         max_digits=6, decimal_places=2, default=0, validators=[MinValueValidator(0)]
     )
 
+    objects = BillLineQuerySet.as_manager()
+
     class Meta:
         ordering = ["id"]
 
@@ -452,7 +718,7 @@ class Invoice(models.Model):
         Order, on_delete=models.SET_NULL, blank=True, null=True, related_name="invoices"
     )
 
-    invoice_number = models.CharField(max_length=50, unique=True)
+    invoice_number = models.CharField(max_length=50, unique=True, blank=True)
     reference = models.CharField(max_length=100, blank=True, null=True)
     invoice_date = models.DateField()
     due_date = models.DateField()
@@ -486,8 +752,11 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = InvoiceQuerySet.as_manager()
+
     class Meta:
         ordering = ["-invoice_date", "-id"]
+        indexes = [models.Index(fields=["status", "due_date"])]
 
     def __str__(self):
         return f"Invoice {self.invoice_number} - {self.customer.user.email}"
@@ -519,6 +788,8 @@ class InvoiceLine(models.Model):
         max_digits=6, decimal_places=2, default=0, validators=[MinValueValidator(0)]
     )
 
+    objects = InvoiceLineQuerySet.as_manager()
+
     class Meta:
         ordering = ["id"]
 
@@ -624,10 +895,100 @@ class FinancialPeriod(models.Model):
     class Meta:
         ordering = ["start_date"]
         unique_together = ("fiscal_year", "name")
+        indexes = [models.Index(fields=["status", "end_date"])]
 
     def __str__(self):
         return f"{self.name} ({self.start_date} to {self.end_date})"
 
+    def close(self, user):
+        """Close the period and freeze the balance of every account at its end"""
+        if self.status == "closed":
+            raise ValueError("Financial period is already closed")
+
+        close_periods([self], user)
+        self.refresh_from_db()
+
+
+class AccountBalance(models.Model):
+    """Materialized balance of an account at the end of a financial period"""
+
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="period_balances"
+    )
+    period = models.ForeignKey(
+        FinancialPeriod, on_delete=models.CASCADE, related_name="account_balances"
+    )
+    # Copy of period.end_date so as-of lookups do not need a join
+    period_end = models.DateField()
+
+    # Posted movement within the period
+    debit_total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    credit_total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    # Cumulative balance at period end, signed like Account.current_balance
+    closing_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["account", "period_end"]
+        unique_together = ("account", "period")
+        indexes = [models.Index(fields=["account", "period_end"])]
+
+    def __str__(self):
+        return f"{self.account.code} @ {self.period_end}: {self.closing_balance}"
+
+
+class LedgerVersion(models.Model):
+    """Single-row counter bumped by every posting, used to key ledger caches"""
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Ledger version {self.version}"
+
+
+class DocumentSequence(models.Model):
+    """
+    Counter of a document number sequence, one row per prefix and fiscal year.
+
+    Processes reserve blocks of numbers from it, see accounting.sequences.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    next_value = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class PostingJob(models.Model):
+    """Queued request to write and post the journal entry of a document"""
+
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    document_type = models.CharField(max_length=20)
+    object_id = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    # Set on every enqueue; the worker skips jobs until available_at
+    enqueued_at = models.DateTimeField(default=timezone.now)
+    available_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["id"]
+        unique_together = ("document_type", "object_id")
+        indexes = [models.Index(fields=["status", "available_at"])]
+
+    def __str__(self):
+        return f"{self.document_type} #{self.object_id} ({self.status})"
+
 
 class FinancialStatement(models.Model):
     STATEMENT_TYPES = (
@@ -654,8 +1015,10 @@ class FinancialStatement(models.Model):
     as_of_date = models.DateField()
     notes = models.TextField(blank=True, null=True)
 
-    # The statement data could be stored as a JSON blob or in related data tables
+    # Rendered statement, see accounting.statements
     data = models.JSONField(blank=True, null=True)
+    # Ledger version the data reflects
+    high_water_mark = models.PositiveBigIntegerField(default=0)
 
     # Who generated this statement
     generated_by = models.ForeignKey(
@@ -668,6 +1031,7 @@ class FinancialStatement(models.Model):
 
     class Meta:
         ordering = ["-as_of_date", "statement_type"]
+        indexes = [models.Index(fields=["statement_type", "fiscal_year", "as_of_date"])]
 
     def __str__(self):
         return f"{self.get_statement_type_display()} - {self.as_of_date}"
@@ -0,0 +1,339 @@
+import csv
+import json
+import re
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+
+from django_project.deltas import chunks
+
+from .aging import open_documents
+from .balances import MONEY
+from .posting import ZERO
+
+CENT = Decimal("0.01")
+
+# Stay below SQLite's default limit on query parameters
+CHUNK = 900
+
+# Per ledger: document and payment models, the payment's document field,
+# the document number field and its prefix in remittance texts, and the
+# statuses for fully paid, partly paid and no longer paid documents
+LEDGERS = {
+    "receivables": {
+        "model": "Invoice",
+        "payment_model": "InvoicePayment",
+        "document": "invoice",
+        "number": "invoice_number",
+        "prefix": "INV-",
+        "statuses": ("paid", "partially_paid", "sent"),
+    },
+    "payables": {
+        "model": "Bill",
+        "payment_model": "BillPayment",
+        "document": "bill",
+        "number": "bill_number",
+        "prefix": "BILL-",
+        "statuses": ("paid", "partial", "approved"),
+    },
+}
+
+TOKEN_SEPARATORS = re.compile(r"[\s,;:/#()]+")
+
+
+class StatementError(Exception):
+    pass
+
+
+def refresh_paid_amounts(ledger, document_ids):
+    """
+    Recompute paid_amount and status of documents from their payments.
+
+    One UPDATE per chunk of documents sets paid_amount to the SUM of the
+    payments and derives the status from it in SQL; cancelled documents
+    keep their status. Customer and vendor balances follow the change.
+    """
+    from . import models
+
+    # counters builds on this module
+    from .counters import tracking
+
+    config = LEDGERS[ledger]
+    model = getattr(models, config["model"])
+    payments = getattr(models, config["payment_model"]).objects.filter(
+        **{config["document"]: OuterRef("pk")}
+    )
+    paid = Coalesce(
+        Subquery(
+            payments.values(config["document"])
+            .annotate(total=Sum("amount"))
+            .values("total"),
+            output_field=MONEY,
+        ),
+        ZERO,
+    )
+    paid_status, partial_status, unpaid_status = config["statuses"]
+    status = Case(
+        When(status="cancelled", then=F("status")),
+        When(
+            GreaterThanOrEqual(paid, F("amount") + F("tax_amount")),
+            then=Value(paid_status),
+        ),
+        When(GreaterThan(paid, 0), then=Value(partial_status)),
+        When(status__in=(paid_status, partial_status), then=Value(unpaid_status)),
+        default=F("status"),
+    )
+    updated = 0
+    with tracking(ledger, document_ids):
+        for ids in chunks(document_ids, CHUNK):
+            updated += model.objects.filter(pk__in=ids).update(
+                paid_amount=paid, status=status
+            )
+    return updated
+
+
+def parse_transaction(line, booked, amount, bank_id, reference, text, direction=None):
+    """
+    A statement transaction as a dict, or StatementError.
+
+    ``amount`` is signed (money in is positive) unless ``direction`` gives
+    the CAMT credit/debit indicator. ``bank_id`` is the bank's own id of the
+    transaction, ``reference`` and ``text`` what the payer wrote.
+    """
+    try:
+        booked = date.fromisoformat(str(booked))
+    except ValueError:
+        raise StatementError(f"invalid date {booked!r}")
+    try:
+        amount = Decimal(str(amount).replace(",", ""))
+    except InvalidOperation:
+        raise StatementError(f"invalid amount {amount!r}")
+    if amount != amount.quantize(CENT) or not amount:
+        raise StatementError(f"invalid amount {amount!r}")
+    if direction == "DBIT":
+        amount = -abs(amount)
+    elif direction == "CRDT":
+        amount = abs(amount)
+    elif direction is not None:
+        raise StatementError(f"invalid credit/debit indicator {direction!r}")
+    return {
+        "line": line,
+        "date": booked,
+        "amount": amount,
+        "id": (bank_id or "").strip(),
+        "reference": (reference or "").strip(),
+        "text": (text or "").strip(),
+    }
+
+
+def read_csv(path):
+    """Rows with date, amount (signed), id, reference and description columns"""
+    with open(path, newline="", encoding="utf-8") as handle:
+        for line, row in enumerate(csv.DictReader(handle), start=2):
+            try:
+                yield parse_transaction(
+                    line,
+                    row.get("date"),
+                    row.get("amount"),
+                    row.get("id"),
+                    row.get("reference"),
+                    row.get("description"),
+                )
+            except StatementError as exc:
+                yield {"line": line, "error": str(exc), "raw": row}
+
+
+def read_camt(path):
+    """
+    Entries of a camt.053-like JSON statement.
+
+    ``{"Stmt": {"Ntry": [{"BookgDt": "2025-03-01", "Amt": "12.00",
+    "CdtDbtInd": "CRDT", "AcctSvcrRef": "...", "EndToEndId": "...",
+    "RmtInf": "..."}]}}``
+    """
+    with open(path, encoding="utf-8") as handle:
+        data = json.load(handle)
+    entries = data.get("Stmt", data).get("Ntry", [])
+    for line, entry in enumerate(entries, start=1):
+        try:
+            yield parse_transaction(
+                line,
+                entry.get("BookgDt"),
+                entry.get("Amt"),
+                entry.get("AcctSvcrRef"),
+                entry.get("EndToEndId"),
+                entry.get("RmtInf"),
+                entry.get("CdtDbtInd") or "CRDT",
+            )
+        except StatementError as exc:
+            yield {"line": line, "error": str(exc), "raw": entry}
+
+
+class OpenDocuments:
+    """
+    Hash indexes over the open documents of a ledger.
+
+    Documents are found by number or reference in O(1) per remittance
+    token and, failing that, by outstanding amount: amounts are bucketed in
+    cents so a tolerance lookup probes a handful of buckets.
+    """
+
+    def __init__(self, ledger, tolerance):
+        config = LEDGERS[ledger]
+        self.prefix = config["prefix"]
+        self.tolerance = int(tolerance / CENT)
+        self.remaining = {}
+        self.keys = defaultdict(set)
+        self.amounts = defaultdict(set)
+        for document_id, number, reference, remaining in open_documents(
+            ledger
+        ).values_list("id", config["number"], "reference", "remaining"):
+            self.remaining[document_id] = remaining
+            for key in (number, reference):
+                if key:
+                    self.keys[key.strip().upper()].add(document_id)
+            self.amounts[self.cents(remaining)].add(document_id)
+
+    @staticmethod
+    def cents(amount):
+        return int(amount / CENT)
+
+    def tokens(self, row):
+        for text in (row["reference"], row["text"]):
+            for token in TOKEN_SEPARATORS.split(text.upper()):
+                if token:
+                    yield token
+                    if token.startswith(self.prefix):
+                        yield token[len(self.prefix) :]
+
+    def within_tolerance(self, document_ids, amount):
+        return {
+            document_id
+            for document_id in document_ids
+            if abs(self.cents(self.remaining[document_id]) - self.cents(amount))
+            <= self.tolerance
+        }
+
+    def match(self, row):
+        """Return (document id, how) or (None, reason) for a transaction"""
+        amount = abs(row["amount"])
+        candidates = set()
+        for token in self.tokens(row):
+            candidates |= self.keys.get(token, set())
+        if len(candidates) == 1:
+            return candidates.pop(), "reference"
+        if candidates:
+            candidates = self.within_tolerance(candidates, amount)
+            if len(candidates) == 1:
+                return candidates.pop(), "reference"
+            return None, "ambiguous reference"
+
+        cents = self.cents(amount)
+        for bucket in range(cents - self.tolerance, cents + self.tolerance + 1):
+            candidates |= self.amounts.get(bucket, set())
+        if len(candidates) == 1:
+            return candidates.pop(), "amount"
+        return None, "ambiguous amount" if candidates else "no match"
+
+    def apply(self, document_id, amount):
+        """Book ``amount`` against a document's remaining balance"""
+        remaining = self.remaining[document_id]
+        self.amounts[self.cents(remaining)].discard(document_id)
+        remaining -= amount
+        self.remaining[document_id] = remaining
+        if remaining > 0:
+            self.amounts[self.cents(remaining)].add(document_id)
+
+
+def recorded_references(references):
+    """Bank transaction ids already recorded as a payment reference"""
+    from .models import BillPayment, InvoicePayment
+
+    found = set()
+    for model in (InvoicePayment, BillPayment):
+        for chunk in chunks(references, CHUNK):
+            found.update(
+                model.objects.filter(reference__in=chunk).values_list(
+                    "reference", flat=True
+                )
+            )
+    return found
+
+
+def import_transactions(transactions, tolerance=CENT, user=None, dry_run=False):
+    """
+    Match statement transactions to open documents and record the payments.
+
+    Money in is matched against invoices, money out against bills. All
+    payments are written with one bulk_create per payment model and the
+    paid amounts and statuses of the touched documents with aggregated
+    updates. The bank's transaction id becomes the payment reference, so
+    transactions imported before are skipped. Returns (stats, unmatched
+    transactions with a ``reason``).
+    """
+    from . import models
+
+    ledgers = {
+        "receivables": OpenDocuments("receivables", tolerance),
+        "payables": OpenDocuments("payables", tolerance),
+    }
+    transactions = list(transactions)
+    recorded = recorded_references({row["id"] for row in transactions if row["id"]})
+    stats = {
+        "transactions": len(transactions),
+        "reference": 0,
+        "amount": 0,
+        "duplicates": 0,
+    }
+    payments = defaultdict(list)
+    unmatched = []
+    for row in transactions:
+        if row["id"] and row["id"] in recorded:
+            stats["duplicates"] += 1
+            continue
+        recorded.add(row["id"])
+        ledger = "receivables" if row["amount"] > 0 else "payables"
+        document_id, how = ledgers[ledger].match(row)
+        if document_id is None:
+            unmatched.append({**row, "reason": how})
+            continue
+        ledgers[ledger].apply(document_id, abs(row["amount"]))
+        payments[ledger].append((document_id, row))
+        stats[how] += 1
+
+    stats["matched"] = stats["reference"] + stats["amount"]
+    stats["unmatched"] = len(unmatched)
+    stats["documents"] = {
+        ledger: len({document_id for document_id, _ in rows})
+        for ledger, rows in payments.items()
+    }
+    if dry_run:
+        return stats, unmatched
+
+    with transaction.atomic():
+        for ledger, rows in payments.items():
+            config = LEDGERS[ledger]
+            model = getattr(models, config["payment_model"])
+            extra = {"created_by": user} if ledger == "payables" else {}
+            model.objects.bulk_create(
+                (
+                    model(
+                        **{f"{config['document']}_id": document_id},
+                        payment_date=row["date"],
+                        amount=abs(row["amount"]),
+                        payment_method="bank_transfer",
+                        reference=(row["id"] or row["reference"])[:100] or None,
+                        notes=row["text"] or None,
+                        **extra,
+                    )
+                    for document_id, row in rows
+                ),
+                batch_size=CHUNK,
+            )
+            refresh_paid_amounts(ledger, {document_id for document_id, _ in rows})
+    return stats, unmatched
@@ -0,0 +1,178 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+ZERO = Value(
+    Decimal("0.00"), output_field=DecimalField(max_digits=15, decimal_places=2)
+)
+
+# Account types whose balance grows with debits
+DEBIT_BALANCE_TYPES = ("asset", "expense")
+
+
+def balance_delta(account_type, debits, credits):
+    """Return the change in current_balance for the given debit/credit totals."""
+    if account_type in DEBIT_BALANCE_TYPES:
+        return debits - credits
+    return credits - debits
+
+
+def bump_ledger_version():
+    """
+    Advance the ledger version so caches keyed on it are dropped.
+
+    Returns the new version; the row stays locked until the caller commits,
+    so versions are handed out in commit order.
+    """
+    from .models import LedgerVersion
+
+    if not LedgerVersion.objects.filter(pk=1).update(version=F("version") + 1):
+        LedgerVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+    return ledger_version()
+
+
+def ledger_version():
+    """Current ledger version, bumped by every posting"""
+    from .models import LedgerVersion
+
+    version = LedgerVersion.objects.filter(pk=1).values_list("version", flat=True)
+    return version.first() or 0
+
+
+def check_open(dates):
+    """
+    Raise ValueError if any of ``dates`` falls in a closed period or year.
+
+    One query over the few closed periods and fiscal years overlapping the
+    dates, served by their (status, end_date) and (is_closed, end_date)
+    indexes.
+    """
+    from .models import FinancialPeriod, FiscalYear
+
+    first, last = min(dates), max(dates)
+    periods = (
+        FinancialPeriod.objects.filter(
+            status="closed", end_date__gte=first, start_date__lte=last
+        )
+        .order_by()
+        .values_list("name", "start_date", "end_date")
+    )
+    years = (
+        FiscalYear.objects.filter(
+            is_closed=True, end_date__gte=first, start_date__lte=last
+        )
+        .order_by()
+        .values_list("name", "start_date", "end_date")
+    )
+    for name, start, end in periods.union(years, all=True):
+        if any(start <= day <= end for day in dates):
+            raise ValueError(f"Cannot post into closed period {name}")
+
+
+def post_many(entries, user, check_closed=True):
+    """
+    Post several draft journal entries in a single transaction.
+
+    Entries and the accounts they touch are locked in ascending id order so
+    concurrent posters cannot deadlock, and each distinct account receives a
+    single aggregated ``F()`` update instead of one save per line.
+    Entries dated in a closed period are rejected unless ``check_closed`` is
+    False, which only the year-end closing entry uses.
+    Accepts JournalEntry instances or ids and returns the list of posted ids.
+    """
+    from .balances import record_postings
+    from .models import Account, JournalEntry, JournalEntryLine
+
+    entries = list(entries)
+    entry_ids = sorted(
+        {
+            entry.pk if isinstance(entry, JournalEntry) else int(entry)
+            for entry in entries
+        }
+    )
+    if not entry_ids:
+        return []
+
+    with transaction.atomic():
+        # Re-read the status under lock so two posters cannot both see "draft"
+        locked = list(
+            JournalEntry.objects.select_for_update()
+            .filter(id__in=entry_ids)
+            .order_by("id")
+            .values_list("id", "status", "date")
+        )
+        if len(locked) != len(entry_ids):
+            raise ValueError("Journal entry does not exist")
+        if any(status != "draft" for _, status, _ in locked):
+            raise ValueError("Only draft journal entries can be posted")
+        if check_closed:
+            check_open({day for _, _, day in locked})
+
+        lines = JournalEntryLine.objects.filter(journal_entry_id__in=entry_ids)
+
+        unbalanced = (
+            lines.values("journal_entry_id")
+            .annotate(
+                debits=Coalesce(Sum("debit_amount"), ZERO),
+                credits=Coalesce(Sum("credit_amount"), ZERO),
+            )
+            .exclude(debits=F("credits"))
+        )
+        if unbalanced.exists():
+            raise ValueError("Journal entry must be balanced before posting")
+
+        totals = list(
+            lines.values(
+                "account_id", "account__account_type__type", "journal_entry__date"
+            )
+            .annotate(
+                debits=Coalesce(Sum("debit_amount"), ZERO),
+                credits=Coalesce(Sum("credit_amount"), ZERO),
+            )
+            .order_by("account_id", "journal_entry__date")
+        )
+        deltas = {}
+        for row in totals:
+            deltas[row["account_id"]] = deltas.get(
+                row["account_id"], 0
+            ) + balance_delta(
+                row["account__account_type__type"], row["debits"], row["credits"]
+            )
+
+        # Lock every touched account in a fixed order before updating any of them
+        list(
+            Account.objects.select_for_update()
+            .filter(id__in=deltas.keys())
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        for account_id in sorted(deltas):
+            if deltas[account_id]:
+                Account.objects.filter(id=account_id).update(
+                    current_balance=F("current_balance") + deltas[account_id]
+                )
+
+        record_postings(totals)
+        version = bump_ledger_version()
+
+        now = timezone.now()
+        JournalEntry.objects.filter(id__in=entry_ids).update(
+            status="posted",
+            approved_by=user,
+            posted_at=now,
+            posted_version=version,
+            updated_at=now,
+        )
+
+    for entry in entries:
+        if isinstance(entry, JournalEntry):
+            entry.status = "posted"
+            entry.approved_by = user
+            entry.posted_at = now
+            entry.posted_version = version
+            entry.updated_at = now
+
+    return entry_ids
@@ -0,0 +1,418 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .posting import post_many
+from .posting_rules import fiscal_year_for, get_rule
+from .sequences import number_entries
+
+# Seconds before the first retry of a failed job, doubled on every attempt
+RETRY_DELAY = 30
+MAX_ATTEMPTS = 5
+
+# Bills and invoices in these statuses get a draft entry; any later status,
+# including paid ones the worker only sees afterwards, is posted
+UNPOSTED_STATUSES = ("draft", "cancelled")
+
+
+class PostingError(Exception):
+    pass
+
+
+def enqueue(document_type, object_id):
+    """
+    Queue the journal entry of a document for the posting worker.
+
+    There is one job per document: queueing it again resets it to pending,
+    which is harmless because processing a job is idempotent.
+    """
+    from .models import PostingJob
+
+    now = timezone.now()
+    PostingJob.objects.update_or_create(
+        document_type=document_type,
+        object_id=object_id,
+        defaults={
+            "status": "pending",
+            "attempts": 0,
+            "last_error": "",
+            "enqueued_at": now,
+            "available_at": now,
+        },
+    )
+
+
+def enqueue_many(document_type, object_ids):
+    """
+    Queue the entries of many documents with one upsert.
+
+    Used by batch jobs that bulk_create documents and so bypass the
+    post_save handlers; existing jobs are reset to pending like enqueue.
+    """
+    from .models import PostingJob
+
+    now = timezone.now()
+    PostingJob.objects.bulk_create(
+        (
+            PostingJob(
+                document_type=document_type,
+                object_id=object_id,
+                status="pending",
+                attempts=0,
+                last_error="",
+                enqueued_at=now,
+                available_at=now,
+            )
+            for object_id in object_ids
+        ),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=["document_type", "object_id"],
+        update_fields=[
+            "status",
+            "attempts",
+            "last_error",
+            "enqueued_at",
+            "available_at",
+        ],
+    )
+
+
+def order_entry(order, accounts):
+    """
+    Book COGS if known and, for guest orders, the sale: debit Accounts
+    Receivable, credit Sales Revenue. Customers' orders are invoiced by
+    invoice_orders and their invoice recognises the revenue.
+    """
+    lines = []
+    try:
+        if order.user_id is None:
+            lines += [
+                (accounts["receivable"], "Accounts Receivable", order.total_amount, 0),
+                (accounts["revenue"], "Sales Revenue", 0, order.total_amount),
+            ]
+        total_cost = getattr(order, "total_cost", None)
+        if total_cost is not None:
+            lines += [
+                (accounts["cogs"], "Cost of Goods Sold", total_cost, 0),
+                (accounts["inventory"], "Inventory Asset", 0, total_cost),
+            ]
+    except KeyError as exc:
+        raise PostingError(f"missing {exc.args[0]} account")
+    if not lines:
+        return None
+    return {
+        "reference": f"SO-{order.order_number}",
+        "date": timezone.localdate(order.updated_at),
+        "description": f"Sale to {order.email or 'Customer'}",
+        "order_id": order.id,
+        "lines": lines,
+        "post": True,
+    }
+
+
+def purchase_order_entry(purchase_order, accounts):
+    """Debit Inventory Asset, credit Accounts Payable"""
+    try:
+        lines = [
+            (accounts["inventory"], "Inventory Asset", purchase_order.total_amount, 0),
+            (accounts["payable"], "Accounts Payable", 0, purchase_order.total_amount),
+        ]
+    except KeyError as exc:
+        raise PostingError(f"missing {exc.args[0]} account")
+    return {
+        "reference": f"PO-{purchase_order.order_number}",
+        "date": purchase_order.delivery_date or timezone.localdate(),
+        "description": f"Purchase order {purchase_order.order_number}",
+        "purchase_order_id": purchase_order.id,
+        "created_by_id": purchase_order.created_by_id,
+        "lines": lines,
+        "post": True,
+    }
+
+
+def bill_entry(bill, accounts):
+    """Debit each bill line's account, credit Accounts Payable"""
+    lines = [
+        (line.account_id, line.description, line.amount, 0) for line in bill.lines.all()
+    ]
+    # Lines are added after the bill itself is first saved
+    if not lines:
+        return None
+    if "payable" not in accounts:
+        raise PostingError("missing payable account")
+    lines.append((accounts["payable"], "Accounts Payable", 0, bill.total_amount))
+    return {
+        "reference": f"BILL-{bill.bill_number}",
+        "date": bill.bill_date,
+        "description": f"Bill {bill.bill_number}",
+        "created_by_id": bill.created_by_id,
+        "lines": lines,
+        "post": bill.status not in UNPOSTED_STATUSES,
+    }
+
+
+def invoice_entry(invoice, accounts):
+    """
+    Credit each invoice line's account and the tax to Sales Tax Payable,
+    debit Accounts Receivable. Negative lines such as discounts are debits.
+    """
+    lines = [
+        (
+            line.account_id,
+            line.description,
+            max(-line.amount, 0),
+            max(line.amount, 0),
+        )
+        for line in invoice.lines.all()
+    ]
+    if not lines:
+        return None
+    if "receivable" not in accounts:
+        raise PostingError("missing receivable account")
+    if invoice.tax_amount:
+        if "sales_tax" not in accounts:
+            raise PostingError("missing sales_tax account")
+        lines.append((accounts["sales_tax"], "Sales Tax", 0, invoice.tax_amount))
+    lines.append(
+        (accounts["receivable"], "Accounts Receivable", invoice.total_amount, 0)
+    )
+    return {
+        "reference": f"INV-{invoice.invoice_number}",
+        "date": invoice.invoice_date,
+        "description": f"Invoice {invoice.invoice_number}",
+        "created_by_id": invoice.created_by_id,
+        "lines": lines,
+        "post": invoice.status not in UNPOSTED_STATUSES,
+    }
+
+
+def document_querysets():
+    """Document type -> (queryset the documents are loaded from, entry builder)"""
+    from inventory.models import PurchaseOrder
+    from shop.models import Order
+
+    from .models import Bill, Invoice
+
+    return {
+        "order": (Order.objects.all(), order_entry),
+        "purchase_order": (PurchaseOrder.objects.all(), purchase_order_entry),
+        "bill": (Bill.objects.prefetch_related("lines"), bill_entry),
+        "invoice": (Invoice.objects.prefetch_related("lines"), invoice_entry),
+    }
+
+
+def plan_entries(jobs):
+    """
+    Build the entry of every job without writing anything.
+
+    Returns ({job_id: entry dict or None}, {job_id: error message}); a None
+    entry means the document is gone or has nothing to post yet.
+    """
+    documents = document_querysets()
+    ids_by_type = defaultdict(list)
+    for job in jobs:
+        ids_by_type[job.document_type].append(job.object_id)
+    loaded = {
+        document_type: documents[document_type][0].in_bulk(ids)
+        for document_type, ids in ids_by_type.items()
+        if document_type in documents
+    }
+
+    plans, errors = {}, {}
+    for job in jobs:
+        if job.document_type not in documents:
+            errors[job.id] = f"unknown document type {job.document_type!r}"
+            continue
+        document = loaded[job.document_type].get(job.object_id)
+        if document is None:
+            plans[job.id] = None
+            continue
+        try:
+            rule = get_rule(job.document_type)
+            plan = documents[job.document_type][1](document, rule["accounts"])
+            if plan is not None:
+                plan["source"] = (job.document_type, job.object_id)
+                plan["journal_id"] = rule["journal_id"]
+                plan["fiscal_year_id"] = fiscal_year_for(plan["date"])
+                if plan["fiscal_year_id"] is None:
+                    raise PostingError(f"no fiscal year covers {plan['date']}")
+            plans[job.id] = plan
+        except PostingError as exc:
+            errors[job.id] = str(exc)
+    return plans, errors
+
+
+def entry_from_plan(plan):
+    """Unsaved draft JournalEntry of a plan"""
+    from .models import JournalEntry
+
+    document_type, object_id = plan["source"]
+    return JournalEntry(
+        journal_id=plan["journal_id"],
+        fiscal_year_id=plan["fiscal_year_id"],
+        reference=plan["reference"],
+        date=plan["date"],
+        description=plan["description"],
+        order_id=plan.get("order_id"),
+        purchase_order_id=plan.get("purchase_order_id"),
+        created_by_id=plan.get("created_by_id"),
+        source_type=document_type,
+        source_id=object_id,
+        status="draft",
+    )
+
+
+def existing_entries(sources):
+    """{(document type, id): (entry id, status)} of entries already written"""
+    from .models import JournalEntry
+
+    ids_by_type = defaultdict(list)
+    for document_type, object_id in sources:
+        ids_by_type[document_type].append(object_id)
+    existing = {}
+    for document_type, ids in ids_by_type.items():
+        for object_id, entry_id, status in JournalEntry.objects.filter(
+            source_type=document_type, source_id__in=ids
+        ).values_list("source_id", "id", "status"):
+            existing[document_type, object_id] = (entry_id, status)
+    return existing
+
+
+def write_entries(plans, errors):
+    """
+    Write the entries of a batch and post everything postable.
+
+    Entries are found by their document, so a job processed again never
+    writes a second one. Drafts written earlier are brought in line with
+    the document: their lines are deleted and written again. New entries
+    are inserted with one bulk_create, all lines with another, and all
+    postings go through a single post_many call so the batch updates each
+    account once. Jobs whose entry cannot be posted are moved to ``errors``.
+    """
+    from .models import JournalEntry, JournalEntryLine
+
+    pending = {}
+    for job_id, plan in plans.items():
+        if not plan:
+            continue
+        if plan["post"]:
+            debits = sum(line[2] for line in plan["lines"])
+            credits = sum(line[3] for line in plan["lines"])
+            if debits != credits:
+                errors[job_id] = f"unbalanced: debits {debits} != credits {credits}"
+                continue
+        pending[job_id] = plan
+    existing = existing_entries(plan["source"] for plan in pending.values())
+
+    # Posted entries are final; drafts are rewritten from the new plan
+    drafts, new = [], []
+    for plan in pending.values():
+        entry = entry_from_plan(plan)
+        if plan["source"] not in existing:
+            new.append((entry, plan))
+        elif existing[plan["source"]][1] == "draft":
+            entry.pk = existing[plan["source"]][0]
+            drafts.append((entry, plan))
+
+    draft_entries = [entry for entry, _ in drafts]
+    JournalEntry.objects.bulk_update(
+        draft_entries, ["journal", "fiscal_year", "reference", "date", "description"]
+    )
+    JournalEntryLine.objects.filter(journal_entry__in=draft_entries).delete()
+    new_entries = [entry for entry, _ in new]
+    number_entries(new_entries)
+    JournalEntry.objects.bulk_create(new_entries)
+    JournalEntryLine.objects.bulk_create(
+        JournalEntryLine(
+            journal_entry_id=entry.id,
+            entry_date=entry.date,
+            account_id=account_id,
+            description=description,
+            debit_amount=debit,
+            credit_amount=credit,
+        )
+        for entry, plan in drafts + new
+        for account_id, description, debit, credit in plan["lines"]
+    )
+
+    post_many([entry.id for entry, plan in drafts + new if plan["post"]], None)
+
+
+def fail_jobs(jobs, errors, max_attempts):
+    """Schedule a retry with exponential backoff or dead-letter the job"""
+    from .models import PostingJob
+
+    now = timezone.now()
+    for job in jobs:
+        if job.id not in errors:
+            continue
+        attempts = job.attempts + 1
+        PostingJob.objects.filter(id=job.id).update(
+            attempts=attempts,
+            last_error=errors[job.id],
+            status="failed" if attempts >= max_attempts else "pending",
+            available_at=now + timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1)),
+            processed_at=now,
+        )
+
+
+def process_batch(batch_size=500, max_attempts=MAX_ATTEMPTS):
+    """
+    Claim up to ``batch_size`` due jobs and process them in one transaction.
+
+    If writing the whole batch fails, each job is retried on its own inside a
+    savepoint so a single bad document cannot hold back the others.
+    Returns the number of jobs done and failed.
+    """
+    from .models import PostingJob
+
+    with transaction.atomic():
+        jobs = list(
+            PostingJob.objects.select_for_update(skip_locked=True)
+            .filter(status="pending", available_at__lte=timezone.now())
+            .order_by("id")[:batch_size]
+        )
+        if not jobs:
+            return {"done": 0, "failed": 0}
+
+        plans, errors = plan_entries(jobs)
+        try:
+            with transaction.atomic():
+                write_entries(plans, errors)
+        except Exception:
+            for job_id, plan in plans.items():
+                if job_id in errors:
+                    continue
+                try:
+                    with transaction.atomic():
+                        write_entries({job_id: plan}, errors)
+                except Exception as exc:
+                    errors[job_id] = f"{type(exc).__name__}: {exc}"
+
+        fail_jobs(jobs, errors, max_attempts)
+        PostingJob.objects.filter(
+            id__in=[job.id for job in jobs if job.id not in errors]
+        ).update(status="done", last_error="", processed_at=timezone.now())
+
+    return {"done": len(jobs) - len(errors), "failed": len(errors)}
+
+
+def queue_stats():
+    """Queue depth, due and dead-lettered jobs and the oldest pending job's age"""
+    from .models import PostingJob
+
+    now = timezone.now()
+    pending = Q(status="pending")
+    stats = PostingJob.objects.aggregate(
+        depth=Count("id", filter=pending),
+        due=Count("id", filter=pending & Q(available_at__lte=now)),
+        failed=Count("id", filter=Q(status="failed")),
+        oldest=Min("enqueued_at", filter=pending),
+    )
+    oldest = stats.pop("oldest")
+    stats["lag_seconds"] = (now - oldest).total_seconds() if oldest else 0.0
+    return stats
@@ -0,0 +1,98 @@
+from django.db import transaction
+
+# Document type -> journal (code, name, description), account roles -> codes
+# and the document status at which its entry is posted
+POSTING_RULES = {
+    "order": {
+        "status": "delivered",
+        "journal": ("SJ", "Sales Journal", "Journal for sales transactions"),
+        "accounts": {
+            "receivable": "1200",
+            "revenue": "4000",
+            "inventory": "1300",
+            "cogs": "5000",
+        },
+    },
+    "purchase_order": {
+        "status": "received",
+        "journal": ("PJ", "Purchases Journal", "Journal for purchase transactions"),
+        "accounts": {"payable": "2100", "inventory": "1300"},
+    },
+    "bill": {
+        "status": "approved",
+        "journal": ("PJ", "Purchases Journal", "Journal for purchase transactions"),
+        "accounts": {"payable": "2100"},
+    },
+    "invoice": {
+        "status": "sent",
+        "journal": ("SJ", "Sales Journal", "Journal for sales transactions"),
+        # Orders invoiced in bulk are credited to the customer's revenue
+        # account, or to this one
+        "accounts": {"receivable": "1200", "revenue": "4000", "sales_tax": "2200"},
+    },
+    # Not a document: the entry closing a fiscal year's income accounts
+    "year_end": {
+        "status": None,
+        "journal": ("CJ", "Closing Journal", "Year-end closing entries"),
+        "accounts": {"retained_earnings": "3200"},
+    },
+}
+
+# Resolved rules, cached per process until an Account, Journal or
+# FiscalYear changes so handlers never look accounts up by code
+_cache = {}
+
+
+def get_rule(document_type):
+    """
+    Return {"journal_id": ..., "accounts": {role: account_id}} for a document
+    type. Roles whose account does not exist are left out.
+    """
+    if document_type not in _cache:
+        _cache[document_type] = _resolve(POSTING_RULES[document_type])
+    return _cache[document_type]
+
+
+def _resolve(rule):
+    from .models import Account, Journal
+
+    code, name, description = rule["journal"]
+    with transaction.atomic():
+        journal, _ = Journal.objects.get_or_create(
+            code=code, defaults={"name": name, "description": description}
+        )
+    ids = dict(
+        Account.objects.filter(code__in=rule["accounts"].values()).values_list(
+            "code", "id"
+        )
+    )
+    return {
+        "journal_id": journal.id,
+        "accounts": {
+            role: ids[code] for role, code in rule["accounts"].items() if code in ids
+        },
+    }
+
+
+def fiscal_years():
+    """Cached (start_date, end_date, id) of every fiscal year."""
+    if "fiscal_years" not in _cache:
+        from .models import FiscalYear
+
+        _cache["fiscal_years"] = list(
+            FiscalYear.objects.values_list("start_date", "end_date", "id")
+        )
+    return _cache["fiscal_years"]
+
+
+def fiscal_year_for(day):
+    """Return the id of the fiscal year covering ``day``, or None."""
+    for start, end, fiscal_year_id in fiscal_years():
+        if start <= day <= end:
+            return fiscal_year_id
+    return None
+
+
+def invalidate(**kwargs):
+    """Signal receiver dropping every resolved rule."""
+    _cache.clear()
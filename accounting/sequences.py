@@ -0,0 +1,192 @@
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+from operator import attrgetter
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .posting_rules import fiscal_years
+
+# Numbers a process reserves from a counter at a time. Numbers left in a
+# block when the process exits are never used, so sequences may have gaps.
+BLOCK_SIZE = 20
+
+# Connection blocks are reserved on from inside a transaction; see settings
+SEQUENCE_DB = "sequences"
+
+# Sequence -> (number format, default prefix). Formats using {year} are
+# numbered per fiscal year, each year with a counter of its own. Counters are
+# keyed by what the number shows, so formatted numbers never repeat.
+SEQUENCES = {
+    "journal_entry": ("{prefix}-{year}-{number:06d}", "JE"),
+    "invoice": ("{year}-{number:06d}", ""),
+    "order": ("{prefix}-{year}-{number:06d}", "ORD"),
+    # Displayed with their PO-, PR- and RFQ- prefixes already
+    "purchase_order": ("{year}-{number:05d}", ""),
+    "inventory_adjustment": ("{year}-{number:05d}", ""),
+    "requisition": ("{year}-{number:05d}", ""),
+    "rfq": ("{year}-{number:05d}", ""),
+}
+
+# Model, number field, sequence, date field picking the fiscal year and the
+# attribute the prefix is taken from
+NUMBERED_DOCUMENTS = (
+    (
+        "accounting.JournalEntry",
+        "entry_number",
+        "journal_entry",
+        "date",
+        "journal.code",
+    ),
+    ("accounting.Invoice", "invoice_number", "invoice", "invoice_date", None),
+    ("shop.Order", "order_number", "order", None, None),
+    ("inventory.PurchaseOrder", "order_number", "purchase_order", "order_date", None),
+    (
+        "inventory.InventoryAdjustment",
+        "adjustment_number",
+        "inventory_adjustment",
+        "date",
+        None,
+    ),
+    (
+        "procurement.PurchaseRequisition",
+        "requisition_number",
+        "requisition",
+        None,
+        None,
+    ),
+    ("procurement.RFQ", "rfq_number", "rfq", "issue_date", None),
+)
+
+# Counter name -> (next number, end of block) reserved by this process
+_blocks = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def reserve(name, size, using=DEFAULT_DB_ALIAS):
+    """
+    Advance a counter by ``size`` in one UPDATE; returns the first number.
+
+    The reservation is part of the current transaction on ``using``.
+    """
+    from .models import DocumentSequence
+
+    counter = DocumentSequence.objects.using(using).filter(name=name)
+    with transaction.atomic(using=using):
+        if not counter.update(next_value=F("next_value") + size):
+            try:
+                with transaction.atomic(using=using):
+                    DocumentSequence.objects.using(using).create(
+                        name=name, next_value=size + 1
+                    )
+                return 1
+            except IntegrityError:
+                # Created by someone else in the meantime
+                counter.update(next_value=F("next_value") + size)
+        return counter.values_list("next_value", flat=True).get() - size
+
+
+def allocate(name, count=1):
+    """
+    ``count`` consecutive numbers of a counter.
+
+    Numbers come from a block this process reserved earlier; only when the
+    block runs out is a new one reserved, so concurrent checkouts almost
+    never touch the counter row. SQLite allows a single writer anyway, so
+    inside a transaction there the numbers are taken in that transaction
+    and no block is kept.
+    """
+    global _pid
+
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and connection.vendor == "sqlite":
+        first = reserve(name, count)
+        return range(first, first + count)
+
+    with _lock:
+        if _pid != os.getpid():
+            # Forked: the parent process hands out its own blocks
+            _blocks.clear()
+            _pid = os.getpid()
+
+        first, end = _blocks.get(name, (0, 0))
+        if end - first < count:
+            size = max(count, BLOCK_SIZE)
+            if connection.in_atomic_block:
+                # Committed at once on the sequence connection: the counter
+                # row is locked only for that statement rather than until the
+                # caller's transaction ends, and a rollback of the caller
+                # cannot hand the same numbers out twice
+                first = reserve(name, size, using=SEQUENCE_DB)
+            else:
+                first = reserve(name, size)
+            end = first + size
+        _blocks[name] = (first + count, end)
+    return range(first, first + count)
+
+
+def fiscal_year_label(day):
+    """Year the fiscal year covering ``day`` ends in, or its calendar year"""
+    for start, end, _ in fiscal_years():
+        if start <= day <= end:
+            return end.year
+    return day.year
+
+
+def next_numbers(sequence, count, day=None, prefix=None):
+    """``count`` formatted document numbers of a sequence"""
+    number_format, default_prefix = SEQUENCES[sequence]
+    if prefix is None:
+        prefix = default_prefix
+    name = f"{sequence}:{prefix}"
+    year = None
+    if "{year}" in number_format:
+        year = fiscal_year_label(day or timezone.localdate())
+        name = f"{name}:{year}"
+    return [
+        number_format.format(prefix=prefix, year=year, number=number)
+        for number in allocate(name, count)
+    ]
+
+
+def next_number(sequence, day=None, prefix=None):
+    """The next formatted document number of a sequence"""
+    return next_numbers(sequence, 1, day, prefix)[0]
+
+
+def number_document(sender, instance, **kwargs):
+    """pre_save receiver numbering documents saved without a number"""
+    for label, field, sequence, date_field, prefix_attr in NUMBERED_DOCUMENTS:
+        if label != sender._meta.label or getattr(instance, field):
+            continue
+        day = getattr(instance, date_field) if date_field else None
+        if isinstance(day, datetime):
+            day = timezone.localdate(day)
+        prefix = attrgetter(prefix_attr)(instance) if prefix_attr else None
+        setattr(instance, field, next_number(sequence, day, prefix))
+
+
+def number_entries(entries):
+    """
+    Number the journal entries among ``entries`` that have no number yet,
+    as number_document() would on save; bulk_create skips pre_save.
+    """
+    from .models import Journal
+
+    unnumbered = [entry for entry in entries if not entry.entry_number]
+    codes = dict(
+        Journal.objects.filter(
+            pk__in={entry.journal_id for entry in unnumbered}
+        ).values_list("id", "code")
+    )
+    groups = defaultdict(list)
+    for entry in unnumbered:
+        groups[codes[entry.journal_id], fiscal_year_label(entry.date)].append(entry)
+    for (prefix, _), group in groups.items():
+        numbers = next_numbers("journal_entry", len(group), group[0].date, prefix)
+        for entry, number in zip(group, numbers):
+            entry.entry_number = number
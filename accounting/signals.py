@@ -1,264 +1,205 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from shop.models import Order
-from procurement.models import PurchaseOrder
-from accounting.models import JournalEntry, Journal, Account, Bill, Invoice
+from inventory.models import PurchaseOrder
+from accounting.models import (
+    Journal,
+    Account,
+    AccountType,
+    Bill,
+    BillPayment,
+    Invoice,
+    InvoicePayment,
+    FiscalYear,
+)
+from accounting import credit
+from accounting.counters import apply_changes, party_totals, rebuild_counters
+from accounting.payments import refresh_paid_amounts
+from accounting.posting import bump_ledger_version
+from accounting.posting_queue import enqueue
+from accounting.posting_rules import POSTING_RULES, invalidate
+from accounting.sequences import NUMBERED_DOCUMENTS, number_document
+
+# Posting rules cache account, journal and fiscal year ids
+for model in (Account, Journal, FiscalYear):
+    post_save.connect(
+        invalidate, sender=model, dispatch_uid=f"posting_rules_{model.__name__}"
+    )
+    post_delete.connect(
+        invalidate, sender=model, dispatch_uid=f"posting_rules_delete_{model.__name__}"
+    )
+
+# Documents saved without a number get the next one of their sequence
+for label, *_ in NUMBERED_DOCUMENTS:
+    pre_save.connect(number_document, sender=label, dispatch_uid=f"number_{label}")
+
+
+# Fields of an account that dashboard figures and statements are grouped,
+# ordered and labelled by
+LEDGER_FIELDS = ("account_type_id", "parent_id", "code", "name")
+
+
+@receiver(pre_save, sender=Account)
+def remember_ledger_fields(sender, instance, **kwargs):
+    instance._ledger_fields = (
+        Account.objects.filter(pk=instance.pk).values_list(*LEDGER_FIELDS).first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=Account)
+def account_changed(sender, instance, **kwargs):
+    """
+    Chart of accounts changes alter dashboard figures and statements without
+    any posting; editing an account's description or the like does not.
+    """
+    before = instance.__dict__.pop("_ledger_fields", None)
+    if before != tuple(getattr(instance, field) for field in LEDGER_FIELDS):
+        bump_ledger_version()
+
+
+@receiver(post_delete, sender=Account)
+def account_deleted(sender, **kwargs):
+    bump_ledger_version()
+
+
+@receiver(post_save, sender=AccountType)
+def account_type_changed(sender, created, **kwargs):
+    """Statements label and group their rows by the accounts' types"""
+    if not created:
+        bump_ledger_version()
+
+
+# Handlers only queue a PostingJob inside the saving transaction; entries are
+# written and posted by the run_posting_worker command.
 
 
 @receiver(post_save, sender=Order)
-def create_sales_journal_entry(sender, instance, created, **kwargs):
+def queue_sales_journal_entry(sender, instance, created, **kwargs):
     """
-    Create a journal entry when an order is marked as completed.
+    Queue a journal entry when an order is delivered.
     """
-    if (
-        instance.status == "completed"
-        and not JournalEntry.objects.filter(order=instance).exists()
-    ):
-        # Get or create the sales journal
-        sales_journal, _ = Journal.objects.get_or_create(
-            name="Sales Journal",
-            defaults={"description": "Journal for sales transactions"},
-        )
+    if instance.status == POSTING_RULES["order"]["status"]:
+        enqueue("order", instance.pk)
 
-        # Create a new journal entry
-        journal_entry = JournalEntry.objects.create(
-            journal=sales_journal,
-            reference=f"SO-{instance.order_number}",
-            description=f"Sale to {instance.customer.name if hasattr(instance, 'customer') and instance.customer else 'Customer'}",
-            order=instance,
-            created_by=instance.updated_by if hasattr(instance, "updated_by") else None,
-            status="draft",
-        )
 
-        # Get the accounts
-        try:
-            accounts_receivable = Account.objects.get(
-                code="1200"
-            )  # Accounts Receivable
-            sales_revenue = Account.objects.get(code="4000")  # Sales Revenue
-            inventory_asset = Account.objects.get(code="1300")  # Inventory Asset
-            cogs = Account.objects.get(code="5000")  # Cost of Goods Sold
-
-            # Create journal entry lines
-            # Debit Accounts Receivable
-            journal_entry.lines.create(
-                account=accounts_receivable,
-                description="Accounts Receivable",
-                debit_amount=instance.total_amount,
-                credit_amount=0,
-            )
-
-            # Credit Sales Revenue
-            journal_entry.lines.create(
-                account=sales_revenue,
-                description="Sales Revenue",
-                debit_amount=0,
-                credit_amount=instance.total_amount,
-            )
-
-            # If we have COGS information
-            if hasattr(instance, "total_cost"):
-                # Debit COGS
-                journal_entry.lines.create(
-                    account=cogs,
-                    description="Cost of Goods Sold",
-                    debit_amount=instance.total_cost,
-                    credit_amount=0,
-                )
-
-                # Credit Inventory Asset
-                journal_entry.lines.create(
-                    account=inventory_asset,
-                    description="Inventory Asset",
-                    debit_amount=0,
-                    credit_amount=instance.total_cost,
-                )
-
-            # Auto-post the journal entry if it's balanced
-            if journal_entry.is_balanced:
-                journal_entry.status = "posted"
-                journal_entry.posted_by = journal_entry.created_by
-                journal_entry.save()
-
-        except Account.DoesNotExist:
-            # Handle case where required accounts don't exist
-            pass
+@receiver(post_save, sender=PurchaseOrder)
+def queue_purchase_journal_entry(sender, instance, created, **kwargs):
+    """
+    Queue a journal entry when a purchase order is received.
+    """
+    if instance.status == POSTING_RULES["purchase_order"]["status"]:
+        enqueue("purchase_order", instance.pk)
 
 
-@receiver(post_save, sender=PurchaseOrder)
-def create_purchase_journal_entry(sender, instance, created, **kwargs):
+@receiver(post_save, sender=Bill)
+def queue_bill_journal_entry(sender, instance, created, **kwargs):
     """
-    Create a journal entry when a purchase order is marked as received.
+    Queue a journal entry for a bill; it is posted once the bill leaves draft.
     """
-    if (
-        instance.status == "received"
-        and not JournalEntry.objects.filter(purchase_order=instance).exists()
-    ):
-        # Get or create the purchases journal
-        purchases_journal, _ = Journal.objects.get_or_create(
-            name="Purchases Journal",
-            defaults={"description": "Journal for purchase transactions"},
-        )
+    if instance.status != "cancelled":
+        enqueue("bill", instance.pk)
 
-        # Create a new journal entry
-        journal_entry = JournalEntry.objects.create(
-            journal=purchases_journal,
-            reference=f"PO-{instance.po_number}",
-            description=f"Purchase from {instance.vendor.name if hasattr(instance, 'vendor') and instance.vendor else 'Vendor'}",
-            purchase_order=instance,
-            created_by=instance.updated_by if hasattr(instance, "updated_by") else None,
-            status="draft",
-        )
 
-        # Get the accounts
-        try:
-            accounts_payable = Account.objects.get(code="2100")  # Accounts Payable
-            inventory_asset = Account.objects.get(code="1300")  # Inventory Asset
-
-            # Create journal entry lines
-            # Debit Inventory Asset
-            journal_entry.lines.create(
-                account=inventory_asset,
-                description="Inventory Asset",
-                debit_amount=instance.total_amount,
-                credit_amount=0,
-            )
-
-            # Credit Accounts Payable
-            journal_entry.lines.create(
-                account=accounts_payable,
-                description="Accounts Payable",
-                debit_amount=0,
-                credit_amount=instance.total_amount,
-            )
-
-            # Auto-post the journal entry if it's balanced
-            if journal_entry.is_balanced:
-                journal_entry.status = "posted"
-                journal_entry.posted_by = journal_entry.created_by
-                journal_entry.save()
-
-        except Account.DoesNotExist:
-            # Handle case where required accounts don't exist
-            pass
+@receiver(post_save, sender=Invoice)
+def queue_invoice_journal_entry(sender, instance, created, **kwargs):
+    """
+    Queue a journal entry for an invoice; it is posted once it leaves draft.
+    """
+    if instance.status != "cancelled":
+        enqueue("invoice", instance.pk)
+
 
+@receiver(post_save, sender=InvoicePayment)
+@receiver(post_delete, sender=InvoicePayment)
+def invoice_payment_changed(sender, instance, **kwargs):
+    """
+    Keep the invoice's paid amount and status in step with its payments.
+    """
+    refresh_paid_amounts("receivables", [instance.invoice_id])
 
+
+@receiver(post_save, sender=BillPayment)
+@receiver(post_delete, sender=BillPayment)
+def bill_payment_changed(sender, instance, **kwargs):
+    """
+    Keep the bill's paid amount and status in step with its payments.
+    """
+    refresh_paid_amounts("payables", [instance.bill_id])
+
+
+# Customer and vendor counters move by the difference a save makes to the
+# document's contribution; deleting one (its payments cascade first)
+# recomputes its party instead.
+COUNTED_DOCUMENTS = {Invoice: "receivables", Bill: "payables"}
+
+
+@receiver(pre_save, sender=Invoice)
+@receiver(pre_save, sender=Bill)
+def remember_counter_totals(sender, instance, **kwargs):
+    instance._counter_totals = (
+        party_totals(COUNTED_DOCUMENTS[sender], [instance.pk]) if instance.pk else {}
+    )
+
+
+@receiver(post_save, sender=Invoice)
 @receiver(post_save, sender=Bill)
-def create_bill_journal_entry(sender, instance, created, **kwargs):
+def update_counters(sender, instance, **kwargs):
     """
-    Create a journal entry when a bill is created or updated.
+    Keep the party's balance and year-to-date figures in step with the document.
     """
-    # Only create a journal entry for new bills or when status changes to approved
-    if created or instance.status_changed and instance.status == "approved":
-        if not JournalEntry.objects.filter(
-            reference=f"BILL-{instance.bill_number}"
-        ).exists():
-            # Get or create the purchases journal
-            purchases_journal, _ = Journal.objects.get_or_create(
-                name="Purchases Journal",
-                defaults={"description": "Journal for purchase transactions"},
-            )
-
-            # Create a new journal entry
-            journal_entry = JournalEntry.objects.create(
-                journal=purchases_journal,
-                reference=f"BILL-{instance.bill_number}",
-                description=f"Bill from {instance.vendor.name}",
-                created_by=(
-                    instance.created_by if hasattr(instance, "created_by") else None
-                ),
-                status="draft",
-            )
-
-            # Get the accounts
-            try:
-                accounts_payable = Account.objects.get(code="2100")  # Accounts Payable
-
-                # Create journal entry lines
-                for line in instance.lines.all():
-                    # Debit expense account or asset account
-                    journal_entry.lines.create(
-                        account=line.account,
-                        description=line.description,
-                        debit_amount=line.amount,
-                        credit_amount=0,
-                    )
-
-                # Credit Accounts Payable
-                journal_entry.lines.create(
-                    account=accounts_payable,
-                    description="Accounts Payable",
-                    debit_amount=0,
-                    credit_amount=instance.total_amount,
-                )
-
-                # Auto-post the journal entry if it's balanced and the bill is approved
-                if journal_entry.is_balanced and instance.status == "approved":
-                    journal_entry.status = "posted"
-                    journal_entry.posted_by = journal_entry.created_by
-                    journal_entry.save()
-
-            except Account.DoesNotExist:
-                # Handle case where required accounts don't exist
-                pass
+    ledger = COUNTED_DOCUMENTS[sender]
+    before = instance.__dict__.pop("_counter_totals", {})
+    apply_changes(ledger, before, party_totals(ledger, [instance.pk]))
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_deleted(sender, instance, **kwargs):
+    rebuild_counters("receivables", [instance.customer_id])
+
+
+@receiver(post_delete, sender=Bill)
+def bill_deleted(sender, instance, **kwargs):
+    rebuild_counters("payables", [instance.vendor_id])
+
+
+# Orders placed but not invoiced count towards the user's credit exposure;
+# like the counters above, it moves by the difference a change makes. The
+# credit limit itself is checked in Order.clean().
+
+
+@receiver(pre_save, sender=Order)
+@receiver(pre_delete, sender=Order)
+def remember_order_exposure(sender, instance, **kwargs):
+    instance._exposure = credit.order_amounts([instance.pk]) if instance.pk else {}
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def update_order_exposure(sender, instance, **kwargs):
+    before = instance.__dict__.pop("_exposure", {})
+    credit.apply_changes(before, credit.order_amounts([instance.pk]))
+
+
+@receiver(pre_save, sender=Invoice)
+@receiver(pre_delete, sender=Invoice)
+def remember_invoiced_orders(sender, instance, **kwargs):
+    order_ids = {instance.order_id}
+    if instance.pk:
+        order_ids.update(
+            Invoice.objects.filter(pk=instance.pk).values_list("order_id", flat=True)
+        )
+    order_ids.discard(None)
+    instance._invoiced_orders = (order_ids, credit.order_amounts(order_ids))
 
 
 @receiver(post_save, sender=Invoice)
-def create_invoice_journal_entry(sender, instance, created, **kwargs):
+@receiver(post_delete, sender=Invoice)
+def update_invoiced_orders(sender, instance, **kwargs):
     """
-    Create a journal entry when an invoice is created or updated.
+    Orders move out of the credit exposure once invoiced, and back in when
+    their invoice is deleted.
     """
-    # Only create a journal entry for new invoices or when status changes to approved
-    if created or instance.status_changed and instance.status == "approved":
-        if not JournalEntry.objects.filter(
-            reference=f"INV-{instance.invoice_number}"
-        ).exists():
-            # Get or create the sales journal
-            sales_journal, _ = Journal.objects.get_or_create(
-                name="Sales Journal",
-                defaults={"description": "Journal for sales transactions"},
-            )
-
-            # Create a new journal entry
-            journal_entry = JournalEntry.objects.create(
-                journal=sales_journal,
-                reference=f"INV-{instance.invoice_number}",
-                description=f"Invoice to {instance.customer.name}",
-                created_by=(
-                    instance.created_by if hasattr(instance, "created_by") else None
-                ),
-                status="draft",
-            )
-
-            # Get the accounts
-            try:
-                accounts_receivable = Account.objects.get(
-                    code="1200"
-                )  # Accounts Receivable
-
-                # Credit revenue accounts
-                for line in instance.lines.all():
-                    journal_entry.lines.create(
-                        account=line.account,
-                        description=line.description,
-                        debit_amount=0,
-                        credit_amount=line.amount,
-                    )
-
-                # Debit Accounts Receivable
-                journal_entry.lines.create(
-                    account=accounts_receivable,
-                    description="Accounts Receivable",
-                    debit_amount=instance.total_amount,
-                    credit_amount=0,
-                )
-
-                # Auto-post the journal entry if it's balanced and the invoice is approved
-                if journal_entry.is_balanced and instance.status == "approved":
-                    journal_entry.status = "posted"
-                    journal_entry.posted_by = journal_entry.created_by
-                    journal_entry.save()
-
-            except Account.DoesNotExist:
-                # Handle case where required accounts don't exist
-                pass
+    order_ids, before = instance.__dict__.pop("_invoiced_orders", (set(), {}))
+    credit.apply_changes(before, credit.order_amounts(order_ids))
@@ -0,0 +1,297 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+
+from .ledger import ACCOUNT_FIELDS, account_balances, account_totals, finish_row
+from .posting import ledger_version
+
+AMOUNT_KEYS = (
+    "balance",
+    "debit_amount",
+    "credit_amount",
+    "debit_total",
+    "credit_total",
+)
+BALANCE_KEYS = ("account_id", *ACCOUNT_FIELDS, "balance")
+
+TITLES = {
+    "balance_sheet": "Balance Sheet",
+    "income_statement": "Income Statement",
+    "trial_balance": "Trial Balance",
+    "retained_earnings": "Statement of Retained Earnings",
+}
+
+
+def statement_sections(statement_type, as_of_date, start_date=None):
+    """
+    The account row sets a statement is made of.
+
+    ``balances`` sections hold cumulative balances at ``end_date``,
+    ``totals`` sections the movement between ``start_date`` and ``end_date``.
+    """
+
+    def section(kind, start, end, types):
+        return {
+            "kind": kind,
+            "start_date": start.isoformat() if start else None,
+            "end_date": end.isoformat(),
+            "types": types,
+        }
+
+    if statement_type == "balance_sheet":
+        return {
+            "accounts": section(
+                "balances", None, as_of_date, ["asset", "liability", "equity"]
+            )
+        }
+    if statement_type == "trial_balance":
+        return {"accounts": section("balances", None, as_of_date, None)}
+    if statement_type == "income_statement":
+        return {
+            "accounts": section(
+                "totals", start_date, as_of_date, ["revenue", "expense"]
+            )
+        }
+    if statement_type == "retained_earnings":
+        sections = {
+            "income": section("totals", start_date, as_of_date, ["revenue", "expense"])
+        }
+        if start_date:
+            sections["opening"] = section(
+                "balances", None, start_date - timedelta(days=1), ["equity"]
+            )
+        return sections
+    raise ValueError(f"Unsupported statement type {statement_type!r}")
+
+
+def section_rows(section, posted_after=None, posted_through=None):
+    """Rows of a section, or only the change posted after ``posted_after``"""
+    start = date.fromisoformat(section["start_date"]) if section["start_date"] else None
+    end = date.fromisoformat(section["end_date"])
+    if section["kind"] == "balances" and posted_after is None:
+        return [
+            {key: row[key] for key in (*BALANCE_KEYS, "debit_amount", "credit_amount")}
+            for row in account_balances(end, section["types"], posted_through)
+        ]
+    return account_totals(
+        start,
+        end,
+        types=section["types"],
+        posted_after=posted_after,
+        posted_through=posted_through,
+    )
+
+
+def merge_rows(section, rows, changes):
+    """Add the rows of ``changes`` into ``rows``, both keyed by account"""
+    by_account = {row["account_id"]: row for row in rows}
+    keys = BALANCE_KEYS if section["kind"] == "balances" else None
+    for change in changes:
+        row = by_account.get(change["account_id"])
+        if row is None:
+            by_account[change["account_id"]] = {
+                key: change[key] for key in keys or change
+            }
+            continue
+        for key in ("balance", "debit_total", "credit_total"):
+            if key in row:
+                row[key] += change[key]
+    return [
+        finish_row(row) for row in sorted(by_account.values(), key=lambda r: r["code"])
+    ]
+
+
+def summarize(statement_type, sections):
+    """Statement totals from the account rows of its sections"""
+
+    def total(name, account_type=None, key="balance"):
+        return sum(
+            (
+                row[key]
+                for row in sections[name]["rows"]
+                if account_type is None or row["type"] == account_type
+            ),
+            Decimal("0.00"),
+        )
+
+    if statement_type == "balance_sheet":
+        return {
+            "total_assets": total("accounts", "asset"),
+            "total_liabilities": total("accounts", "liability"),
+            "total_equity": total("accounts", "equity"),
+        }
+    if statement_type == "trial_balance":
+        return {
+            "total_debits": total("accounts", key="debit_amount"),
+            "total_credits": total("accounts", key="credit_amount"),
+        }
+
+    name = "accounts" if statement_type == "income_statement" else "income"
+    totals = {
+        "total_revenue": total(name, "revenue"),
+        "total_expenses": total(name, "expense"),
+    }
+    totals["net_income"] = totals["total_revenue"] - totals["total_expenses"]
+    if statement_type == "retained_earnings":
+        totals["opening_balance"] = total("opening") if "opening" in sections else 0
+        totals["closing_balance"] = totals["opening_balance"] + totals["net_income"]
+    return totals
+
+
+def encode(value):
+    """Make Decimal amounts JSON serializable"""
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def decode(data):
+    """Inverse of encode() for stored statement data"""
+    for section in data["sections"].values():
+        for row in section["rows"]:
+            for key in AMOUNT_KEYS:
+                if key in row:
+                    row[key] = Decimal(row[key])
+    data["totals"] = {key: Decimal(value) for key, value in data["totals"].items()}
+    return data
+
+
+def build_data(statement_type, as_of_date, start_date, version):
+    sections = statement_sections(statement_type, as_of_date, start_date)
+    for section in sections.values():
+        section["rows"] = section_rows(section, posted_through=version)
+    return {"sections": sections, "totals": summarize(statement_type, sections)}
+
+
+def refresh_data(statement_type, data, since, version):
+    """
+    Fold the postings made between two ledger versions into stored data.
+
+    The version also moves without posting anything when the chart of
+    accounts changes, which the stored rows cannot be patched for; the
+    rows are then generated again.
+    """
+    from .models import JournalEntry
+
+    posted_versions = (
+        JournalEntry.objects.filter(
+            posted_version__gt=since, posted_version__lte=version
+        )
+        .values("posted_version")
+        .distinct()
+        .count()
+    )
+    if posted_versions < version - since:
+        for section in data["sections"].values():
+            section["rows"] = section_rows(section, posted_through=version)
+        data["totals"] = summarize(statement_type, data["sections"])
+        return data
+
+    changed = False
+    for section in data["sections"].values():
+        changes = section_rows(section, posted_after=since, posted_through=version)
+        if changes:
+            section["rows"] = merge_rows(section, section["rows"], changes)
+            changed = True
+    if changed:
+        data["totals"] = summarize(statement_type, data["sections"])
+    return data
+
+
+def current_statement(
+    statement_type,
+    as_of_date,
+    start_date=None,
+    fiscal_year=None,
+    period=None,
+    user=None,
+    store=False,
+):
+    """
+    Statement data for the given dates, served from FinancialStatement.data.
+
+    The stored statement is stamped with the ledger version it reflects. When
+    postings happened since, only the lines posted after that version are
+    aggregated and folded into the stored rows; a statement is generated from
+    scratch only when none is stored or the chart of accounts changed. Nothing is written unless ``store`` is
+    set, which saves the refreshed or new statement. Without a fiscal year
+    covering the dates there is nothing to store it against, so it is built
+    on the fly. Returns a dict with ``sections`` (account rows) and ``totals``.
+    """
+    from .models import FinancialStatement, FiscalYear
+
+    version = ledger_version()
+    if fiscal_year is None:
+        fiscal_year = FiscalYear.objects.filter(
+            start_date__lte=as_of_date, end_date__gte=as_of_date
+        ).first()
+    if fiscal_year is None:
+        return build_data(statement_type, as_of_date, start_date, version)
+
+    lookup = {
+        "statement_type": statement_type,
+        "fiscal_year": fiscal_year,
+        "period": period,
+        "as_of_date": as_of_date,
+    }
+    statement = FinancialStatement.objects.filter(**lookup).order_by("-id").first()
+    if statement and statement.high_water_mark == version:
+        return decode(statement.data)
+    if not store:
+        if statement:
+            return refresh_data(
+                statement_type,
+                decode(statement.data),
+                statement.high_water_mark,
+                version,
+            )
+        return build_data(statement_type, as_of_date, start_date, version)
+
+    with transaction.atomic():
+        statement = (
+            FinancialStatement.objects.select_for_update()
+            .filter(**lookup)
+            .order_by("-id")
+            .first()
+        )
+        if statement and statement.high_water_mark >= version:
+            return decode(statement.data)
+
+        if statement:
+            data = refresh_data(
+                statement_type,
+                decode(statement.data),
+                statement.high_water_mark,
+                version,
+            )
+        else:
+            data = build_data(statement_type, as_of_date, start_date, version)
+            statement = FinancialStatement(
+                **lookup,
+                title=f"{TITLES[statement_type]} as of {as_of_date:%b %d, %Y}",
+                generated_by=user,
+            )
+        statement.data = encode(data)
+        statement.high_water_mark = version
+        statement.save()
+    return data
+
+
+def regenerate_statement(statement):
+    """Rebuild a stored statement from scratch at the current ledger version"""
+    version = ledger_version()
+    start_date = None
+    if statement.statement_type in ("income_statement", "retained_earnings"):
+        start_date = (statement.period or statement.fiscal_year).start_date
+    data = build_data(
+        statement.statement_type, statement.as_of_date, start_date, version
+    )
+    statement.data = encode(data)
+    statement.high_water_mark = version
+    statement.save(update_fields=["data", "high_water_mark"])
+    return data
@@ -1,3 +1,1530 @@
-from django.test import TestCase
+import ast
+import json
+import tempfile
+import zipfile
+from array import array
+import threading
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from inventory.models import Supplier
+from procurement.models import Vendor as ProcurementVendor
+from shop.models import Order
+from .aging import aging_detail, aging_report
+from .balances import balances_as_of
+from .closing import close_periods
+from .counters import reset_ytd
+from .credit import exposure, rebuild_exposure
+from .payments import read_camt
+from .ledger import (
+    account_balances,
+    account_ledger,
+    account_totals,
+    dashboard_kpis,
+    range_totals,
+)
+from .models import (
+    Account,
+    AccountBalance,
+    AccountType,
+    Bill,
+    CreditExposure,
+    Customer,
+    DocumentSequence,
+    FinancialPeriod,
+    FinancialStatement,
+    FiscalYear,
+    Journal,
+    Invoice,
+    InvoicePayment,
+    JournalEntry,
+    JournalEntryLine,
+    PostingJob,
+    Vendor,
+)
+from .posting import ledger_version, post_many
+from .posting_queue import enqueue, process_batch, queue_stats
+from .statements import current_statement, decode, regenerate_statement
+from .views import filter_balance, sort_documents
+from . import credit, posting_rules, sequences
+
+
+class LedgerFixtureMixin:
+    def create_ledger(self):
+        self.user = CustomUser.objects.create_user(
+            email="accountant@example.com",
+            password="secret",
+            first_name="Ada",
+            last_name="Lovelace",
+        )
+        asset = AccountType.objects.create(name="Assets", type="asset")
+        revenue = AccountType.objects.create(name="Revenue", type="revenue")
+        self.receivable = Account.objects.create(
+            code="1200", name="Accounts Receivable", account_type=asset
+        )
+        self.sales = Account.objects.create(
+            code="4000", name="Sales Revenue", account_type=revenue
+        )
+        self.journal = Journal.objects.create(code="SJ", name="Sales Journal")
+        self.fiscal_year = FiscalYear.objects.create(
+            name="FY", start_date=date(2025, 1, 1), end_date=date(2025, 12, 31)
+        )
+
+    def create_entry(self, number, amount, entry_date=date(2025, 3, 1)):
+        entry = JournalEntry.objects.create(
+            journal=self.journal,
+            fiscal_year=self.fiscal_year,
+            entry_number=number,
+            date=entry_date,
+            description="Sale",
+        )
+        entry.lines.create(account=self.receivable, debit_amount=amount)
+        entry.lines.create(account=self.sales, credit_amount=amount)
+        return entry
+
+    def create_periods(self):
+        self.january = FinancialPeriod.objects.create(
+            fiscal_year=self.fiscal_year,
+            name="January",
+            start_date=date(2025, 1, 1),
+            end_date=date(2025, 1, 31),
+        )
+        self.february = FinancialPeriod.objects.create(
+            fiscal_year=self.fiscal_year,
+            name="February",
+            start_date=date(2025, 2, 1),
+            end_date=date(2025, 2, 28),
+        )
+
+
+class PostingTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+
+    def test_post_updates_balances(self):
+        entry = self.create_entry("JE-1", Decimal("100.00"))
+        entry.post(self.user)
+
+        entry.refresh_from_db()
+        self.receivable.refresh_from_db()
+        self.sales.refresh_from_db()
+        self.assertEqual(entry.status, "posted")
+        self.assertEqual(self.receivable.current_balance, Decimal("100.00"))
+        self.assertEqual(self.sales.current_balance, Decimal("100.00"))
+
+    def test_post_many_issues_one_update_per_account(self):
+        entries = [self.create_entry(f"JE-{i}", Decimal("10.00")) for i in range(20)]
+
+        # Savepoint, lock entries, balance check, account totals, account lock,
+        # two account updates, period and snapshot lookups, the status update
+        # and savepoint release
+        with self.assertNumQueries(14):
+            post_many(entries, self.user)
+
+        self.receivable.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, Decimal("200.00"))
+
+    def test_only_chart_changes_move_the_ledger_version(self):
+        version = ledger_version()
+        self.sales.description = "Sales of goods"
+        self.sales.save()
+        self.assertEqual(ledger_version(), version)
+
+        self.sales.code = "4100"
+        self.sales.save()
+        self.assertEqual(ledger_version(), version + 1)
+        # Statements show account names
+        self.sales.name = "Revenue"
+        self.sales.save()
+        self.assertEqual(ledger_version(), version + 2)
+
+    def test_post_rejects_unbalanced_entry(self):
+        entry = self.create_entry("JE-1", Decimal("100.00"))
+        entry.lines.create(account=self.receivable, debit_amount=Decimal("1.00"))
+
+        with self.assertRaises(ValueError):
+            entry.post(self.user)
+
+        self.receivable.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, 0)
+
+    def test_post_rejects_posted_entry(self):
+        entry = self.create_entry("JE-1", Decimal("100.00"))
+        post_many([entry.id], self.user)
+
+        with self.assertRaises(ValueError):
+            post_many([entry.id], self.user)
+
+
+class BalanceSnapshotTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        self.create_periods()
+
+    def balance_on(self, day):
+        return balances_as_of(day).get(id=self.receivable.id).balance
+
+    def test_balance_as_of_date(self):
+        self.create_entry("JE-1", Decimal("10.00"), date(2025, 1, 10)).post(self.user)
+        self.january.close(self.user)
+        self.create_entry("JE-2", Decimal("5.00"), date(2025, 2, 10)).post(self.user)
+        self.create_entry("JE-3", Decimal("2.00"), date(2025, 3, 10)).post(self.user)
+
+        self.assertEqual(self.balance_on(date(2024, 12, 31)), 0)
+        self.assertEqual(self.balance_on(date(2025, 1, 31)), Decimal("10.00"))
+        self.assertEqual(self.balance_on(date(2025, 2, 15)), Decimal("15.00"))
+        self.assertEqual(self.balance_on(date(2025, 3, 31)), Decimal("17.00"))
+
+    def test_backdated_posting_moves_later_snapshots(self):
+        self.create_entry("JE-1", Decimal("10.00"), date(2025, 2, 10)).post(self.user)
+        self.create_entry("JE-2", Decimal("4.00"), date(2025, 1, 10)).post(self.user)
+
+        january = AccountBalance.objects.get(
+            account=self.receivable, period=self.january
+        )
+        february = AccountBalance.objects.get(
+            account=self.receivable, period=self.february
+        )
+        self.assertEqual(january.closing_balance, Decimal("4.00"))
+        self.assertEqual(january.debit_total, Decimal("4.00"))
+        self.assertEqual(february.closing_balance, Decimal("14.00"))
+        self.assertEqual(february.debit_total, Decimal("10.00"))
+        self.assertEqual(self.balance_on(date(2025, 1, 31)), Decimal("4.00"))
+
+
+class ClosingTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        self.create_periods()
+        posting_rules.invalidate()
+
+    def test_close_periods_freezes_every_period_at_once(self):
+        self.create_entry("JE-1", Decimal("10.00"), date(2025, 1, 10)).post(self.user)
+        self.create_entry("JE-2", Decimal("5.00"), date(2025, 2, 10)).post(self.user)
+
+        # Savepoint, periods, movements, opening balances, upsert, update, release
+        with self.assertNumQueries(7):
+            closed = close_periods([self.january, self.february], self.user)
+
+        self.assertEqual(len(closed), 2)
+        snapshots = {
+            snapshot.period_id: snapshot
+            for snapshot in AccountBalance.objects.filter(account=self.receivable)
+        }
+        self.assertEqual(snapshots[self.january.pk].closing_balance, Decimal("10.00"))
+        self.assertEqual(snapshots[self.february.pk].closing_balance, Decimal("15.00"))
+        self.assertEqual(snapshots[self.february.pk].debit_total, Decimal("5.00"))
+        self.assertFalse(FinancialPeriod.objects.filter(status="open").exists())
+
+    def test_posting_into_closed_period_is_rejected(self):
+        self.january.close(self.user)
+
+        with self.assertRaisesMessage(ValueError, "closed period January"):
+            self.create_entry("JE-1", Decimal("1.00"), date(2025, 1, 15)).post(
+                self.user
+            )
+        self.create_entry("JE-2", Decimal("1.00"), date(2025, 2, 15)).post(self.user)
+        self.receivable.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, Decimal("1.00"))
+
+    def test_year_end_closing_moves_income_to_retained_earnings(self):
+        expense = Account.objects.create(
+            code="5000",
+            name="Cost of Goods Sold",
+            account_type=AccountType.objects.create(name="Expenses", type="expense"),
+        )
+        retained = Account.objects.create(
+            code="3200",
+            name="Retained Earnings",
+            account_type=AccountType.objects.create(name="Equity", type="equity"),
+        )
+        self.create_entry("JE-1", Decimal("100.00"), date(2025, 1, 10)).post(self.user)
+        cost = self.create_entry("JE-2", Decimal("0.00"), date(2025, 2, 10))
+        cost.lines.create(account=expense, debit_amount=Decimal("30.00"))
+        cost.lines.create(account=self.receivable, credit_amount=Decimal("30.00"))
+        cost.post(self.user)
+        self.january.close(self.user)
+
+        entry = self.fiscal_year.close(self.user)
+
+        self.assertEqual(entry.status, "posted")
+        self.assertEqual(entry.lines.count(), 3)
+        balances = dict(
+            balances_as_of(date(2025, 12, 31)).values_list("code", "balance")
+        )
+        self.assertEqual(balances["4000"], 0)
+        self.assertEqual(balances["5000"], 0)
+        self.assertEqual(balances["3200"], Decimal("70.00"))
+        retained.refresh_from_db()
+        self.assertEqual(retained.current_balance, Decimal("70.00"))
+        self.assertTrue(FiscalYear.objects.get(pk=self.fiscal_year.pk).is_closed)
+        self.assertFalse(FinancialPeriod.objects.filter(status="open").exists())
+        with self.assertRaisesMessage(ValueError, "already closed"):
+            self.fiscal_year.close(self.user)
+
+
+class LedgerAggregationTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        self.create_periods()
+
+    def test_account_totals_is_one_query(self):
+        self.create_entry("JE-1", Decimal("10.00"), date(2025, 1, 10)).post(self.user)
+        self.create_entry("JE-2", Decimal("5.00"), date(2025, 2, 10)).post(self.user)
+        self.create_entry("JE-3", Decimal("7.00"), date(2025, 2, 11))
+
+        with self.assertNumQueries(1):
+            rows = account_totals(date(2025, 2, 1), date(2025, 2, 28))
+
+        self.assertEqual([row["code"] for row in rows], ["1200", "4000"])
+        self.assertEqual(rows[0]["debit_total"], Decimal("5.00"))
+        self.assertEqual(rows[0]["debit_amount"], Decimal("5.00"))
+        self.assertEqual(rows[1]["credit_amount"], Decimal("5.00"))
+
+        rows = account_totals(statuses=["posted", "draft"], types=["revenue"])
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["balance"], Decimal("22.00"))
+
+    def test_account_balances_match_balances_as_of(self):
+        self.create_entry("JE-1", Decimal("10.00"), date(2025, 1, 10)).post(self.user)
+        self.january.close(self.user)
+        self.create_entry("JE-2", Decimal("5.00"), date(2025, 2, 10)).post(self.user)
+        Account.objects.create(
+            code="1100", name="Cash", account_type=self.receivable.account_type
+        )
+        Account.objects.create(
+            code="1900",
+            name="Closed",
+            account_type=self.receivable.account_type,
+            is_active=False,
+        )
+
+        rows = account_balances(date(2025, 2, 28))
+        # Accounts without lines are listed, inactive ones are not
+        self.assertEqual([row["code"] for row in rows], ["1100", "1200", "4000"])
+        self.assertEqual([row["balance"] for row in rows], [0, 15, 15])
+        self.assertEqual(sum(row["debit_amount"] for row in rows), 15)
+        self.assertEqual(sum(row["credit_amount"] for row in rows), 15)
+        self.assertEqual(
+            {row["account_id"]: row["balance"] for row in rows},
+            dict(
+                balances_as_of(date(2025, 2, 28))
+                .filter(is_active=True)
+                .values_list("id", "balance")
+            ),
+        )
+        self.assertEqual(
+            [row["balance"] for row in account_balances(date(2025, 1, 31))],
+            [0, 10, 10],
+        )
+
+
+class FinancialStatementTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+
+    def trial_balance(self, store=True):
+        return current_statement(
+            "trial_balance", date(2025, 6, 30), user=self.user, store=store
+        )
+
+    def test_stored_statement_is_served_until_something_is_posted(self):
+        self.create_entry("JE-1", Decimal("10.00")).post(self.user)
+        self.assertEqual(self.trial_balance()["totals"]["total_debits"], 10)
+
+        with self.assertNumQueries(3):
+            data = self.trial_balance()
+        self.assertEqual(data["totals"]["total_credits"], 10)
+
+        statement = FinancialStatement.objects.get()
+        self.assertEqual(statement.fiscal_year, self.fiscal_year)
+        self.assertEqual(statement.high_water_mark, ledger_version())
+
+    def test_refresh_folds_in_later_postings(self):
+        # Drafted first, so its lines have lower ids than JE-2's
+        backdated = self.create_entry("JE-1", Decimal("4.00"), date(2025, 2, 1))
+        self.create_entry("JE-2", Decimal("10.00")).post(self.user)
+        self.trial_balance()
+
+        backdated.post(self.user)
+        self.create_entry("JE-3", Decimal("99.00"), date(2025, 7, 1)).post(self.user)
+        data = self.trial_balance()
+
+        self.assertEqual(data["totals"]["total_debits"], Decimal("14.00"))
+        statement = FinancialStatement.objects.get()
+        self.assertEqual(
+            regenerate_statement(statement)["sections"],
+            decode(statement.data)["sections"],
+        )
+
+    def test_account_changes_regenerate_the_statement(self):
+        self.create_entry("JE-1", Decimal("10.00")).post(self.user)
+        self.trial_balance()
+
+        self.sales.name = "Revenue"
+        self.sales.save()
+        rows = self.trial_balance()["sections"]["accounts"]["rows"]
+        self.assertIn("Revenue", [row["name"] for row in rows])
+
+        # Moved under another type along with a new posting
+        self.sales.account_type = self.receivable.account_type
+        self.sales.save()
+        self.create_entry("JE-2", Decimal("5.00")).post(self.user)
+        data = self.trial_balance()
+        statement = FinancialStatement.objects.get()
+        self.assertEqual(regenerate_statement(statement), data)
+
+    def test_statements_are_only_stored_when_asked_to(self):
+        self.create_entry("JE-1", Decimal("10.00")).post(self.user)
+        self.assertEqual(self.trial_balance(store=False)["totals"]["total_debits"], 10)
+        self.assertFalse(FinancialStatement.objects.exists())
+
+        self.trial_balance()
+        self.create_entry("JE-2", Decimal("5.00")).post(self.user)
+        data = self.trial_balance(store=False)
+        self.assertEqual(data["totals"]["total_debits"], Decimal("15.00"))
+        statement = FinancialStatement.objects.get()
+        self.assertLess(statement.high_water_mark, ledger_version())
+
+    def test_refreshing_the_balance_sheet_stores_it(self):
+        self.user.user_permissions.add(
+            Permission.objects.get(codename="view_financialstatement")
+        )
+        self.client.force_login(self.user)
+        url = (
+            reverse("accounting:balance_sheet") + f"?fiscal_year={self.fiscal_year.id}"
+        )
+
+        self.assertRedirects(self.client.post(url), url, fetch_redirect_response=False)
+        statement = FinancialStatement.objects.get()
+        self.assertEqual(statement.statement_type, "balance_sheet")
+        self.assertEqual(statement.as_of_date, self.fiscal_year.end_date)
+
+    def test_retained_earnings(self):
+        self.create_entry("JE-1", Decimal("10.00")).post(self.user)
+        data = current_statement(
+            "retained_earnings",
+            date(2025, 12, 31),
+            date(2025, 1, 1),
+            fiscal_year=self.fiscal_year,
+        )
+        self.assertEqual(data["totals"]["net_income"], Decimal("10.00"))
+        self.assertEqual(data["totals"]["closing_balance"], Decimal("10.00"))
+
+
+class AccountLedgerTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        entries = [
+            self.create_entry(f"JE-{day}", Decimal(day), date(2025, 3, day))
+            for day in range(1, 8)
+        ]
+        post_many(entries, self.user)
+
+    def test_keyset_pages_carry_the_running_balance(self):
+        first = account_ledger(self.receivable, page_size=3)
+        self.assertIsNone(first["previous_cursor"])
+        self.assertEqual([line.running_balance for line in first["lines"]], [1, 3, 6])
+
+        # The page and the balance at the cursor
+        with self.assertNumQueries(2):
+            second = account_ledger(
+                self.receivable, after=first["next_cursor"], page_size=3
+            )
+        self.assertEqual(
+            [line.running_balance for line in second["lines"]], [10, 15, 21]
+        )
+
+        last = account_ledger(self.receivable, after=second["next_cursor"], page_size=3)
+        self.assertEqual([line.running_balance for line in last["lines"]], [28])
+        self.assertIsNone(last["next_cursor"])
+
+        back = account_ledger(
+            self.receivable, before=last["previous_cursor"], page_size=3
+        )
+        self.assertEqual([line.running_balance for line in back["lines"]], [10, 15, 21])
+        self.assertEqual(back["next_cursor"], second["next_cursor"])
+
+    def test_cursors_only_hold_the_position(self):
+        first = account_ledger(self.receivable, page_size=3)
+        cursor = first["next_cursor"]
+        self.assertEqual(cursor, f"2025-03-03.{first['lines'][-1].id}")
+        with self.assertRaises(ValueError):
+            account_ledger(self.receivable, after=f"{cursor}.1000000", page_size=3)
+
+        # Backdated postings are reflected on pages already handed out
+        post_many(
+            [self.create_entry("JE-0", Decimal("100.00"), date(2025, 2, 1))], None
+        )
+        second = account_ledger(self.receivable, after=cursor, page_size=3)
+        self.assertEqual(
+            [line.running_balance for line in second["lines"]], [110, 115, 121]
+        )
+
+    def test_date_range_starts_from_the_opening_balance(self):
+        ledger = account_ledger(self.sales, date(2025, 3, 3), date(2025, 3, 4))
+        self.assertEqual(ledger["opening_balance"], Decimal("3.00"))
+        self.assertEqual([line.running_balance for line in ledger["lines"]], [6, 10])
+
+    def test_range_totals_cover_every_page(self):
+        with self.assertNumQueries(1):
+            totals = range_totals(self.sales, date(2025, 3, 2), date(2025, 3, 6))
+        self.assertEqual(totals["credit_total"], Decimal("20.00"))
+        self.assertEqual(totals["debit_total"], 0)
+
+    def test_line_dates_follow_the_entry(self):
+        entry = JournalEntry.objects.get(entry_number="JE-1")
+        entry.date = date(2025, 3, 31)
+        entry.save()
+        self.assertEqual(
+            set(entry.lines.values_list("entry_date", flat=True)), {date(2025, 3, 31)}
+        )
+
+
+class AgingTests(LedgerFixtureMixin, TestCase):
+    AS_OF = date(2025, 6, 30)
+
+    def setUp(self):
+        self.create_ledger()
+        self.customer = Customer.objects.create(
+            user=self.user, receivable_account=self.receivable
+        )
+
+    def invoice(self, number, due_date, amount, paid="0.00", status="sent"):
+        return Invoice.objects.create(
+            customer=self.customer,
+            invoice_number=number,
+            invoice_date=date(2025, 1, 1),
+            due_date=due_date,
+            amount=Decimal(amount),
+            tax_amount=Decimal("0.00"),
+            paid_amount=Decimal(paid),
+            status=status,
+        )
+
+    def test_buckets_are_summed_in_one_query(self):
+        self.invoice("INV-1", date(2025, 7, 15), "100.00", paid="40.00")
+        self.invoice("INV-2", date(2025, 6, 29), "10.00")
+        self.invoice("INV-3", date(2025, 5, 15), "20.00")
+        self.invoice("INV-4", date(2025, 3, 1), "30.00")
+        self.invoice("INV-5", date(2025, 3, 1), "30.00", status="paid")
+        self.invoice("INV-6", date(2025, 3, 1), "30.00", paid="30.00")
+
+        with self.assertNumQueries(1):
+            rows, totals = aging_report("receivables", self.AS_OF)
+
+        self.assertEqual(len(rows), 1)
+        row = rows[0]
+        self.assertEqual(row["party_id"], self.customer.id)
+        self.assertEqual(row["current"], Decimal("60.00"))
+        self.assertEqual(row["days_1_30"], Decimal("10.00"))
+        self.assertEqual(row["days_31_60"], Decimal("20.00"))
+        self.assertEqual(row["days_61_90"], Decimal("0.00"))
+        self.assertEqual(row["days_90_plus"], Decimal("30.00"))
+        self.assertEqual(totals["total"], Decimal("120.00"))
+
+    def test_drill_down(self):
+        self.invoice("INV-1", date(2025, 6, 29), "10.00")
+        self.invoice("INV-2", date(2025, 3, 1), "30.00")
+
+        documents = list(aging_detail("receivables", self.AS_OF, bucket="days_90_plus"))
+        self.assertEqual([d.invoice_number for d in documents], ["INV-2"])
+        self.assertEqual(documents[0].bucket, "days_90_plus")
+        self.assertEqual(documents[0].remaining, Decimal("30.00"))
+        documents = aging_detail("receivables", self.AS_OF, party_id=self.customer.id)
+        self.assertEqual(documents.count(), 2)
+
+
+class DashboardTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_ledger()
+
+    def test_kpis_are_cached_until_the_next_posting(self):
+        post_many([self.create_entry("JE-1", Decimal("25.00"))], self.user)
+
+        with self.assertNumQueries(2):
+            kpis = dashboard_kpis()
+        self.assertEqual(kpis["receivable_balance"], Decimal("25.00"))
+        self.assertEqual(kpis["total_revenue"], Decimal("25.00"))
+        with self.assertNumQueries(1):
+            dashboard_kpis()
+
+        post_many([self.create_entry("JE-2", Decimal("5.00"))], self.user)
+        self.assertEqual(dashboard_kpis()["receivable_balance"], Decimal("30.00"))
+
+
+class AccountTreeTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        asset = self.receivable.account_type
+        self.current = Account.objects.create(
+            code="1000", name="Current Assets", account_type=asset
+        )
+        self.receivable.parent = self.current
+        self.receivable.save()
+        self.trade = Account.objects.create(
+            code="1210",
+            name="Trade Receivables",
+            account_type=asset,
+            parent=self.receivable,
+            current_balance=Decimal("3.00"),
+        )
+        Account.objects.filter(pk=self.receivable.pk).update(
+            current_balance=Decimal("2.00")
+        )
+
+    def test_paths_follow_parents(self):
+        self.trade.refresh_from_db()
+        self.assertEqual(self.trade.path, "1000/1200/1210/")
+        self.assertEqual(self.trade.depth, 2)
+        self.assertEqual(
+            list(Account.objects.subtree(self.current).values_list("code", flat=True)),
+            ["1000", "1200", "1210"],
+        )
+
+    def test_move_reroots_subtree(self):
+        self.receivable.refresh_from_db()
+        self.receivable.parent = None
+        self.receivable.save()
+
+        self.trade.refresh_from_db()
+        self.assertEqual(self.trade.path, "1200/1210/")
+        self.assertEqual(self.trade.depth, 1)
+
+    def test_cannot_move_below_own_subtree(self):
+        self.current.refresh_from_db()
+        self.current.parent = self.trade
+        with self.assertRaises(ValueError):
+            self.current.save()
+
+    def test_tree_with_rollups_is_two_queries(self):
+        # The accounts, then every path and balance to sum the subtrees
+        with self.assertNumQueries(2):
+            tree = list(Account.objects.tree().with_subtree_balance())
+
+        by_code = {account.code: account for account in tree}
+        self.assertEqual([a.code for a in tree][:3], ["1000", "1200", "1210"])
+        self.assertEqual(by_code["1000"].subtree_balance, Decimal("5.00"))
+        self.assertEqual(by_code["1200"].subtree_balance, Decimal("5.00"))
+        self.assertTrue(by_code["1200"].has_children)
+        self.assertFalse(by_code["1210"].has_children)
+
+
+class ImportJournalTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+
+    def write_jsonl(self, directory, rows):
+        path = Path(directory) / "lines.jsonl"
+        path.write_text("\n".join(json.dumps(row) for row in rows))
+        return path
+
+    def line(self, number, account, debit="", credit=""):
+        return {
+            "entry_number": number,
+            "date": "2025-03-01",
+            "journal": "SJ",
+            "description": "Imported",
+            "account": account,
+            "debit": debit,
+            "credit": credit,
+        }
+
+    def test_import_groups_lines_and_rejects_bad_entries(self):
+        rows = [
+            self.line("IMP-1", "1200", debit="10.00"),
+            self.line("IMP-1", "4000", credit="10.00"),
+            self.line("IMP-2", "1200", debit="10.00"),
+            self.line("IMP-2", "4000", credit="9.00"),
+            self.line("IMP-3", "9999", debit="1.00"),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_jsonl(directory, rows)
+            call_command("import_journal", str(path), "--post", stdout=StringIO())
+            rejects = (Path(directory) / "lines.jsonl.rejects.csv").read_text()
+
+        entry = JournalEntry.objects.get()
+        self.assertEqual(entry.entry_number, "IMP-1")
+        self.assertEqual(entry.status, "posted")
+        self.assertEqual(entry.fiscal_year, self.fiscal_year)
+        self.receivable.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, Decimal("10.00"))
+        self.assertIn("unbalanced", rejects)
+        self.assertIn("unknown account '9999'", rejects)
+
+    def test_entries_in_closed_periods_are_rejected_when_posting(self):
+        self.create_periods()
+        self.january.close(self.user)
+        closed = self.line("IMP-2", "1200", debit="5.00")
+        rows = [
+            self.line("IMP-1", "1200", debit="10.00"),
+            self.line("IMP-1", "4000", credit="10.00"),
+            {**closed, "date": "2025-01-15"},
+            {**self.line("IMP-2", "4000", credit="5.00"), "date": "2025-01-15"},
+            self.line("IMP-3", "1200", debit="1.00"),
+            self.line("IMP-3", "4000", credit="1.00"),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_jsonl(directory, rows)
+            out = StringIO()
+            call_command("import_journal", str(path), "--post", stdout=out)
+            rejects = (Path(directory) / "lines.jsonl.rejects.csv").read_text()
+
+        self.assertEqual(
+            list(
+                JournalEntry.objects.order_by("entry_number").values_list(
+                    "entry_number", "status"
+                )
+            ),
+            [("IMP-1", "posted"), ("IMP-3", "posted")],
+        )
+        self.assertEqual(JournalEntryLine.objects.count(), 4)
+        self.assertIn("Imported 2 entries / 4 lines", out.getvalue())
+        self.assertIn("IMP-2", rejects)
+        self.assertIn("closed", rejects)
+
+
+class BankStatementTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        self.customer = Customer.objects.create(
+            user=self.user, receivable_account=self.receivable
+        )
+        payable = Account.objects.create(
+            code="2100",
+            name="Accounts Payable",
+            account_type=AccountType.objects.create(name="Payables", type="liability"),
+        )
+        supplier = Supplier.objects.create(name="Acme", code="ACME")
+        self.vendor = Vendor.objects.create(
+            procurement_vendor=ProcurementVendor.objects.create(
+                supplier=supplier, vendor_type="distributor"
+            ),
+            payable_account=payable,
+        )
+
+    def invoice(self, number, amount, reference=None):
+        return Invoice.objects.create(
+            customer=self.customer,
+            invoice_number=number,
+            reference=reference,
+            invoice_date=date(2025, 3, 1),
+            due_date=date(2025, 3, 31),
+            amount=Decimal(amount),
+            status="sent",
+        )
+
+    def import_statement(self, directory, rows):
+        path = Path(directory) / "statement.csv"
+        lines = ["date,amount,id,reference,description"]
+        lines += [",".join(row) for row in rows]
+        path.write_text("\n".join(lines))
+        out = StringIO()
+        call_command("import_bank_statement", str(path), stdout=out)
+        unmatched = Path(directory) / "statement.csv.unmatched.csv"
+        return out.getvalue(), unmatched.read_text() if unmatched.exists() else ""
+
+    def test_statement_pays_invoices_and_bills(self):
+        full = self.invoice("2025-000101", "100.00")
+        partial = self.invoice("2025-000102", "50.00", reference="PO-77")
+        by_amount = self.invoice("2025-000103", "33.33")
+        bill = Bill.objects.create(
+            vendor=self.vendor,
+            bill_number="7781",
+            bill_date=date(2025, 3, 1),
+            due_date=date(2025, 3, 31),
+            amount=Decimal("80.00"),
+            status="approved",
+        )
+        rows = [
+            ("2025-04-01", "100.00", "B1", "", "Payment INV-2025-000101"),
+            ("2025-04-01", "20.00", "B2", "PO-77", "first part"),
+            ("2025-04-02", "33.34", "B3", "", "thanks"),
+            ("2025-04-02", "-80.00", "B4", "", "BILL 7781"),
+            ("2025-04-03", "999.00", "B5", "", "unknown"),
+            ("yesterday", "1.00", "B6", "", ""),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            output, unmatched = self.import_statement(directory, rows)
+            # Importing the same statement again records nothing new
+            self.import_statement(directory, rows)
+
+        self.assertIn("Matched 4 of 5 transactions", output)
+        self.assertIn("Paid 3 invoices and 1 bills", output)
+        self.assertIn("no match", unmatched)
+        self.assertIn("invalid date", unmatched)
+        for document, paid, status in (
+            (full, "100.00", "paid"),
+            (partial, "20.00", "partially_paid"),
+            (by_amount, "33.34", "paid"),
+            (bill, "80.00", "paid"),
+        ):
+            document.refresh_from_db()
+            self.assertEqual(document.paid_amount, Decimal(paid))
+            self.assertEqual(document.status, status)
+        self.assertEqual(InvoicePayment.objects.count(), 3)
+        self.assertEqual(bill.payments.get().reference, "B4")
+
+    def test_payments_entered_one_at_a_time_update_the_invoice(self):
+        invoice = self.invoice("2025-000201", "40.00")
+        payment = invoice.payments.create(
+            payment_date=date(2025, 4, 1),
+            amount=Decimal("40.00"),
+            payment_method="cash",
+        )
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, "paid")
+
+        payment.delete()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.paid_amount, 0)
+        self.assertEqual(invoice.status, "sent")
+
+    def test_camt_debit_entries_are_negative(self):
+        statement = {
+            "Stmt": {
+                "Ntry": [
+                    {"BookgDt": "2025-04-01", "Amt": "5.00", "CdtDbtInd": "DBIT"},
+                    {"BookgDt": "2025-04-01", "Amt": "7.00", "CdtDbtInd": "CRDT"},
+                ]
+            }
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "statement.json"
+            path.write_text(json.dumps(statement))
+            amounts = [row["amount"] for row in read_camt(path)]
+        self.assertEqual(amounts, [Decimal("-5.00"), Decimal("7.00")])
+
+
+class PartyCounterTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        self.today = timezone.localdate()
+        self.customer = Customer.objects.create(
+            user=self.user, receivable_account=self.receivable
+        )
+        payable = Account.objects.create(
+            code="2100",
+            name="Accounts Payable",
+            account_type=AccountType.objects.create(name="Payables", type="liability"),
+        )
+        supplier = Supplier.objects.create(name="Acme", code="ACME")
+        self.vendor = Vendor.objects.create(
+            procurement_vendor=ProcurementVendor.objects.create(
+                supplier=supplier, vendor_type="distributor"
+            ),
+            payable_account=payable,
+        )
+
+    def invoice(self, amount, status="sent", invoice_date=None):
+        return Invoice.objects.create(
+            customer=self.customer,
+            invoice_date=invoice_date or self.today,
+            due_date=invoice_date or self.today,
+            amount=Decimal(amount),
+            tax_amount=Decimal("10.00"),
+            status=status,
+        )
+
+    def assertCounters(self, party, balance, ytd):
+        party.refresh_from_db()
+        ytd_field = "ytd_sales" if isinstance(party, Customer) else "ytd_purchases"
+        self.assertEqual(
+            (party.current_balance, getattr(party, ytd_field)),
+            (Decimal(balance), Decimal(ytd)),
+        )
+
+    def test_documents_and_payments_move_the_counters(self):
+        invoice = self.invoice("100.00", status="draft")
+        self.assertCounters(self.customer, "0", "0")
+
+        invoice.status = "sent"
+        invoice.save()
+        self.assertCounters(self.customer, "110.00", "100.00")
+
+        payment = InvoicePayment.objects.create(
+            invoice=invoice, payment_date=self.today, amount=Decimal("30.00")
+        )
+        self.assertCounters(self.customer, "80.00", "100.00")
+        payment.delete()
+        self.assertCounters(self.customer, "110.00", "100.00")
+
+        # Last year's invoices are owed but not part of this year's sales
+        old = self.invoice("50.00", invoice_date=date(self.today.year - 1, 6, 1))
+        self.assertCounters(self.customer, "170.00", "100.00")
+        old.delete()
+        invoice.status = "cancelled"
+        invoice.save()
+        self.assertCounters(self.customer, "0", "0")
+
+        Bill.objects.create(
+            vendor=self.vendor,
+            bill_number="B-1",
+            bill_date=self.today,
+            due_date=self.today,
+            amount=Decimal("40.00"),
+            status="approved",
+        )
+        self.assertCounters(self.vendor, "40.00", "40.00")
+
+    def test_rebuild_and_year_rollover(self):
+        invoice = self.invoice("100.00")
+        InvoicePayment.objects.create(
+            invoice=invoice, payment_date=self.today, amount=Decimal("100.00")
+        )
+        Customer.objects.update(current_balance=999, ytd_sales=999)
+
+        out = StringIO()
+        call_command("rebuild_counters", stdout=out)
+        self.assertIn("Rebuilt the counters of 2 customers and vendors", out.getvalue())
+        self.assertCounters(self.customer, "10.00", "100.00")
+
+        reset_ytd(date(self.today.year + 1, 1, 1))
+        self.assertCounters(self.customer, "10.00", "0")
+
+
+class CreditExposureTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        self.customer = Customer.objects.create(
+            user=self.user, receivable_account=self.receivable, credit_limit=100
+        )
+        credit._cache.clear()
+
+    def order(self, amount, status="pending"):
+        # Validated as the admin form would, which checks the credit limit
+        order = Order(
+            user=self.user,
+            status=status,
+            total_amount=Decimal(amount),
+            shipping_address="Street 1",
+            billing_address="Street 1",
+            email=self.user.email,
+            payment_method="invoice",
+        )
+        order.full_clean(validate_unique=False)
+        order.save()
+        return order
+
+    def open_orders(self):
+        return CreditExposure.objects.get(user=self.user).open_orders
+
+    def test_orders_over_the_limit_are_refused(self):
+        first = self.order("60.00")
+        self.assertEqual(self.open_orders(), Decimal("60.00"))
+        # The cached exposure already includes the first order
+        with self.assertNumQueries(0):
+            self.assertEqual(exposure(self.user.id), (100, Decimal("60.00")))
+        with self.assertRaises(ValidationError) as raised:
+            self.order("50.00")
+        self.assertEqual(raised.exception.error_dict["__all__"][0].code, "credit_limit")
+
+        first.status = "canceled"
+        first.save()
+        self.assertEqual(self.open_orders(), 0)
+        credit._cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(exposure(self.user.id), (100, 0))
+        second = self.order("50.00")
+
+        # Invoicing moves the order into the receivable balance
+        invoice = Invoice.objects.create(
+            customer=self.customer,
+            order=second,
+            invoice_date=date(2025, 3, 1),
+            due_date=date(2025, 3, 31),
+            amount=Decimal("50.00"),
+            status="sent",
+        )
+        self.assertEqual(self.open_orders(), 0)
+        credit._cache.clear()
+        self.assertEqual(exposure(self.user.id), (100, Decimal("50.00")))
+        invoice.delete()
+        self.assertEqual(self.open_orders(), Decimal("50.00"))
+
+        CreditExposure.objects.update(open_orders=999)
+        self.assertEqual(rebuild_exposure(), 1)
+        self.assertEqual(self.open_orders(), Decimal("50.00"))
+
+
+class DocumentTotalsTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        self.customer = Customer.objects.create(
+            user=self.user, receivable_account=self.receivable
+        )
+
+    def invoice(self, number, amount, paid="0.00"):
+        return Invoice.objects.create(
+            customer=self.customer,
+            invoice_number=number,
+            invoice_date=date(2025, 3, 1),
+            due_date=date(2025, 3, 31),
+            amount=Decimal(amount),
+            paid_amount=Decimal(paid),
+            status="sent",
+        )
+
+    def test_totals_match_the_python_properties(self):
+        invoice = self.invoice("INV-1", "3.30", paid="1.00")
+        line = invoice.lines.create(
+            description="Widget",
+            account=self.sales,
+            quantity=Decimal("3.00"),
+            unit_price=Decimal("1.10"),
+            tax_rate=Decimal("7.50"),
+        )
+
+        annotated = Invoice.objects.with_totals().with_line_totals().get()
+        self.assertEqual(annotated.total, invoice.total_amount)
+        self.assertEqual(annotated.remaining, invoice.remaining_amount)
+        self.assertFalse(annotated.paid_in_full)
+        self.assertEqual(annotated.lines_amount, line.amount)
+        self.assertEqual(annotated.lines_tax_amount, line.tax_amount)
+        self.assertEqual(annotated.lines_total, Decimal("3.5475"))
+        annotated_line = invoice.lines.with_totals().get()
+        self.assertEqual(annotated_line.line_total, line.total_amount)
+
+    def test_lists_sort_and_filter_on_the_balance(self):
+        self.invoice("INV-1", "10.00")
+        self.invoice("INV-2", "30.00", paid="5.00")
+        self.invoice("INV-3", "20.00", paid="20.00")
+        invoices = Invoice.objects.with_totals().select_related("customer__user")
+
+        with self.assertNumQueries(1):
+            numbers = [
+                invoice.invoice_number
+                for invoice in sort_documents(
+                    filter_balance(invoices, {"balance": "open"}),
+                    "-remaining",
+                    "invoice_date",
+                )
+                if invoice.customer.user.email
+            ]
+        self.assertEqual(numbers, ["INV-2", "INV-1"])
+        self.assertEqual(
+            list(
+                filter_balance(invoices, {"min_remaining": "20"}).values_list(
+                    "invoice_number", flat=True
+                )
+            ),
+            ["INV-2"],
+        )
+
+
+class ExportLedgerTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+
+    def read_npz(self, path):
+        """{name: (descr, values)} decoded without NumPy"""
+        columns = {}
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                data = archive.read(member)
+                self.assertEqual(data[:8], b"\x93NUMPY\x01\x00")
+                length = int.from_bytes(data[8:10], "little")
+                self.assertEqual((10 + length) % 64, 0)
+                header = ast.literal_eval(data[10 : 10 + length].decode("latin1"))
+                body = data[10 + length :]
+                if header["descr"].startswith("<U"):
+                    width = int(header["descr"][2:]) * 4
+                    values = [
+                        body[i : i + width].decode("utf-32-le").rstrip("\0")
+                        for i in range(0, len(body), width)
+                    ]
+                else:
+                    values = array("q", body).tolist()
+                self.assertEqual(header["shape"], (len(values),))
+                columns[member[:-4]] = (header["descr"], values)
+        return columns
+
+    def test_full_and_incremental_export(self):
+        self.create_entry("JE-1", Decimal("10.50")).post(self.user)
+        draft = self.create_entry("JE-2", Decimal("2.00"))
+        self.create_entry("JE-3", Decimal("7.00")).post(self.user)
+
+        with tempfile.TemporaryDirectory() as directory:
+            out = StringIO()
+            call_command("export_ledger", directory, stdout=out)
+            # The draft is left out, the entry posted after it is not
+            self.assertIn("Exported 4 lines to 1 files", out.getvalue())
+            columns = self.read_npz(Path(directory) / "ledger-00001.npz")
+            self.assertEqual(columns["debit_cents"], ("<i8", [1050, 0, 700, 0]))
+            self.assertEqual(columns["credit_cents"][1], [0, 1050, 0, 700])
+            self.assertEqual(
+                columns["account_code"], ("<U4", ["1200", "4000", "1200", "4000"])
+            )
+            self.assertEqual(columns["journal"][1], ["SJ"] * 4)
+            self.assertEqual(
+                columns["entry_date"],
+                ("<M8[D]", [(date(2025, 3, 1) - date(1970, 1, 1)).days] * 4),
+            )
+
+            draft.post(self.user)
+            self.create_entry("JE-4", Decimal("1.00")).post(self.user)
+            # Never posted: does not hold back later postings
+            self.create_entry("JE-5", Decimal("3.00"))
+            self.create_entry("JE-6", Decimal("4.00")).post(self.user)
+            call_command(
+                "export_ledger",
+                directory,
+                "--incremental",
+                "--rows-per-file",
+                "4",
+                stdout=out,
+            )
+            manifest = json.loads((Path(directory) / "manifest.json").read_text())
+            self.assertEqual([part["rows"] for part in manifest["parts"]], [4, 4, 2])
+            self.assertEqual(manifest["last_version"], ledger_version())
+            columns = self.read_npz(Path(directory) / "ledger-00003.npz")
+            self.assertEqual(columns["debit_cents"][1], [400, 0])
+
+            # Nothing posted since: nothing exported
+            out = StringIO()
+            call_command("export_ledger", directory, "--incremental", stdout=out)
+            self.assertIn("Exported 0 lines to 0 files", out.getvalue())
+
+            call_command("export_ledger", directory, stdout=out)
+            self.assertEqual(
+                sorted(path.name for path in Path(directory).iterdir()),
+                ["ledger-00001.npz", "manifest.json"],
+            )
+
+
+class VerifyLedgerTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+
+    def test_drift_is_reported_and_fixed(self):
+        self.create_entry("JE-1", Decimal("10.00")).post(self.user)
+        broken = self.create_entry("JE-2", Decimal("5.00"))
+        broken.post(self.user)
+        broken.lines.filter(account=self.sales).update(credit_amount=Decimal("4.00"))
+        Account.objects.filter(pk=self.receivable.pk).update(
+            current_balance=Decimal("99.00")
+        )
+
+        out = StringIO()
+        call_command("verify_ledger", "--workers", "1", "--fix", stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("1200 Accounts Receivable: stored 99.00, posted 15.00", output)
+        self.assertIn("4000 Sales Revenue: stored 15.00, posted 14.00", output)
+        self.assertIn("Entry JE-2: debits 5.00 != credits 4.00", output)
+        self.assertIn("2 drifted, 1 unbalanced entries", output)
+        self.assertIn("Rewrote 2 account balances", output)
+        self.receivable.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, Decimal("15.00"))
+
+        out = StringIO()
+        call_command("verify_ledger", "--workers", "1", stdout=out)
+        self.assertIn("0 drifted", out.getvalue())
+
+
+class PostingQueueTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        self.customer = Customer.objects.create(
+            user=self.user, receivable_account=self.receivable
+        )
+
+    def create_invoice(self, number, invoice_date=date(2025, 3, 1), status="sent"):
+        invoice = Invoice.objects.create(
+            customer=self.customer,
+            invoice_number=number,
+            invoice_date=invoice_date,
+            due_date=invoice_date,
+            amount=Decimal("40.00"),
+            created_by=self.user,
+        )
+        invoice.lines.create(
+            description="Consulting", account=self.sales, unit_price=Decimal("40.00")
+        )
+        invoice.status = status
+        invoice.save()
+        return invoice
+
+    def test_saving_a_document_only_queues_a_job(self):
+        invoice = self.create_invoice("INV-1")
+
+        self.assertFalse(JournalEntry.objects.exists())
+        job = PostingJob.objects.get()
+        self.assertEqual((job.document_type, job.object_id), ("invoice", invoice.id))
+        self.assertEqual(job.status, "pending")
+
+    def test_worker_posts_the_whole_batch(self):
+        self.create_invoice("INV-1")
+        self.create_invoice("INV-2")
+
+        out = StringIO()
+        call_command("run_posting_worker", "--once", stdout=out)
+
+        entries = JournalEntry.objects.filter(status="posted")
+        self.assertEqual(
+            sorted(entries.values_list("entry_number", "reference")),
+            [("SJ-2025-000001", "INV-INV-1"), ("SJ-2025-000002", "INV-INV-2")],
+        )
+        self.assertEqual(JournalEntryLine.objects.count(), 4)
+        self.receivable.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, Decimal("80.00"))
+        self.assertFalse(PostingJob.objects.exclude(status="done").exists())
+        self.assertIn("Queue depth 0", out.getvalue())
+
+        # Re-queued jobs do not write a second entry
+        enqueue("invoice", Invoice.objects.first().id)
+        process_batch()
+        self.assertEqual(JournalEntry.objects.count(), 2)
+
+    def test_invoices_paid_before_the_worker_runs_are_posted(self):
+        invoice = self.create_invoice("INV-1")
+        invoice.payments.create(
+            payment_date=date(2025, 3, 2),
+            amount=Decimal("40.00"),
+            payment_method="cash",
+        )
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, "paid")
+
+        self.assertEqual(process_batch(), {"done": 1, "failed": 0})
+        self.assertEqual(JournalEntry.objects.get().status, "posted")
+        self.receivable.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, Decimal("40.00"))
+
+    def test_draft_entries_follow_their_document(self):
+        invoice = self.create_invoice("INV-1", status="draft")
+        process_batch()
+        entry = JournalEntry.objects.get()
+        self.assertEqual(entry.status, "draft")
+        self.assertEqual((entry.source_type, entry.source_id), ("invoice", invoice.id))
+
+        invoice.lines.create(
+            description="Travel", account=self.sales, unit_price=Decimal("10.00")
+        )
+        invoice.amount = Decimal("50.00")
+        invoice.invoice_date = date(2025, 3, 5)
+        invoice.status = "sent"
+        invoice.save()
+        process_batch()
+
+        entry = JournalEntry.objects.get()
+        self.assertEqual((entry.status, entry.date), ("posted", date(2025, 3, 5)))
+        self.assertEqual(
+            sorted(entry.lines.values_list("description", "entry_date")),
+            [
+                ("Accounts Receivable", date(2025, 3, 5)),
+                ("Consulting", date(2025, 3, 5)),
+                ("Travel", date(2025, 3, 5)),
+            ],
+        )
+        self.receivable.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, Decimal("50.00"))
+
+    def test_bills_sharing_a_number_get_an_entry_each(self):
+        payable = Account.objects.create(
+            code="2100",
+            name="Accounts Payable",
+            account_type=AccountType.objects.create(name="Payables", type="liability"),
+        )
+        for code in ("ACME", "BOLT"):
+            vendor = Vendor.objects.create(
+                procurement_vendor=ProcurementVendor.objects.create(
+                    supplier=Supplier.objects.create(name=code, code=code),
+                    vendor_type="distributor",
+                ),
+                payable_account=payable,
+            )
+            bill = Bill.objects.create(
+                vendor=vendor,
+                bill_number="7",
+                bill_date=date(2025, 3, 1),
+                due_date=date(2025, 3, 31),
+                amount=Decimal("5.00"),
+                status="approved",
+            )
+            bill.lines.create(
+                description="Paper", account=self.sales, amount=Decimal("5.00")
+            )
+            bill.save()
+
+        self.assertEqual(process_batch(), {"done": 2, "failed": 0})
+        self.assertEqual(
+            sorted(JournalEntry.objects.values_list("reference", "status")),
+            [("BILL-7", "posted"), ("BILL-7", "posted")],
+        )
+        payable.refresh_from_db()
+        self.assertEqual(payable.current_balance, Decimal("10.00"))
+
+    def test_failing_jobs_are_retried_then_dead_lettered(self):
+        self.create_invoice("INV-1")
+        self.create_invoice("INV-LATE", invoice_date=date(2030, 1, 1))
+
+        self.assertEqual(process_batch(max_attempts=2), {"done": 1, "failed": 1})
+        job = PostingJob.objects.get(status="pending")
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("no fiscal year", job.last_error)
+        self.assertEqual(process_batch(max_attempts=2), {"done": 0, "failed": 0})
+
+        PostingJob.objects.update(available_at=job.enqueued_at)
+        self.assertEqual(process_batch(max_attempts=2), {"done": 0, "failed": 1})
+        stats = queue_stats()
+        self.assertEqual((stats["depth"], stats["failed"]), (0, 1))
+        self.assertEqual(JournalEntry.objects.count(), 1)
+
+    def test_rules_are_cached_until_accounts_change(self):
+        posting_rules.get_rule("invoice")
+        with self.assertNumQueries(0):
+            rule = posting_rules.get_rule("invoice")
+        self.assertEqual(
+            rule["accounts"],
+            {"receivable": self.receivable.id, "revenue": self.sales.id},
+        )
+
+        self.receivable.name = "Trade Receivables"
+        self.receivable.save()
+        with self.assertNumQueries(1):
+            posting_rules.fiscal_year_for(date(2025, 3, 1))
+
+
+class InvoiceOrdersTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+        liability = AccountType.objects.create(name="Liabilities", type="liability")
+        Account.objects.create(
+            code="2200", name="Sales Tax Payable", account_type=liability
+        )
+        self.buyer = CustomUser.objects.create_user(
+            email="buyer@example.com", password="secret"
+        )
+
+    def create_order(self, user, status="delivered", **amounts):
+        order = Order.objects.create(
+            user=user,
+            status=status,
+            total_amount=Decimal("30.00"),
+            shipping_address="Street 1",
+            billing_address="Street 1",
+            email="buyer@example.com",
+            payment_method="card",
+            **amounts,
+        )
+        order.items.create(
+            product_name="Mug", price=Decimal("10.00"), quantity=2, subtotal=20
+        )
+        order.items.create(
+            product_name="Shirt",
+            variation_name="XL",
+            price=Decimal("10.00"),
+            quantity=1,
+            subtotal=10,
+        )
+        return order
+
+    def test_completed_orders_are_invoiced_in_batches(self):
+        # Orders are dated today and so are their invoices
+        today = timezone.localdate()
+        self.fiscal_year.start_date = date(today.year, 1, 1)
+        self.fiscal_year.end_date = date(today.year, 12, 31)
+        self.fiscal_year.save()
+        Customer.objects.create(user=self.user, receivable_account=self.receivable)
+        order = self.create_order(
+            self.buyer,
+            shipping_amount=Decimal("5.00"),
+            discount_amount=Decimal("2.00"),
+            tax_amount=Decimal("3.00"),
+        )
+        self.create_order(self.user)
+        self.create_order(self.user, status="pending")
+        guest_order = self.create_order(None)
+
+        out = StringIO()
+        call_command("invoice_orders", "--batch-size", "1", stdout=out)
+
+        self.assertIn("Invoiced 2 orders (6 lines)", out.getvalue())
+        invoice = Invoice.objects.get(order=order)
+        self.assertEqual(invoice.customer.user, self.buyer)
+        self.assertEqual(invoice.invoice_number, f"{today.year}-000001")
+        self.assertEqual(invoice.status, "sent")
+        self.assertEqual(invoice.amount, Decimal("33.00"))
+        self.assertEqual(invoice.total_amount, Decimal("36.00"))
+        self.assertEqual(
+            [line.description for line in invoice.lines.all()],
+            ["Mug", "Shirt (XL)", "Shipping", "Discount"],
+        )
+        self.assertEqual(PostingJob.objects.filter(document_type="invoice").count(), 2)
+
+        self.assertEqual(process_batch(), {"done": 5, "failed": 0})
+        entry = JournalEntry.objects.get(reference=f"INV-{today.year}-000001")
+        self.assertEqual(entry.status, "posted")
+
+        # Each order's sale is booked once: by its invoice, or for the guest
+        # order, which is never invoiced, by the order's own entry
+        self.assertEqual(
+            sorted(
+                JournalEntryLine.objects.filter(account=self.receivable).values_list(
+                    "journal_entry__reference", "debit_amount"
+                )
+            ),
+            [
+                (f"INV-{today.year}-000001", Decimal("36.00")),
+                (f"INV-{today.year}-000002", Decimal("30.00")),
+                (f"SO-{guest_order.order_number}", Decimal("30.00")),
+            ],
+        )
+        self.receivable.refresh_from_db()
+        self.sales.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, Decimal("96.00"))
+        self.assertEqual(self.sales.current_balance, Decimal("93.00"))
+
+        # Invoiced orders are not picked up again
+        call_command("invoice_orders", stdout=out)
+        self.assertEqual(Invoice.objects.count(), 2)
+
+
+class ConcurrentPostingTests(LedgerFixtureMixin, TransactionTestCase):
+    THREADS = 4
+    ENTRIES_PER_THREAD = 10
+
+    def setUp(self):
+        self.create_ledger()
+
+    def test_parallel_posting_does_not_drift(self):
+        batches = [
+            [
+                self.create_entry(f"JE-{t}-{i}", Decimal("1.25")).id
+                for i in range(self.ENTRIES_PER_THREAD)
+            ]
+            for t in range(self.THREADS)
+        ]
+        errors = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker(batch):
+            try:
+                barrier.wait()
+                for entry_id in batch:
+                    post_many([entry_id], self.user)
+            except Exception as exc:  # pragma: no cover - reported below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(b,)) for b in batches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        expected = Decimal("1.25") * self.THREADS * self.ENTRIES_PER_THREAD
+        self.receivable.refresh_from_db()
+        self.sales.refresh_from_db()
+        self.assertEqual(self.receivable.current_balance, expected)
+        self.assertEqual(self.sales.current_balance, expected)
+        self.assertFalse(JournalEntry.objects.exclude(status="posted").exists())
+
+
+class DocumentSequenceTests(LedgerFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_ledger()
+
+    def test_documents_saved_without_number_are_numbered(self):
+        first = self.create_entry("", Decimal("10.00"))
+        second = self.create_entry("", Decimal("10.00"))
+        customer = Customer.objects.create(
+            user=self.user, receivable_account=self.receivable
+        )
+        invoice = Invoice.objects.create(
+            customer=customer,
+            invoice_date=date(2025, 3, 1),
+            due_date=date(2025, 3, 31),
+            amount=Decimal("10.00"),
+        )
+
+        self.assertEqual(first.entry_number, "SJ-2025-000001")
+        self.assertEqual(second.entry_number, "SJ-2025-000002")
+        self.assertEqual(invoice.invoice_number, "2025-000001")
+        self.assertEqual(
+            self.create_entry("JE-9", Decimal("1.00")).entry_number, "JE-9"
+        )
+
+    def test_numbers_restart_every_fiscal_year(self):
+        FiscalYear.objects.create(
+            name="FY 2025/26", start_date=date(2025, 7, 1), end_date=date(2026, 6, 30)
+        )
+        self.fiscal_year.end_date = date(2025, 6, 30)
+        self.fiscal_year.save()
+
+        self.assertEqual(sequences.next_number("rfq", date(2025, 6, 30)), "2025-00001")
+        self.assertEqual(sequences.next_number("rfq", date(2026, 6, 1)), "2026-00001")
+        self.assertEqual(sequences.next_number("rfq", date(2025, 8, 1)), "2026-00002")
+        # No fiscal year: numbered by calendar year
+        self.assertEqual(sequences.next_number("rfq", date(2027, 1, 1)), "2027-00001")
+        self.assertEqual(
+            sequences.next_numbers("order", 2, date(2025, 1, 1), prefix="WEB"),
+            ["WEB-2025-000001", "WEB-2025-000002"],
+        )
+
+
+class DocumentSequenceBlockTests(TransactionTestCase):
+    databases = {"default", sequences.SEQUENCE_DB}
+
+    def setUp(self):
+        sequences._blocks.clear()
+        posting_rules.invalidate()
+
+    def test_numbers_come_from_a_reserved_block(self):
+        day = date(2025, 1, 1)
+        self.assertEqual(sequences.next_number("order", day), "ORD-2025-000001")
+        with self.assertNumQueries(0):
+            numbers = sequences.next_numbers("order", sequences.BLOCK_SIZE - 1, day)
+        self.assertEqual(numbers[-1], f"ORD-2025-{sequences.BLOCK_SIZE:06d}")
+
+        self.assertEqual(
+            sequences.next_number("order", day),
+            f"ORD-2025-{sequences.BLOCK_SIZE + 1:06d}",
+        )
+        counter = DocumentSequence.objects.get(name="order:ORD:2025")
+        self.assertEqual(counter.next_value, 2 * sequences.BLOCK_SIZE + 1)
+
+    def test_reservation_on_the_sequence_connection(self):
+        self.assertEqual(sequences.reserve("test", 5, using=sequences.SEQUENCE_DB), 1)
+        self.assertEqual(sequences.reserve("test", 5, using=sequences.SEQUENCE_DB), 6)
+        self.assertEqual(DocumentSequence.objects.get(name="test").next_value, 11)
+
+    def test_concurrent_reservations_do_not_overlap(self):
+        blocks, errors = [], []
+        barrier = threading.Barrier(4)
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(10):
+                    blocks.append(sequences.reserve("test", 3))
+            except Exception as exc:  # pragma: no cover - reported below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(blocks), list(range(1, 121, 3)))
@@ -36,4 +36,10 @@ urlpatterns = [
     path("reports/balance-sheet/", views.balance_sheet, name="balance_sheet"),
     path("reports/income-statement/", views.income_statement, name="income_statement"),
     path("reports/trial-balance/", views.trial_balance, name="trial_balance"),
+    path(
+        "reports/receivables-aging/",
+        views.receivables_aging,
+        name="receivables_aging",
+    ),
+    path("reports/payables-aging/", views.payables_aging, name="payables_aging"),
 ]
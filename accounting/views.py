@@ -1,3 +1,6 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib import messages
@@ -26,6 +29,10 @@ from .models import (
     FinancialPeriod,
     FinancialStatement,
 )
+from .aging import BUCKETS, aging_detail, aging_report
+from .ledger import account_ledger, account_totals, dashboard_kpis, range_totals
+from .posting import balance_delta
+from .statements import current_statement, summarize
 
 
 @login_required
@@ -35,60 +42,38 @@ def accounting_dashboard(request):
     # Get current fiscal year and period
     current_fiscal_year = FiscalYear.objects.filter(is_active=True).first()
 
-    # Get summary data
-    accounts_count = Account.objects.filter(is_active=True).count()
-
-    # Get accounts receivable balance
-    receivable_accounts = Account.objects.filter(
-        account_type__type="asset", name__icontains="receivable", is_active=True
-    )
-    receivable_balance = sum(account.current_balance for account in receivable_accounts)
-
-    # Get accounts payable balance
-    payable_accounts = Account.objects.filter(
-        account_type__type="liability", name__icontains="payable", is_active=True
-    )
-    payable_balance = sum(account.current_balance for account in payable_accounts)
-
-    # Get revenue and expense totals for current fiscal year
-    if current_fiscal_year:
-        revenue_accounts = Account.objects.filter(
-            account_type__type="revenue", is_active=True
-        )
-        expense_accounts = Account.objects.filter(
-            account_type__type="expense", is_active=True
-        )
-
-        revenue_total = sum(account.current_balance for account in revenue_accounts)
-        expense_total = sum(account.current_balance for account in expense_accounts)
-
-        profit_loss = revenue_total - expense_total
-    else:
-        revenue_total = expense_total = profit_loss = 0
+    # All KPI figures come from one cached aggregate query
+    kpis = dashboard_kpis()
+    if not current_fiscal_year:
+        kpis = dict(kpis, total_revenue=0, total_expenses=0, profit_loss=0)
 
     # Recent transactions
-    recent_journal_entries = JournalEntry.objects.all().order_by(
-        "-date", "-created_at"
-    )[:10]
+    recent_journal_entries = (
+        JournalEntry.objects.select_related("journal")
+        .annotate(total_debit=Sum("lines__debit_amount"))
+        .order_by("-date", "-created_at")[:10]
+    )
 
     # Unpaid bills
-    unpaid_bills = Bill.objects.filter(
-        status__in=["verified", "approved", "partial"]
-    ).order_by("due_date")[:5]
+    unpaid_bills = (
+        Bill.objects.filter(status__in=["verified", "approved", "partial"])
+        .select_related("vendor__procurement_vendor__supplier")
+        .order_by("due_date")[:5]
+    )
 
     # Unpaid invoices
-    unpaid_invoices = Invoice.objects.filter(
-        status__in=["sent", "partially_paid", "overdue"]
-    ).order_by("due_date")[:5]
+    unpaid_invoices = (
+        Invoice.objects.filter(status__in=["sent", "partially_paid", "overdue"])
+        .select_related("customer__user")
+        .order_by("due_date")[:5]
+    )
 
     context = {
         "current_fiscal_year": current_fiscal_year,
-        "accounts_count": accounts_count,
-        "receivable_balance": receivable_balance,
-        "payable_balance": payable_balance,
-        "revenue_total": revenue_total,
-        "expense_total": expense_total,
-        "profit_loss": profit_loss,
+        **kpis,
+        # Kept for templates using the previous names
+        "revenue_total": kpis["total_revenue"],
+        "expense_total": kpis["total_expenses"],
         "recent_journal_entries": recent_journal_entries,
         "unpaid_bills": unpaid_bills,
         "unpaid_invoices": unpaid_invoices,
@@ -104,16 +89,14 @@ def account_list(request):
     """Display the chart of accounts."""
     account_types = AccountType.objects.all()
 
-    # Get parent accounts (top level)
-    parent_accounts = {}
-    for account_type in account_types:
-        parent_accounts[account_type.id] = Account.objects.filter(
-            account_type=account_type, parent__isnull=True, is_active=True
-        ).order_by("code")
+    # Whole chart in tree order with balances rolled up in Python
+    accounts_by_type = {account_type.id: [] for account_type in account_types}
+    for account in Account.objects.filter(is_active=True).tree().with_subtree_balance():
+        accounts_by_type.setdefault(account.account_type_id, []).append(account)
 
     context = {
         "account_types": account_types,
-        "parent_accounts": parent_accounts,
+        "accounts_by_type": accounts_by_type,
     }
 
     return render(request, "accounting/account_list.html", context)
@@ -123,22 +106,56 @@ def account_list(request):
 @permission_required("accounting.view_account")
 def account_detail(request, account_id):
     """Display account details and transactions."""
-    account = get_object_or_404(Account, id=account_id)
+    account = get_object_or_404(
+        Account.objects.select_related("account_type", "parent"), id=account_id
+    )
 
     # Get child accounts if any
-    child_accounts = account.children.filter(is_active=True).order_by("code")
+    child_accounts = (
+        account.children.filter(is_active=True).with_subtree_balance().order_by("code")
+    )
 
-    # Get journal entry lines for this account
-    journal_lines = (
-        JournalEntryLine.objects.filter(account=account, journal_entry__status="posted")
-        .select_related("journal_entry")
-        .order_by("-journal_entry__date", "-journal_entry__id")
+    # Date range filter
+    start_date = end_date = None
+    try:
+        if request.GET.get("start_date"):
+            start_date = date.fromisoformat(request.GET["start_date"])
+        if request.GET.get("end_date"):
+            end_date = date.fromisoformat(request.GET["end_date"])
+    except ValueError:
+        messages.error(request, "Invalid date filter.")
+
+    # One keyset page of posted lines with running balances
+    try:
+        ledger = account_ledger(
+            account,
+            start_date,
+            end_date,
+            after=request.GET.get("after"),
+            before=request.GET.get("before"),
+        )
+    except ValueError:
+        ledger = account_ledger(account, start_date, end_date)
+
+    # Totals of the whole range, not just the page shown
+    totals = range_totals(account, start_date, end_date)
+    ending_balance = ledger["opening_balance"] + balance_delta(
+        account.account_type.type, totals["debit_total"], totals["credit_total"]
     )
 
     context = {
         "account": account,
         "child_accounts": child_accounts,
-        "journal_lines": journal_lines,
+        "balance_with_descendants": account.balance_with_descendants,
+        "account_entries": ledger["lines"],
+        "opening_balance": ledger["opening_balance"],
+        "next_cursor": ledger["next_cursor"],
+        "previous_cursor": ledger["previous_cursor"],
+        "total_debits": totals["debit_total"],
+        "total_credits": totals["credit_total"],
+        "ending_balance": ending_balance,
+        "start_date": start_date,
+        "end_date": end_date,
     }
 
     return render(request, "accounting/account_detail.html", context)
@@ -252,12 +269,43 @@ def journal_entry_post(request, entry_id):
     return redirect("accounting:journal_entry_detail", entry_id=entry_id)
 
 
+# Columns invoice and bill lists can be sorted by, "-" prefixed for descending
+DOCUMENT_SORTS = ("date", "due_date", "total", "remaining")
+
+
+def sort_documents(documents, sort, date_field):
+    """Order a with_totals() queryset by ?sort=, newest first by default"""
+    column = sort.lstrip("-")
+    if column not in DOCUMENT_SORTS:
+        return documents.order_by(f"-{date_field}", "-id")
+    if column == "date":
+        column = date_field
+    direction = "-" if sort.startswith("-") else ""
+    return documents.order_by(f"{direction}{column}", f"{direction}id")
+
+
+def filter_balance(documents, params):
+    """Filter a with_totals() queryset by ?balance=open|settled and ?min_remaining="""
+    balance = params.get("balance")
+    if balance == "open":
+        documents = documents.filter(remaining__gt=0)
+    elif balance == "settled":
+        documents = documents.filter(remaining__lte=0)
+    try:
+        minimum = Decimal(params.get("min_remaining", ""))
+    except InvalidOperation:
+        return documents
+    return documents.filter(remaining__gte=minimum)
+
+
 # Bill Views
 @login_required
 @permission_required("accounting.view_bill")
 def bill_list(request):
     """List bills with filters."""
-    bills = Bill.objects.all()
+    bills = Bill.objects.with_totals().select_related(
+        "vendor__procurement_vendor__supplier"
+    )
 
     # Apply filters
     if "status" in request.GET:
@@ -287,12 +335,17 @@ def bill_list(request):
                 | Q(notes__icontains=query)
             )
 
+    if request.GET.get("overdue"):
+        bills = bills.filter(overdue=True)
+
     # Get vendors for filter dropdown
-    vendors = Vendor.objects.all()
+    vendors = Vendor.objects.select_related("procurement_vendor__supplier")
 
+    sort = request.GET.get("sort", "")
     context = {
-        "bills": bills.order_by("-bill_date", "-id"),
+        "bills": sort_documents(filter_balance(bills, request.GET), sort, "bill_date"),
         "vendors": vendors,
+        "sort": sort,
     }
 
     return render(request, "accounting/bill_list.html", context)
@@ -302,8 +355,13 @@ def bill_list(request):
 @permission_required("accounting.view_bill")
 def bill_detail(request, bill_id):
     """Display bill details."""
-    bill = get_object_or_404(Bill, id=bill_id)
-    lines = bill.lines.all()
+    bill = get_object_or_404(
+        Bill.objects.with_totals().select_related(
+            "vendor__procurement_vendor__supplier"
+        ),
+        id=bill_id,
+    )
+    lines = bill.lines.with_totals().select_related("account")
     payments = bill.payments.all().order_by("-payment_date", "-id")
 
     context = {
@@ -320,7 +378,7 @@ def bill_detail(request, bill_id):
 @permission_required("accounting.view_invoice")
 def invoice_list(request):
     """List invoices with filters."""
-    invoices = Invoice.objects.all()
+    invoices = Invoice.objects.with_totals().select_related("customer__user")
 
     # Apply filters
     if "status" in request.GET:
@@ -353,11 +411,15 @@ def invoice_list(request):
             )
 
     # Get customers for filter dropdown
-    customers = Customer.objects.all()
+    customers = Customer.objects.select_related("user")
 
+    sort = request.GET.get("sort", "")
     context = {
-        "invoices": invoices.order_by("-invoice_date", "-id"),
+        "invoices": sort_documents(
+            filter_balance(invoices, request.GET), sort, "invoice_date"
+        ),
         "customers": customers,
+        "sort": sort,
     }
 
     return render(request, "accounting/invoice_list.html", context)
@@ -367,8 +429,10 @@ def invoice_list(request):
 @permission_required("accounting.view_invoice")
 def invoice_detail(request, invoice_id):
     """Display invoice details."""
-    invoice = get_object_or_404(Invoice, id=invoice_id)
-    lines = invoice.lines.all()
+    invoice = get_object_or_404(
+        Invoice.objects.with_totals().select_related("customer__user"), id=invoice_id
+    )
+    lines = invoice.lines.with_totals().select_related("account")
     payments = invoice.payments.all().order_by("-payment_date", "-id")
 
     context = {
@@ -403,25 +467,22 @@ def balance_sheet(request):
         else:
             as_of_date = fiscal_year.end_date
 
-    # Get all asset accounts
-    asset_accounts = Account.objects.filter(
-        account_type__type="asset", is_active=True
-    ).order_by("code")
-
-    # Get all liability accounts
-    liability_accounts = Account.objects.filter(
-        account_type__type="liability", is_active=True
-    ).order_by("code")
-
-    # Get all equity accounts
-    equity_accounts = Account.objects.filter(
-        account_type__type="equity", is_active=True
-    ).order_by("code")
-
-    # Calculate totals
-    total_assets = sum(account.current_balance for account in asset_accounts)
-    total_liabilities = sum(account.current_balance for account in liability_accounts)
-    total_equity = sum(account.current_balance for account in equity_accounts)
+    # Stored statement, brought up to date with anything posted since; only
+    # the Refresh button (a POST) saves the refreshed copy
+    statement = current_statement(
+        "balance_sheet",
+        as_of_date,
+        fiscal_year=fiscal_year,
+        period=period,
+        user=request.user,
+        store=request.method == "POST",
+    )
+    if request.method == "POST":
+        return redirect(request.get_full_path())
+    rows = statement["sections"]["accounts"]["rows"]
+    asset_accounts = [row for row in rows if row["type"] == "asset"]
+    liability_accounts = [row for row in rows if row["type"] == "liability"]
+    equity_accounts = [row for row in rows if row["type"] == "equity"]
 
     # Get fiscal years for dropdown
     fiscal_years = FiscalYear.objects.all().order_by("-start_date")
@@ -433,9 +494,7 @@ def balance_sheet(request):
         "asset_accounts": asset_accounts,
         "liability_accounts": liability_accounts,
         "equity_accounts": equity_accounts,
-        "total_assets": total_assets,
-        "total_liabilities": total_liabilities,
-        "total_equity": total_equity,
+        **statement["totals"],
         "fiscal_years": fiscal_years,
         "selected_fiscal_year": fiscal_year,
         "periods": periods,
@@ -476,20 +535,26 @@ def income_statement(request):
             start_date = fiscal_year.start_date
             end_date = fiscal_year.end_date
 
-    # Get all revenue accounts
-    revenue_accounts = Account.objects.filter(
-        account_type__type="revenue", is_active=True
-    ).order_by("code")
-
-    # Get all expense accounts
-    expense_accounts = Account.objects.filter(
-        account_type__type="expense", is_active=True
-    ).order_by("code")
-
-    # Calculate totals
-    total_revenue = sum(account.current_balance for account in revenue_accounts)
-    total_expenses = sum(account.current_balance for account in expense_accounts)
-    net_income = total_revenue - total_expenses
+    # Revenue and expense movement within the selected range
+    if end_date:
+        statement = current_statement(
+            "income_statement",
+            end_date,
+            start_date,
+            fiscal_year=fiscal_year,
+            period=period,
+            user=request.user,
+            store=request.method == "POST",
+        )
+        if request.method == "POST":
+            return redirect(request.get_full_path())
+        rows = statement["sections"]["accounts"]["rows"]
+        totals = statement["totals"]
+    else:
+        rows = account_totals(types=["revenue", "expense"])
+        totals = summarize("income_statement", {"accounts": {"rows": rows}})
+    revenue_accounts = [row for row in rows if row["type"] == "revenue"]
+    expense_accounts = [row for row in rows if row["type"] == "expense"]
 
     # Get fiscal years for dropdown
     fiscal_years = FiscalYear.objects.all().order_by("-start_date")
@@ -500,9 +565,7 @@ def income_statement(request):
     context = {
         "revenue_accounts": revenue_accounts,
         "expense_accounts": expense_accounts,
-        "total_revenue": total_revenue,
-        "total_expenses": total_expenses,
-        "net_income": net_income,
+        **totals,
         "fiscal_years": fiscal_years,
         "selected_fiscal_year": fiscal_year,
         "periods": periods,
@@ -536,41 +599,22 @@ def trial_balance(request):
         else:
             as_of_date = fiscal_year.end_date
 
-    # Get all accounts
-    accounts = Account.objects.filter(is_active=True).order_by("code")
-
-    # Prepare data for the trial balance
-    trial_balance_data = []
-    total_debits = 0
-    total_credits = 0
-
-    for account in accounts:
-        if account.current_balance != 0:
-            debit_amount = credit_amount = 0
-
-            if account.is_debit_balance:
-                # Asset and Expense accounts typically have debit balances
-                if account.current_balance > 0:
-                    debit_amount = account.current_balance
-                else:
-                    credit_amount = -account.current_balance
-            else:
-                # Liability, Equity, and Revenue accounts typically have credit balances
-                if account.current_balance > 0:
-                    credit_amount = account.current_balance
-                else:
-                    debit_amount = -account.current_balance
-
-            total_debits += debit_amount
-            total_credits += credit_amount
-
-            trial_balance_data.append(
-                {
-                    "account": account,
-                    "debit_amount": debit_amount,
-                    "credit_amount": credit_amount,
-                }
-            )
+    # Balances as of the report date, already split into debit/credit columns
+    statement = current_statement(
+        "trial_balance",
+        as_of_date,
+        fiscal_year=fiscal_year,
+        period=period,
+        user=request.user,
+        store=request.method == "POST",
+    )
+    if request.method == "POST":
+        return redirect(request.get_full_path())
+    trial_balance_data = [
+        row for row in statement["sections"]["accounts"]["rows"] if row["balance"] != 0
+    ]
+    total_debits = statement["totals"]["total_debits"]
+    total_credits = statement["totals"]["total_credits"]
 
     # Get fiscal years for dropdown
     fiscal_years = FiscalYear.objects.all().order_by("-start_date")
@@ -591,3 +635,52 @@ def trial_balance(request):
     }
 
     return render(request, "accounting/trial_balance.html", context)
+
+
+def aging_view(request, ledger, template):
+    """Shared body of the receivables and payables aging reports."""
+    as_of_date = timezone.now().date()
+    if request.GET.get("as_of"):
+        try:
+            as_of_date = date.fromisoformat(request.GET["as_of"])
+        except ValueError:
+            messages.error(request, "Invalid as-of date.")
+
+    rows, totals = aging_report(ledger, as_of_date)
+
+    # Drill-down into one party and/or bucket
+    party_id = request.GET.get("party", "")
+    party_id = int(party_id) if party_id.isdigit() else None
+    bucket = request.GET.get("bucket")
+    if bucket not in [key for key, _, _, _ in BUCKETS]:
+        bucket = None
+    documents = None
+    if party_id or bucket:
+        documents = aging_detail(ledger, as_of_date, party_id, bucket)[:500]
+
+    context = {
+        "ledger": ledger,
+        "rows": rows,
+        "totals": totals,
+        "buckets": BUCKETS,
+        "documents": documents,
+        "selected_party": party_id,
+        "selected_bucket": bucket,
+        "as_of_date": as_of_date,
+    }
+
+    return render(request, template, context)
+
+
+@login_required
+@permission_required("accounting.view_invoice")
+def receivables_aging(request):
+    """Accounts receivable aging by customer."""
+    return aging_view(request, "receivables", "accounting/aging_report.html")
+
+
+@login_required
+@permission_required("accounting.view_bill")
+def payables_aging(request):
+    """Accounts payable aging by vendor."""
+    return aging_view(request, "payables", "accounting/aging_report.html")
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+# Keys read or rows updated per statement; each costs a few parameters
+CHUNK_SIZE = 500
+
+
+def chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def apply_changes(model, fields, before, after, create=False, size=CHUNK_SIZE):
+    """
+    Move the ``fields`` of ``model`` rows by ``after`` minus ``before``.
+
+    Both map a primary key to a tuple of totals, one per field. With
+    ``create`` missing rows are inserted first. Each chunk of rows then
+    gets one UPDATE adding its deltas with F() expressions, so concurrent
+    changes to the same row add up instead of overwriting each other.
+    Returns the number of rows changed.
+    """
+    zeros = (0,) * len(fields)
+    deltas = {}
+    for pk in before.keys() | after.keys():
+        old, new = before.get(pk, zeros), after.get(pk, zeros)
+        delta = tuple(n - o for n, o in zip(new, old))
+        if any(delta):
+            deltas[pk] = delta
+    if not deltas:
+        return 0
+
+    pks = sorted(deltas)
+    if create:
+        model.objects.bulk_create((model(pk=pk) for pk in pks), ignore_conflicts=True)
+    for chunk in chunks(pks, size):
+        changes = {}
+        for index, field in enumerate(fields):
+            whens = [
+                When(pk=pk, then=Value(deltas[pk][index]))
+                for pk in chunk
+                if deltas[pk][index]
+            ]
+            if whens:
+                changes[field] = F(field) + Case(
+                    *whens,
+                    default=Value(0),
+                    output_field=model._meta.get_field(field),
+                )
+        model.objects.filter(pk__in=chunk).update(**changes)
+    return len(deltas)
+
+
+@contextmanager
+def tracking(totals, apply, keys, lock=None):
+    """
+    Hand ``apply`` the ``totals`` of ``keys`` from before and after the
+    block. With a ``lock`` queryset its rows of ``keys`` are locked first,
+    all in one transaction, so concurrent changes queue up.
+    """
+    keys = [key for key in keys if key is not None]
+    if lock is None:
+        before = totals(keys)
+        yield
+        apply(before, totals(keys))
+        return
+
+    with transaction.atomic():
+        for chunk in chunks(keys):
+            list(
+                lock.select_for_update()
+                .filter(pk__in=chunk)
+                .order_by("pk")
+                .values_list("pk")
+            )
+        before = totals(keys)
+        yield
+        apply(before, totals(keys))
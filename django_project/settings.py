@@ -85,8 +85,15 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Take the write lock when a transaction starts so concurrent postings
+        # wait for each other instead of failing on lock upgrade
+        "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 20},
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
+# The same database on a connection of its own, on which blocks of document
+# numbers are reserved and committed while the caller's transaction goes on
+DATABASES["sequences"] = {**DATABASES["default"]}
 
 
 # Password validation
@@ -148,7 +148,7 @@ class PurchaseOrder(models.Model):
         ("cancelled", "Cancelled"),
     )
 
-    order_number = models.CharField(max_length=50, unique=True)
+    order_number = models.CharField(max_length=50, unique=True, blank=True)
     supplier = models.ForeignKey(
         Supplier, on_delete=models.PROTECT, related_name="purchase_orders"
     )
@@ -233,7 +233,7 @@ class InventoryAdjustment(models.Model):
         ("other", "Other"),
     )
 
-    adjustment_number = models.CharField(max_length=50, unique=True)
+    adjustment_number = models.CharField(max_length=50, unique=True, blank=True)
     warehouse = models.ForeignKey(
         Warehouse, on_delete=models.CASCADE, related_name="inventory_adjustments"
     )
@@ -250,7 +250,7 @@ class PurchaseRequisition(models.Model):
         ("cancelled", "Cancelled"),
     )
 
-    requisition_number = models.CharField(max_length=50, unique=True)
+    requisition_number = models.CharField(max_length=50, unique=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="draft")
     requester = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, related_name="purchase_requisitions"
@@ -333,7 +333,7 @@ class RFQ(models.Model):
         ("cancelled", "Cancelled"),
     )
 
-    rfq_number = models.CharField(max_length=50, unique=True)
+    rfq_number = models.CharField(max_length=50, unique=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="draft")
     requisition = models.ForeignKey(
         PurchaseRequisition,
@@ -11,9 +11,11 @@ from .models import (
     Coupon,
     Wishlist,
     Review,
+    ProductRatingSummary,
     ShippingMethod,
     PaymentMethod,
 )
+from .ratings import tracking
 
 
 class CategoryAdmin(admin.ModelAdmin):
@@ -167,11 +169,28 @@ class ReviewAdmin(admin.ModelAdmin):
     actions = ["approve_reviews"]
 
     def approve_reviews(self, request, queryset):
-        queryset.update(is_approved=True)
+        # One update of the reviews and of the summaries they change
+        with tracking(queryset.values_list("pk", flat=True)):
+            queryset.update(is_approved=True)
 
     approve_reviews.short_description = "Approve selected reviews"
 
 
+class ProductRatingSummaryAdmin(admin.ModelAdmin):
+    list_display = ("product", "rating_count", "rating_sum")
+    search_fields = ("product__name",)
+    readonly_fields = (
+        "product",
+        "rating_count",
+        "rating_sum",
+        "rating_1",
+        "rating_2",
+        "rating_3",
+        "rating_4",
+        "rating_5",
+    )
+
+
 class ShippingMethodAdmin(admin.ModelAdmin):
     list_display = ("name", "price", "estimated_days", "is_active")
     list_filter = ("is_active",)
@@ -191,5 +210,6 @@ admin.site.register(Order, OrderAdmin)
 admin.site.register(Coupon, CouponAdmin)
 admin.site.register(Wishlist, WishlistAdmin)
 admin.site.register(Review, ReviewAdmin)
+admin.site.register(ProductRatingSummary, ProductRatingSummaryAdmin)
 admin.site.register(ShippingMethod, ShippingMethodAdmin)
 admin.site.register(PaymentMethod, PaymentMethodAdmin)
@@ -0,0 +1,105 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch, Q
+
+# Sort option -> ordering, ending with the id so every position is unique
+SORTS = {
+    "newest": ("-created_at", "-id"),
+    "price_asc": ("effective_price", "id"),
+    "price_desc": ("-effective_price", "-id"),
+}
+DEFAULT_SORT = "newest"
+
+# Products per catalog page, and the most a page may ask for
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(ordering, product):
+    """Opaque cursor of the position just after ``product``"""
+    key = ordering[0].lstrip("-")
+    value = getattr(product, key)
+    position = [value.isoformat() if hasattr(value, "isoformat") else str(value)]
+    position.append(product.id)
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(ordering, cursor):
+    """(sort key value, id) of a cursor, or None if it is not a valid one"""
+    from .models import Product
+
+    field = Product._meta.get_field(ordering[0].lstrip("-"))
+    field = getattr(field, "output_field", field)
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return field.to_python(value), int(last_id)
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def after(ordering, value, last_id):
+    """
+    Rows following (value, last_id) in ``ordering``; the leading range on
+    the sort key lets the database start the index scan there.
+    """
+    key = ordering[0].lstrip("-")
+    op = "lt" if ordering[0].startswith("-") else "gt"
+    return Q(**{f"{key}__{op}e": value}) & (
+        Q(**{f"{key}__{op}": value}) | Q(**{f"id__{op}": last_id})
+    )
+
+
+def with_listing_data(products):
+    """
+    Fetch what a listing shows: rating summaries with the page, then the
+    primary images and categories.
+    """
+    from .models import ProductImage
+
+    return products.select_related("rating_summary").prefetch_related(
+        Prefetch(
+            "images",
+            queryset=ProductImage.objects.filter(is_primary=True),
+            to_attr="primary_images",
+        ),
+        "categories",
+    )
+
+
+def clamp_size(size):
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def catalog_page(products, sort=None, cursor=None, size=PAGE_SIZE):
+    """
+    A page of ``products`` in ``sort`` order and the cursor of the next
+    page, or None on the last one.
+
+    Pages are found by keyset on (sort key, id) rather than OFFSET: the
+    scan of the matching (is_active, key, id) index starts right after the
+    previous page, so page N costs what page 1 does.
+    """
+    ordering = SORTS.get(sort) or SORTS[DEFAULT_SORT]
+    size = clamp_size(size)
+    position = decode_cursor(ordering, cursor) if cursor else None
+    if position:
+        products = products.filter(after(ordering, *position))
+    page = list(with_listing_data(products.order_by(*ordering))[: size + 1])
+    if len(page) > size:
+        return page[:size], encode_cursor(ordering, page[size - 1])
+    return page, None
+
+
+def offset_page(products, cursor=None, size=PAGE_SIZE):
+    """
+    A page of ``products`` in their own order, e.g. search relevance, with
+    the cursor an offset. Only for bounded sets such as search results.
+    """
+    size = clamp_size(size)
+    start = int(cursor) if cursor and cursor.isdigit() else 0
+    page = list(with_listing_data(products)[start : start + size + 1])
+    if len(page) > size:
+        return page[:size], str(start + size)
+    return page, None
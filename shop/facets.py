@@ -0,0 +1,345 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F
+
+# Facets of every active product; variations add "variation:<name>"
+CATEGORY = "category"
+PRICE = "price"
+AVAILABILITY = "availability"
+VARIATION = "variation:"
+
+# Bands of the price paid, as (value, lower bound, upper bound or None)
+PRICE_BANDS = (
+    ("0-25", 0, 25),
+    ("25-50", 25, 50),
+    ("50-100", 50, 100),
+    ("100-250", 100, 250),
+    ("250-500", 250, 500),
+    ("500+", 500, None),
+)
+
+# Products refreshed per transaction
+BATCH_SIZE = 500
+
+# Versions whose changes are kept for other processes to replay; a process
+# further behind reloads its index
+CHANGE_LOG_VERSIONS = 1000
+
+# Index of this process, reloaded when the facet version moves on
+_index = None
+
+
+def bitset(ids):
+    """Python int with bit n set for every id n"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for product_id in ids:
+        bits[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(bits, "little")
+
+
+def price_band(price):
+    for value, low, high in PRICE_BANDS:
+        if high is None or price < high:
+            return value
+
+
+def facet_values(product_ids):
+    """{(facet, value, product_id)} of the active products among ``product_ids``"""
+    from .models import Product, ProductVariation
+
+    active = Product.objects.filter(pk__in=product_ids, is_active=True)
+    values = set()
+    for product_id, price, availability in active.values_list(
+        "id", "effective_price", "availability"
+    ):
+        values.add((PRICE, price_band(price), product_id))
+        values.add((AVAILABILITY, availability, product_id))
+    for product_id, category_id in Product.categories.through.objects.filter(
+        product__in=active
+    ).values_list("product_id", "category_id"):
+        values.add((CATEGORY, str(category_id), product_id))
+    for product_id, name, value in ProductVariation.objects.filter(
+        product__in=active
+    ).values_list("product_id", "name", "value"):
+        values.add((VARIATION + name.strip(), value.strip(), product_id))
+    return values
+
+
+def stored_facets(product_ids):
+    """{(facet, value, product_id): pk} of the posting rows of ``product_ids``"""
+    from .models import ProductFacet
+
+    return {
+        (facet, value, product_id): pk
+        for pk, facet, value, product_id in ProductFacet.objects.filter(
+            product_id__in=product_ids
+        ).values_list("pk", "facet", "value", "product_id")
+    }
+
+
+def bump_facet_version():
+    """
+    Advance the facet version; the row stays locked until the caller
+    commits, so versions are handed out in commit order.
+    """
+    from .models import FacetVersion
+
+    if not FacetVersion.objects.filter(pk=1).update(version=F("version") + 1):
+        FacetVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+    return facet_version()
+
+
+def facet_version():
+    from .models import FacetVersion
+
+    version = FacetVersion.objects.filter(pk=1).values_list("version", flat=True)
+    return version.first() or 0
+
+
+def publish(added, removed):
+    """
+    Bump the facet version for posting rows just added and removed, log
+    them under it and, once committed, patch this process's index with
+    them. Other processes replay the log when they see the new version.
+    """
+    from .models import FacetChange
+
+    if not added and not removed:
+        return
+    version = bump_facet_version()
+    FacetChange.objects.bulk_create(
+        [
+            FacetChange(
+                version=version,
+                facet=facet,
+                value=value,
+                product_id=product_id,
+                added=is_added,
+            )
+            for rows, is_added in ((added, True), (removed, False))
+            for facet, value, product_id in rows
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    FacetChange.objects.filter(version__lte=version - CHANGE_LOG_VERSIONS).delete()
+    transaction.on_commit(lambda: patch_index(version, added, removed))
+
+
+def refresh_facets(product_ids):
+    """
+    Bring the posting rows of ``product_ids`` up to date.
+
+    Per batch the stored rows are compared with the products' current
+    facet values, and only the difference is deleted and inserted.
+    """
+    from .models import ProductFacet
+
+    product_ids = sorted(set(product_ids))
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[start : start + BATCH_SIZE]
+        with transaction.atomic():
+            stored = stored_facets(batch)
+            current = facet_values(batch)
+            removed = stored.keys() - current
+            added = current - stored.keys()
+            ProductFacet.objects.filter(
+                pk__in=[stored[key] for key in removed]
+            ).delete()
+            ProductFacet.objects.bulk_create(
+                ProductFacet(facet=facet, value=value, product_id=product_id)
+                for facet, value, product_id in added
+            )
+            publish(added, removed)
+    return len(product_ids)
+
+
+def rebuild_facets():
+    """Refresh the posting rows of every product, walking them by id"""
+    from .models import Product
+
+    last_id, total = 0, 0
+    while True:
+        batch = list(
+            Product.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:BATCH_SIZE]
+        )
+        if not batch:
+            return total
+        total += refresh_facets(batch)
+        last_id = batch[-1]
+
+
+class FacetIndex:
+    """
+    Products of every facet value as bitsets: Python ints with bit n set
+    for product id n, intersected with & and counted with bit_count().
+    """
+
+    def __init__(self, version, postings):
+        self.version = version
+        # facet -> {value: bitset}
+        self.postings = postings
+
+    @classmethod
+    def load(cls, version):
+        from .models import ProductFacet
+
+        ids = defaultdict(list)
+        for facet, value, product_id in (
+            ProductFacet.objects.order_by()
+            .values_list("facet", "value", "product_id")
+            .iterator(chunk_size=10_000)
+        ):
+            ids[facet, value].append(product_id)
+        postings = defaultdict(dict)
+        for (facet, value), product_ids in ids.items():
+            postings[facet][value] = bitset(product_ids)
+        return cls(version, postings)
+
+    def copy(self):
+        return type(self)(
+            self.version,
+            defaultdict(
+                dict, {facet: dict(values) for facet, values in self.postings.items()}
+            ),
+        )
+
+    def catch_up(self, version):
+        """
+        Replay the logged changes of the versions after this index's up to
+        ``version``; False if some of them are no longer logged.
+        """
+        from .models import FacetChange
+
+        changes = defaultdict(lambda: ([], []))
+        for change_version, facet, value, product_id, added in (
+            FacetChange.objects.filter(version__gt=self.version, version__lte=version)
+            .order_by("version")
+            .values_list("version", "facet", "value", "product_id", "added")
+        ):
+            changes[change_version][0 if added else 1].append(
+                (facet, value, product_id)
+            )
+        if len(changes) != version - self.version:
+            return False
+        for change_version in sorted(changes):
+            self.apply(*changes[change_version])
+        self.version = version
+        return True
+
+    def apply(self, added, removed):
+        """Set and clear the bits of posting rows (facet, value, product_id)"""
+        changes = defaultdict(lambda: ([], []))
+        for facet, value, product_id in added:
+            changes[facet, value][0].append(product_id)
+        for facet, value, product_id in removed:
+            changes[facet, value][1].append(product_id)
+        for (facet, value), (set_ids, cleared_ids) in changes.items():
+            values = self.postings[facet]
+            bits = (values.get(value, 0) & ~bitset(cleared_ids)) | bitset(set_ids)
+            if bits:
+                values[value] = bits
+            else:
+                values.pop(value, None)
+                if not values:
+                    del self.postings[facet]
+
+    @property
+    def products(self):
+        """Every indexed product: each has exactly one availability"""
+        bits = 0
+        for posting in self.postings.get(AVAILABILITY, {}).values():
+            bits |= posting
+        return bits
+
+    def select(self, selection, base=None, skip=None):
+        """
+        Bitset of the products in ``base`` (all by default) having, for each
+        facet of ``selection`` but ``skip``, any of its selected values.
+        """
+        bits = self.products if base is None else base
+        for facet, values in selection.items():
+            if facet == skip or not values:
+                continue
+            postings = self.postings.get(facet, {})
+            either = 0
+            for value in values:
+                either |= postings.get(value, 0)
+            bits &= either
+        return bits
+
+    def counts(self, selection, base=None):
+        """
+        (products matching, {facet: {value: count}}) given ``selection``.
+
+        A facet's counts apply the selection of every other facet, so the
+        alternatives to its own selected values keep their counts. Values
+        without products are left out.
+        """
+        matching = self.select(selection, base)
+        counts = {}
+        for facet, values in self.postings.items():
+            within = (
+                self.select(selection, base, skip=facet)
+                if selection.get(facet)
+                else matching
+            )
+            counts[facet] = {}
+            for value, bits in values.items():
+                count = (within & bits).bit_count()
+                if count:
+                    counts[facet][value] = count
+        return matching.bit_count(), counts
+
+
+def facet_index():
+    """
+    The facet index, loaded once per process. When another process has
+    changed the facets since, their logged changes are replayed; only a
+    process too far behind reloads it.
+    """
+    global _index
+
+    version = facet_version()
+    if _index is not None and _index.version == version:
+        return _index
+    index = None
+    if _index is not None and _index.version < version:
+        # Inside a transaction the changes may still be rolled back, so
+        # they are replayed on a copy then
+        index = _index.copy() if connection.in_atomic_block else _index
+        if not index.catch_up(version):
+            index = None
+    if index is None:
+        # Rows committed after the version was read may be loaded too; they
+        # are applied again when their version arrives, which is harmless
+        index = FacetIndex.load(version)
+    if not connection.in_atomic_block:
+        _index = index
+    return index
+
+
+def patch_index(version, added, removed):
+    """Apply a committed change to this process's index if it is current"""
+    if _index is not None and _index.version == version - 1:
+        _index.apply(added, removed)
+        _index.version = version
+
+
+def filter_selection(products, selection):
+    """Narrow a Product queryset to the products matching ``selection``"""
+    from .models import ProductFacet
+
+    for facet, values in selection.items():
+        if values:
+            products = products.filter(
+                pk__in=ProductFacet.objects.filter(
+                    facet=facet, value__in=values
+                ).values("product_id")
+            )
+    return products
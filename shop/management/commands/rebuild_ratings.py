@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.ratings import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the review count, rating sum and star histogram of every "
+        "product from its approved reviews, zeroing products that have none."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        products = rebuild_summaries()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt the rating summaries of {products} products in "
+                f"{elapsed:.2f}s"
+            )
+        )
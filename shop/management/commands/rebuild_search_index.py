@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the search document of every active product from its name, "
+        "SKU, categories, variations and description, and drop the documents "
+        "of inactive products."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        products = rebuild_index()
+        elapsed = time.perf_counter() - started
+        rate = products / elapsed if elapsed else 0
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {products} products in {elapsed:.2f}s "
+                f"({rate:,.0f} products/s)"
+            )
+        )
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="order_number",
+            field=models.CharField(blank=True, max_length=50, unique=True),
+        ),
+    ]
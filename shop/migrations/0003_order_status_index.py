@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0002_blank_document_numbers"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "id"], name="shop_order_status_8e5afa_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,168 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:58
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+COLUMNS = "name, sku, categories, variations, description"
+
+# SQLite: an external-content FTS5 table over the documents, kept in sync
+# by triggers, with prefix indexes for search-as-you-type
+SQLITE_INDEX = [
+    f"""
+    CREATE VIRTUAL TABLE shop_product_fts USING fts5(
+        {COLUMNS},
+        content='shop_productsearchdocument',
+        content_rowid='product_id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER shop_product_fts_insert AFTER INSERT
+    ON shop_productsearchdocument BEGIN
+        INSERT INTO shop_product_fts(rowid, {COLUMNS})
+        VALUES (new.product_id, new.name, new.sku, new.categories,
+                new.variations, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER shop_product_fts_delete AFTER DELETE
+    ON shop_productsearchdocument BEGIN
+        INSERT INTO shop_product_fts(shop_product_fts, rowid, {COLUMNS})
+        VALUES ('delete', old.product_id, old.name, old.sku, old.categories,
+                old.variations, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER shop_product_fts_update AFTER UPDATE
+    ON shop_productsearchdocument BEGIN
+        INSERT INTO shop_product_fts(shop_product_fts, rowid, {COLUMNS})
+        VALUES ('delete', old.product_id, old.name, old.sku, old.categories,
+                old.variations, old.description);
+        INSERT INTO shop_product_fts(rowid, {COLUMNS})
+        VALUES (new.product_id, new.name, new.sku, new.categories,
+                new.variations, new.description);
+    END
+    """,
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS shop_product_fts_insert",
+    "DROP TRIGGER IF EXISTS shop_product_fts_delete",
+    "DROP TRIGGER IF EXISTS shop_product_fts_update",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+# PostgreSQL: a generated tsvector weighting name and SKU over categories,
+# variations and description, with a GIN index
+POSTGRESQL_INDEX = [
+    """
+    ALTER TABLE shop_productsearchdocument ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', name), 'A')
+        || setweight(to_tsvector('simple', sku), 'A')
+        || setweight(to_tsvector('simple', categories), 'B')
+        || setweight(to_tsvector('simple', variations), 'C')
+        || setweight(to_tsvector('simple', description), 'D')
+    ) STORED
+    """,
+    """
+    CREATE INDEX shop_productsearch_vector_idx
+    ON shop_productsearchdocument USING GIN (search_vector)
+    """,
+]
+POSTGRESQL_DROP = [
+    "DROP INDEX IF EXISTS shop_productsearch_vector_idx",
+    "ALTER TABLE shop_productsearchdocument DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement)
+
+    return operation
+
+
+def index_products(apps, schema_editor):
+    """Documents for the products that exist already, a batch at a time"""
+    Product = apps.get_model("shop", "Product")
+    ProductSearchDocument = apps.get_model("shop", "ProductSearchDocument")
+    ProductVariation = apps.get_model("shop", "ProductVariation")
+    db = schema_editor.connection.alias
+
+    products = Product.objects.using(db).filter(is_active=True).order_by("id")
+    last_id = 0
+    while True:
+        batch = list(
+            products.filter(id__gt=last_id).values_list(
+                "id", "name", "sku", "description"
+            )[:500]
+        )
+        if not batch:
+            return
+        ids = [row[0] for row in batch]
+        categories = defaultdict(list)
+        for product_id, name in (
+            Product.categories.through.objects.using(db)
+            .filter(product_id__in=ids)
+            .values_list("product_id", "category__name")
+        ):
+            categories[product_id].append(name)
+        variations = defaultdict(list)
+        for product_id, name, value, sku in (
+            ProductVariation.objects.using(db)
+            .filter(product_id__in=ids)
+            .values_list("product_id", "name", "value", "sku")
+        ):
+            variations[product_id].append(f"{name} {value} {sku or ''}".strip())
+        ProductSearchDocument.objects.using(db).bulk_create(
+            ProductSearchDocument(
+                product_id=product_id,
+                name=name,
+                sku=sku or "",
+                categories=" ".join(categories[product_id]),
+                variations=" ".join(variations[product_id]),
+                description=description,
+            )
+            for product_id, name, sku, description in batch
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0003_order_status_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductSearchDocument",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="search_document",
+                        serialize=False,
+                        to="shop.product",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("sku", models.CharField(blank=True, max_length=255)),
+                ("categories", models.TextField(blank=True)),
+                ("variations", models.TextField(blank=True)),
+                ("description", models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(
+            run({"sqlite": SQLITE_INDEX, "postgresql": POSTGRESQL_INDEX}),
+            run({"sqlite": SQLITE_DROP, "postgresql": POSTGRESQL_DROP}),
+        ),
+        # Indexed through the triggers or generated column created above
+        migrations.RunPython(index_products, migrations.RunPython.noop),
+    ]
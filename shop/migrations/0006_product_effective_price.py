@@ -0,0 +1,45 @@
+# Generated by Django 5.1.7 on 2026-10-17 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0005_product_facets"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="effective_price",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=models.Case(
+                    models.When(
+                        sale_price__gt=0,
+                        sale_price__lt=models.F("price"),
+                        then=models.F("sale_price"),
+                    ),
+                    default=models.F("price"),
+                ),
+                output_field=models.DecimalField(decimal_places=2, max_digits=10),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["effective_price", "id"],
+                name="shop_product_price_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["created_at", "id"],
+                name="shop_product_newest_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-17 11:17
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model("shop", "Category")
+    categories = {
+        category.pk: category
+        for category in Category.objects.only("parent_id", "path", "depth")
+    }
+
+    def resolve(category):
+        if category.path:
+            return category
+        if category.parent_id:
+            parent = resolve(categories[category.parent_id])
+            category.path = f"{parent.path}{category.pk}/"
+            category.depth = parent.depth + 1
+        else:
+            category.path = f"{category.pk}/"
+            category.depth = 0
+        return category
+
+    for category in categories.values():
+        resolve(category)
+    Category.objects.bulk_update(categories.values(), ["path", "depth"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0006_product_effective_price"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
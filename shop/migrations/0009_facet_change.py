@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-17 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0008_product_rating_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FacetChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveBigIntegerField(db_index=True)),
+                ("facet", models.CharField(max_length=120)),
+                ("value", models.CharField(max_length=100)),
+                ("product_id", models.PositiveBigIntegerField()),
+                ("added", models.BooleanField()),
+            ],
+        ),
+    ]
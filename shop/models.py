@@ -1,10 +1,17 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 from accounts.models import CustomUser
 
 
+class CategoryQuerySet(models.QuerySet):
+    def subtree(self, category):
+        """The category and all of its descendants"""
+        return self.filter(path__startswith=category.path)
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True, blank=True)
@@ -17,6 +24,12 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Materialized path of ancestor ids, e.g. "3/17/42/"
+    path = models.CharField(max_length=255, db_index=True, editable=False, default="")
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ["name"]
@@ -24,12 +37,53 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+
+        old_path = self.path
+        prefix, self.depth = "", 0
+        if self.parent_id:
+            parent = Category.objects.only("path", "depth").get(pk=self.parent_id)
+            if old_path and parent.path.startswith(old_path):
+                raise ValueError("A category cannot be moved below its own subtree")
+            prefix, self.depth = parent.path, parent.depth + 1
+
+        with transaction.atomic():
+            if self.pk is None:
+                # The path ends in the category's own id, known once inserted
+                super().save(*args, **kwargs)
+                self.path = f"{prefix}{self.pk}/"
+                Category.objects.filter(pk=self.pk).update(
+                    path=self.path, depth=self.depth
+                )
+                return
+
+            self.path = f"{prefix}{self.pk}/"
+            super().save(*args, **kwargs)
+
+            # Re-root the whole subtree with one UPDATE after a move
+            if old_path and old_path != self.path:
+                Category.objects.filter(path__startswith=old_path).exclude(
+                    pk=self.pk
+                ).update(
+                    path=Concat(
+                        models.Value(self.path), Substr("path", len(old_path) + 1)
+                    ),
+                    depth=models.F("depth") + (self.depth - old_path.count("/") + 1),
+                )
 
     def __str__(self):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    def in_category(self, category):
+        """Products of the category or of any category below it"""
+        return self.filter(
+            pk__in=Product.categories.through.objects.filter(
+                category__path__startswith=category.path
+            ).values("product_id")
+        )
+
+
 class Product(models.Model):
     AVAILABILITY_CHOICES = (
         ("in_stock", "In Stock"),
@@ -75,9 +129,37 @@ class Product(models.Model):
     )  # Format: LxWxH
     meta_keywords = models.CharField(max_length=255, blank=True, null=True)
     meta_description = models.TextField(blank=True, null=True)
+    # current_price in SQL, stored so catalog pages can be sorted by index
+    effective_price = models.GeneratedField(
+        expression=models.Case(
+            models.When(
+                sale_price__gt=0,
+                sale_price__lt=models.F("price"),
+                then=models.F("sale_price"),
+            ),
+            default=models.F("price"),
+        ),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Catalog pages list active products only
+            models.Index(
+                fields=["effective_price", "id"],
+                condition=models.Q(is_active=True),
+                name="shop_product_price_idx",
+            ),
+            models.Index(
+                fields=["created_at", "id"],
+                condition=models.Q(is_active=True),
+                name="shop_product_newest_idx",
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -138,6 +220,76 @@ class ProductVariation(models.Model):
         return f"{self.product.name} - {self.name}: {self.value}"
 
 
+class ProductSearchDocument(models.Model):
+    """
+    Searchable text of an active product, denormalized from the product,
+    its categories and variations and indexed for full-text search: an FTS5
+    table on SQLite, a weighted tsvector column on PostgreSQL. See
+    shop.search.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="search_document",
+    )
+    name = models.CharField(max_length=255)
+    sku = models.CharField(max_length=255, blank=True)
+    categories = models.TextField(blank=True)
+    variations = models.TextField(blank=True)
+    description = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ProductFacet(models.Model):
+    """
+    Posting list entry: an active product having a facet value, e.g.
+    category 12, price band 50-100 or variation:Size XL. See shop.facets.
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="facets"
+    )
+    facet = models.CharField(max_length=120)
+    value = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = ("facet", "value", "product")
+
+    def __str__(self):
+        return f"{self.product_id} {self.facet}={self.value}"
+
+
+class FacetVersion(models.Model):
+    """Single-row counter bumped by every facet change, keys the facet index"""
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Facet version {self.version}"
+
+
+class FacetChange(models.Model):
+    """
+    Posting row a facet version added or removed, so processes holding an
+    older index replay the changes instead of reloading it. See shop.facets.
+    """
+
+    version = models.PositiveBigIntegerField(db_index=True)
+    facet = models.CharField(max_length=120)
+    value = models.CharField(max_length=100)
+    # Not a foreign key: the rows of deleted products are replayed too
+    product_id = models.PositiveBigIntegerField()
+    added = models.BooleanField()
+
+    def __str__(self):
+        sign = "+" if self.added else "-"
+        return f"{self.version}: {sign}{self.product_id} {self.facet}={self.value}"
+
+
 class Cart(models.Model):
     user = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, blank=True, null=True
@@ -201,7 +353,7 @@ class Order(models.Model):
         null=True,
         related_name="orders",
     )
-    order_number = models.CharField(max_length=50, unique=True)
+    order_number = models.CharField(max_length=50, unique=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     shipping_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -220,10 +372,25 @@ class Order(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        # Batch invoicing walks the orders of one status by id
+        indexes = [models.Index(fields=["status", "id"])]
 
     def __str__(self):
         return self.order_number
 
+    def clean(self):
+        # Imported here: the accounting app builds on these models
+        from accounting import credit
+
+        # Refuse new orders that would take the customer over their limit
+        if (
+            self._state.adding
+            and self.user_id
+            and self.total_amount is not None
+            and self.status in credit.IN_FLIGHT
+        ):
+            credit.check_credit(self.user_id, self.final_total)
+
     @property
     def final_total(self):
         return (
@@ -313,6 +480,46 @@ class Review(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.rating} stars by {self.user.email}"
 
+    def save(self, *args, **kwargs):
+        # The rating summary moves in the same transaction, see shop.signals
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class ProductRatingSummary(models.Model):
+    """
+    Approved reviews of a product: their count, rating sum and how many
+    gave each of 1-5 stars. Maintained by shop.ratings.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="rating_summary",
+    )
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Ratings of {self.product_id}: {self.rating_count}"
+
+    @property
+    def average(self):
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
+        return None
+
+    @property
+    def histogram(self):
+        """[(stars, reviews)] from 5 stars down"""
+        return [(stars, getattr(self, f"rating_{stars}")) for stars in range(5, 0, -1)]
+
 
 class ShippingMethod(models.Model):
     name = models.CharField(max_length=100)
@@ -0,0 +1,65 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = "shop:navigation:version"
+
+# Trees of old versions just expire; a category change moves the version
+# on. With a per-process cache this also bounds how stale another process's
+# tree can get
+NAVIGATION_CACHE_TIMEOUT = 60 * 5
+
+
+def navigation_version():
+    return cache.get_or_set(VERSION_KEY, time.time_ns(), None)
+
+
+def bump_navigation_version():
+    # A fresh value rather than an increment, so a version evicted from the
+    # cache is never handed out again
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def build_tree():
+    """
+    Active categories as nested {"id", "name", "slug", "path", "depth",
+    "children"} dicts, siblings by name. Categories below an inactive one
+    are hidden with it.
+    """
+    from .models import Category
+
+    nodes, roots = {}, []
+    for pk, name, slug, parent_id, path, depth in (
+        Category.objects.filter(is_active=True)
+        .order_by("depth", "name")
+        .values_list("id", "name", "slug", "parent_id", "path", "depth")
+    ):
+        node = {
+            "id": pk,
+            "name": name,
+            "slug": slug,
+            "path": path,
+            "depth": depth,
+            "children": [],
+        }
+        if parent_id is None:
+            roots.append(node)
+        elif parent_id in nodes:
+            nodes[parent_id]["children"].append(node)
+        else:
+            continue
+        nodes[pk] = node
+    return roots
+
+
+def navigation_tree():
+    """
+    The navigation tree, cached per navigation version so pages and menus
+    share it without querying categories.
+    """
+    key = f"shop:navigation:{navigation_version()}"
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_tree()
+        cache.set(key, tree, NAVIGATION_CACHE_TIMEOUT)
+    return tree
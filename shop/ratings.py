@@ -0,0 +1,91 @@
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+from django_project import deltas
+from django_project.deltas import chunks
+
+STARS = range(1, 6)
+
+# Summary columns of a product's approved reviews
+FIELDS = ("rating_count", "rating_sum", *(f"rating_{stars}" for stars in STARS))
+
+
+def rating_sums():
+    """Aggregates of the approved reviews, one per summary column"""
+    approved = Q(is_approved=True)
+    sums = {
+        "rating_count": Count("id", filter=approved),
+        "rating_sum": Coalesce(Sum("rating", filter=approved), 0),
+    }
+    for stars in STARS:
+        sums[f"rating_{stars}"] = Count("id", filter=approved & Q(rating=stars))
+    return sums
+
+
+def product_totals(review_ids):
+    """{product_id: (count, sum, 1 star, ..., 5 stars)} the given reviews add"""
+    from .models import Review
+
+    totals = {}
+    for ids in chunks(review_ids):
+        rows = (
+            Review.objects.filter(pk__in=ids)
+            .values("product")
+            .annotate(**rating_sums())
+            .order_by()
+            .values_list("product", *FIELDS)
+        )
+        for product_id, *values in rows:
+            previous = totals.get(product_id, (0,) * len(FIELDS))
+            totals[product_id] = tuple(map(sum, zip(previous, values)))
+    return totals
+
+
+def apply_changes(before, after):
+    """Move the summaries of the products by ``after`` minus ``before``"""
+    from .models import ProductRatingSummary
+
+    return deltas.apply_changes(
+        ProductRatingSummary, FIELDS, before, after, create=True
+    )
+
+
+def tracking(review_ids):
+    """
+    Apply the summary changes the block makes to the reviews, in one
+    transaction with the reviews locked so concurrent changes queue up.
+    """
+    from .models import Review
+
+    return deltas.tracking(
+        product_totals, apply_changes, review_ids, lock=Review.objects.all()
+    )
+
+
+def rebuild_summaries():
+    """Recompute every product's summary from its approved reviews"""
+    from .models import ProductRatingSummary, Review
+
+    with transaction.atomic():
+        rows = list(
+            Review.objects.filter(is_approved=True)
+            .values("product")
+            .annotate(**rating_sums())
+            .order_by()
+            .values_list("product", *FIELDS)
+        )
+        ProductRatingSummary.objects.exclude(rating_count=0).update(
+            **{field: 0 for field in FIELDS}
+        )
+        ProductRatingSummary.objects.bulk_create(
+            (
+                ProductRatingSummary(product_id=product_id, **dict(zip(FIELDS, values)))
+                for product_id, *values in rows
+            ),
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=list(FIELDS),
+        )
+    return len(rows)
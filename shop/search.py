@@ -0,0 +1,170 @@
+import re
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import BooleanField, ExpressionWrapper, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+# Terms of a query that are searched, the rest is ignored
+MAX_TERMS = 8
+
+# Shortest last term also matched as a prefix; the FTS5 prefix indexes
+# start at two characters, a single one would scan the whole vocabulary
+MIN_PREFIX = 2
+
+# Documents rebuilt per statement
+BATCH_SIZE = 500
+
+# Relevance of a match per column: name, sku, categories, variations,
+# description (the PostgreSQL weights A-D follow the same order)
+FTS5_WEIGHTS = (10.0, 10.0, 4.0, 2.0, 1.0)
+
+TERMS = re.compile(r"\w+")
+
+
+def build_documents(product_ids):
+    """Unsaved search documents of the active products among ``product_ids``"""
+    from .models import Product, ProductSearchDocument, ProductVariation
+
+    categories = defaultdict(list)
+    for product_id, name in Product.categories.through.objects.filter(
+        product_id__in=product_ids
+    ).values_list("product_id", "category__name"):
+        categories[product_id].append(name)
+    variations = defaultdict(list)
+    for product_id, name, value, sku in ProductVariation.objects.filter(
+        product_id__in=product_ids
+    ).values_list("product_id", "name", "value", "sku"):
+        variations[product_id].append(f"{name} {value} {sku or ''}".strip())
+
+    return [
+        ProductSearchDocument(
+            product_id=product_id,
+            name=name,
+            sku=sku or "",
+            categories=" ".join(categories[product_id]),
+            variations=" ".join(variations[product_id]),
+            description=description,
+        )
+        for product_id, name, sku, description in Product.objects.filter(
+            pk__in=product_ids, is_active=True
+        ).values_list("id", "name", "sku", "description")
+    ]
+
+
+def refresh_documents(product_ids):
+    """
+    Rewrite the search documents of ``product_ids``.
+
+    Per batch, one DELETE and one bulk INSERT; the index follows through
+    triggers (SQLite) or a generated column (PostgreSQL). Inactive or
+    deleted products lose their document.
+    """
+    from .models import ProductSearchDocument
+
+    product_ids = sorted(set(product_ids))
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[start : start + BATCH_SIZE]
+        with transaction.atomic():
+            ProductSearchDocument.objects.filter(product_id__in=batch).delete()
+            ProductSearchDocument.objects.bulk_create(build_documents(batch))
+    return len(product_ids)
+
+
+def rebuild_index():
+    """Rewrite every document, walking the products by id"""
+    from .models import Product, ProductSearchDocument
+
+    ProductSearchDocument.objects.exclude(product__is_active=True).delete()
+    last_id, total = 0, 0
+    while True:
+        batch = list(
+            Product.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:BATCH_SIZE]
+        )
+        if not batch:
+            return total
+        total += refresh_documents(batch)
+        last_id = batch[-1]
+
+
+def query_terms(query):
+    return TERMS.findall((query or "").lower())[:MAX_TERMS]
+
+
+def match_expression(terms, prefix):
+    """
+    Full-text query requiring every term; with ``prefix`` the last term also
+    matches longer words, as when the shopper is still typing it.
+    """
+    last = terms[-1]
+    if connection.vendor == "postgresql":
+        return " & ".join(terms[:-1] + [f"{last}:*" if prefix else last])
+    quoted = [f'"{term}"' for term in terms]
+    if prefix:
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def matched_ids(match):
+    """SQL selecting the ids of the products matching ``match``"""
+    if connection.vendor == "postgresql":
+        return RawSQL(
+            "SELECT product_id FROM shop_productsearchdocument"
+            " WHERE search_vector @@ to_tsquery('simple', %s)",
+            [match],
+        )
+    return RawSQL(
+        "SELECT rowid FROM shop_product_fts WHERE shop_product_fts MATCH %s",
+        [match],
+    )
+
+
+def match_rank(match):
+    """Correlated SQL ranking a product for ``match``, best match lowest"""
+    if connection.vendor == "postgresql":
+        return RawSQL(
+            "SELECT -ts_rank(search_vector, to_tsquery('simple', %s))"
+            " FROM shop_productsearchdocument"
+            " WHERE product_id = shop_product.id",
+            [match],
+            output_field=FloatField(),
+        )
+    weights = ", ".join(str(weight) for weight in FTS5_WEIGHTS)
+    return RawSQL(
+        f"SELECT bm25(shop_product_fts, {weights}) FROM shop_product_fts"
+        " WHERE shop_product_fts MATCH %s AND rowid = shop_product.id",
+        [match],
+        output_field=FloatField(),
+    )
+
+
+def matching(products, query):
+    """
+    Narrow a Product queryset to the products matching every term of
+    ``query``, best match first.
+
+    The matches are a subquery on the full-text index, so they are filtered
+    together with the rest of the queryset and ranked by the database, with
+    no cap on how many are considered. Products matching the terms as typed
+    come before those matching the last term only as a prefix.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return products.none()
+    exact = match_expression(terms, prefix=False)
+    match = exact
+    if len(terms[-1]) >= MIN_PREFIX:
+        match = match_expression(terms, prefix=True)
+
+    return (
+        products.filter(pk__in=matched_ids(match))
+        .annotate(
+            search_exact=ExpressionWrapper(
+                Q(pk__in=matched_ids(exact)), output_field=BooleanField()
+            ),
+            search_rank=match_rank(match),
+        )
+        .order_by("-search_exact", "search_rank", "id")
+    )
@@ -0,0 +1,135 @@
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from . import ratings
+from .models import Category, Product, ProductVariation, Review
+from .facets import publish, refresh_facets, stored_facets
+from .navigation import bump_navigation_version
+from .search import refresh_documents
+
+
+def reindex(product_ids):
+    """Refresh the search documents and facets of changed products"""
+    product_ids = list(product_ids)
+    refresh_documents(product_ids)
+    refresh_facets(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    """
+    Reindex a product when it is saved; inactive products leave the index.
+    """
+    reindex([instance.pk])
+
+
+@receiver(pre_delete, sender=Product)
+def remember_product_facets(sender, instance, **kwargs):
+    # The posting rows are deleted by cascade before post_delete
+    instance._facets = list(stored_facets([instance.pk]))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    publish((), instance.__dict__.pop("_facets", []))
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def remember_cleared_products(sender, instance, action, reverse, **kwargs):
+    # category.products.clear() does not say which products it detached
+    if action == "pre_clear" and reverse:
+        instance._cleared_products = list(
+            instance.products.values_list("id", flat=True)
+        )
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        reindex([instance.pk])
+    elif pk_set:
+        reindex(pk_set)
+    elif action == "post_clear":
+        reindex(instance._cleared_products)
+
+
+@receiver(post_save, sender=ProductVariation)
+@receiver(post_delete, sender=ProductVariation)
+def variation_changed(sender, instance, origin=None, **kwargs):
+    # Deleted along with its product, which leaves the indexes by itself
+    if isinstance(origin, Product) or getattr(origin, "model", None) is Product:
+        return
+    reindex([instance.product_id])
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_name(sender, instance, **kwargs):
+    instance._indexed_name = (
+        Category.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    """
+    Reindex the products of a renamed category.
+    """
+    if not created and instance.name != instance.__dict__.pop("_indexed_name", None):
+        refresh_documents(instance.products.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    instance._indexed_products = list(instance.products.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    reindex(instance.__dict__.pop("_indexed_products", []))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    """Drop the cached navigation tree once the change is committed"""
+    transaction.on_commit(bump_navigation_version)
+
+
+# Rating summaries move by the difference a save or delete makes to the
+# review's contribution. Review.save() and deletes run in a transaction, so
+# the review stays locked from reading its contribution until the summary
+# has moved and concurrent changes to it queue up.
+
+
+@receiver(pre_save, sender=Review)
+@receiver(pre_delete, sender=Review)
+def remember_review_ratings(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._ratings = {}
+        return
+    list(Review.objects.select_for_update().filter(pk=instance.pk).values_list("pk"))
+    instance._ratings = ratings.product_totals([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def update_rating_summary(sender, instance, origin=None, **kwargs):
+    """
+    Keep the product's rating summary in step with its approved reviews.
+    """
+    before = instance.__dict__.pop("_ratings", {})
+    # Deleted along with its product, whose summary goes too
+    if isinstance(origin, Product) or getattr(origin, "model", None) is Product:
+        return
+    ratings.apply_changes(before, ratings.product_totals([instance.pk]))
@@ -1,3 +1,365 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from accounts.models import CustomUser
+
+from . import facets
+from .catalog import catalog_page
+from .facets import FacetIndex, facet_index, facet_version
+from .models import (
+    Category,
+    FacetChange,
+    Product,
+    ProductFacet,
+    ProductRatingSummary,
+    ProductSearchDocument,
+    Review,
+)
+from .navigation import navigation_tree
+from .search import matching
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.shoes = Category.objects.create(name="Running Shoes")
+        self.boots = Category.objects.create(name="Boots")
+        self.trail = self.product("Trail Runner", "TR-100", "Light shoe for trails")
+        self.trail.categories.add(self.shoes)
+        self.road = self.product("Road Racer", "RR-200", "Fast shoe for running")
+        self.road.categories.add(self.shoes)
+        self.hiker = self.product("Mountain Hiker", "MH-300", "Waterproof boot")
+        self.hiker.categories.add(self.boots)
+
+    def product(self, name, sku, description):
+        return Product.objects.create(
+            name=name, sku=sku, description=description, price=Decimal("50.00")
+        )
+
+    def search(self, query):
+        return list(matching(Product.objects.all(), query).values_list("id", flat=True))
+
+    def test_search_is_ranked(self):
+        # A name match outranks a description match
+        self.assertEqual(self.search("runn"), [self.trail.id, self.road.id])
+        self.assertEqual(self.search("tr-100"), [self.trail.id])
+        self.assertEqual(self.search("shoe waterproof"), [])
+        self.assertEqual(self.search("  "), [])
+
+    def test_matching_filters_and_ranks_in_one_query(self):
+        products = Product.objects.filter(is_active=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                list(matching(products, "runn").values_list("id", flat=True)),
+                [self.trail.id, self.road.id],
+            )
+        self.road.price = Decimal("20.00")
+        self.road.save()
+        cheap = matching(products.filter(effective_price__lt=30), "shoe")
+        self.assertEqual(list(cheap), [self.road])
+        # Exact matches of the last term before prefix-only ones
+        self.hiker.description = "Waterproof boot for trails and trailheads"
+        self.hiker.save()
+        self.assertEqual(
+            list(matching(products, "trail").values_list("id", flat=True)),
+            [self.trail.id, self.hiker.id],
+        )
+        self.assertFalse(matching(products, "  ").exists())
+
+    def test_index_follows_changes(self):
+        self.hiker.variations.create(name="Colour", value="Crimson")
+        self.assertEqual(self.search("crimson"), [self.hiker.id])
+
+        self.boots.name = "Alpine Gear"
+        self.boots.save()
+        self.assertEqual(self.search("alpine"), [self.hiker.id])
+
+        self.hiker.categories.remove(self.boots)
+        self.assertEqual(self.search("alpine"), [])
+
+        self.road.is_active = False
+        self.road.save()
+        self.assertEqual(self.search("racer"), [])
+
+        self.trail.delete()
+        self.assertEqual(self.search("trail"), [])
+
+    def test_rebuild(self):
+        ProductSearchDocument.objects.all().delete()
+        Product.objects.filter(pk=self.road.pk).update(is_active=False)
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("Indexed 3 products", out.getvalue())
+        self.assertEqual(self.search("shoe"), [self.trail.id])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.shoes = Category.objects.create(name="Shoes")
+        self.boots = Category.objects.create(name="Boots")
+        self.cheap = self.product("Sandal", "20.00", self.shoes, "Red", "in_stock")
+        self.mid = self.product("Sneaker", "60.00", self.shoes, "Blue", "in_stock")
+        self.dear = self.product("Boot", "300.00", self.boots, "Red", "pre_order")
+
+    def product(self, name, price, category, colour, availability):
+        product = Product.objects.create(
+            name=name, description=name, price=Decimal(price), availability=availability
+        )
+        product.categories.add(category)
+        product.variations.create(name="Colour", value=colour)
+        return product
+
+    def test_counts_given_selection(self):
+        index = facet_index()
+        total, counts = index.counts({})
+        self.assertEqual(total, 3)
+        self.assertEqual(
+            counts["category"], {str(self.shoes.pk): 2, str(self.boots.pk): 1}
+        )
+        self.assertEqual(counts["price"], {"0-25": 1, "50-100": 1, "250-500": 1})
+        self.assertEqual(counts["variation:Colour"], {"Red": 2, "Blue": 1})
+
+        # Other facets are narrowed, the selected one keeps its alternatives
+        total, counts = index.counts({"variation:Colour": ["Red"]})
+        self.assertEqual(total, 2)
+        self.assertEqual(counts["variation:Colour"], {"Red": 2, "Blue": 1})
+        self.assertEqual(counts["availability"], {"in_stock": 1, "pre_order": 1})
+
+        total, counts = index.counts(
+            {"variation:Colour": ["Red", "Blue"], "category": [str(self.shoes.pk)]}
+        )
+        self.assertEqual(total, 2)
+        self.assertEqual(counts["price"], {"0-25": 1, "50-100": 1})
+
+    def test_changes_patch_index(self):
+        # Outside a transaction the index would be kept by the process
+        facets._index = facet_index()
+        self.addCleanup(setattr, facets, "_index", None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mid.price = Decimal("30.00")
+            self.mid.save()
+            self.cheap.categories.remove(self.shoes)
+            self.cheap.variations.update(value="Black")
+            self.cheap.variations.get().save()
+            self.dear.delete()
+
+        # Applying just the changes gives the same index as a reload
+        self.assertEqual(facets._index.version, facet_version())
+        self.assertEqual(facets._index.postings, FacetIndex.load(0).postings)
+        self.assertFalse(ProductSearchDocument.objects.filter(pk=self.dear.pk))
+        total, counts = facet_index().counts({})
+        self.assertEqual(total, 2)
+        self.assertEqual(counts["price"], {"0-25": 1, "25-50": 1})
+        self.assertEqual(counts["category"], {str(self.shoes.pk): 1})
+        self.assertEqual(counts["variation:Colour"], {"Black": 1, "Blue": 1})
+
+    def test_other_processes_replay_the_logged_changes(self):
+        facets._index = facet_index()
+        self.addCleanup(setattr, facets, "_index", None)
+
+        # As made by another process: this one's index is not patched
+        with self.captureOnCommitCallbacks(execute=False):
+            self.mid.price = Decimal("30.00")
+            self.mid.save()
+            self.dear.delete()
+
+        # The version, then the changes since the index's; no reload
+        with self.assertNumQueries(2):
+            index = facet_index()
+        self.assertEqual(index.version, facet_version())
+        self.assertEqual(index.postings, FacetIndex.load(0).postings)
+
+        # Changes no longer logged: the index is reloaded
+        FacetChange.objects.filter(version=facets._index.version + 1).delete()
+        with self.assertNumQueries(3):
+            index = facet_index()
+        self.assertEqual(index.postings, FacetIndex.load(0).postings)
+
+    def test_rebuild(self):
+        ProductFacet.objects.all().delete()
+        Product.objects.filter(pk=self.mid.pk).update(is_active=False)
+        out = StringIO()
+        call_command("rebuild_facets", stdout=out)
+        self.assertIn("Refreshed facets of 3 products", out.getvalue())
+        total, counts = facet_index().counts({})
+        self.assertEqual(total, 2)
+        self.assertEqual(counts["variation:Colour"], {"Red": 2})
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        self.shoes = Category.objects.create(name="Shoes", slug="shoes")
+        prices = [
+            ("30.00", None),
+            ("20.00", "25.00"),
+            ("40.00", "10.00"),
+            ("20.00", "0"),
+        ]
+        self.products = []
+        for number, (price, sale_price) in enumerate(prices):
+            product = Product.objects.create(
+                name=f"Product {number}",
+                description="",
+                price=Decimal(price),
+                sale_price=sale_price and Decimal(sale_price),
+            )
+            product.categories.add(self.shoes)
+            self.products.append(product)
+
+    def walk(self, sort, size):
+        products = Product.objects.filter(is_active=True)
+        pages, cursor = [], None
+        while True:
+            page, cursor = catalog_page(products, sort, cursor, size)
+            pages.append([product.pk for product in page])
+            if cursor is None:
+                return pages
+
+    def test_keyset_pages_by_effective_price(self):
+        first, second, third, fourth = (product.pk for product in self.products)
+        # Sale prices count only below the price; ties are ordered by id
+        self.assertEqual(self.walk("price_asc", 2), [[third, second], [fourth, first]])
+        self.assertEqual(self.walk("price_desc", 3), [[first, fourth, second], [third]])
+        self.assertEqual(self.walk("newest", 4), [[fourth, third, second, first]])
+        self.assertEqual(
+            Product.objects.get(pk=third).effective_price, Decimal("10.00")
+        )
+
+        page, cursor = catalog_page(Product.objects.all(), "price_asc", "garbage", 2)
+        self.assertEqual([product.pk for product in page], [third, second])
+
+    def test_api(self):
+        url = reverse("shop:catalog_api")
+        # The page, then its primary images and categories
+        with self.assertNumQueries(3):
+            data = self.client.get(url, {"sort": "price_asc", "size": 3}).json()
+        self.assertEqual(
+            [item["effective_price"] for item in data["results"]],
+            ["10.00", "20.00", "20.00"],
+        )
+        self.assertEqual(data["results"][0]["categories"], ["shoes"])
+        self.assertIsNone(data["results"][0]["image"])
+
+        data = self.client.get(url, {"sort": "price_asc", "after": data["next"]}).json()
+        self.assertEqual(
+            [item["id"] for item in data["results"]], [self.products[0].pk]
+        )
+        self.assertIsNone(data["next"])
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.clothing = Category.objects.create(name="Clothing")
+        self.shoes = Category.objects.create(name="Shoes", parent=self.clothing)
+        self.boots = Category.objects.create(name="Boots", parent=self.shoes)
+        self.toys = Category.objects.create(name="Toys")
+        self.boot = Product.objects.create(name="Boot", description="", price=10)
+        self.boot.categories.add(self.boots, self.shoes)
+        self.kite = Product.objects.create(name="Kite", description="", price=10)
+        self.kite.categories.add(self.toys)
+        cache.clear()
+
+    def test_paths_follow_parents(self):
+        self.boots.refresh_from_db()
+        self.assertEqual(
+            self.boots.path, f"{self.clothing.pk}/{self.shoes.pk}/{self.boots.pk}/"
+        )
+        self.assertEqual(self.boots.depth, 2)
+
+        self.shoes.parent = None
+        self.shoes.save()
+        self.boots.refresh_from_db()
+        self.assertEqual(self.boots.path, f"{self.shoes.pk}/{self.boots.pk}/")
+        self.assertEqual(self.boots.depth, 1)
+
+        self.shoes.parent = self.boots
+        with self.assertRaises(ValueError):
+            self.shoes.save()
+
+    def test_products_in_subtree(self):
+        with self.assertNumQueries(1):
+            products = list(Product.objects.in_category(self.clothing))
+        self.assertEqual(products, [self.boot])
+        self.assertEqual(list(Product.objects.in_category(self.toys)), [self.kite])
+
+    def test_navigation_tree_is_cached(self):
+        tree = navigation_tree()
+        self.assertEqual([node["name"] for node in tree], ["Clothing", "Toys"])
+        self.assertEqual(tree[0]["children"][0]["children"][0]["slug"], "boots")
+        with self.assertNumQueries(0):
+            self.assertEqual(navigation_tree(), tree)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shoes.is_active = False
+            self.shoes.save()
+        self.assertEqual(navigation_tree()[0]["children"], [])
+
+
+class RatingSummaryTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Kite", description="", price=10)
+        self.users = [
+            CustomUser.objects.create_user(email=f"buyer{n}@example.com", password="x")
+            for n in range(3)
+        ]
+
+    def review(self, user, rating, is_approved=True):
+        return Review.objects.create(
+            product=self.product,
+            user=user,
+            rating=rating,
+            comment="",
+            is_approved=is_approved,
+        )
+
+    def summary(self):
+        summary = ProductRatingSummary.objects.get(product=self.product)
+        return summary.rating_count, summary.rating_sum, dict(summary.histogram)
+
+    def test_summary_follows_reviews(self):
+        first = self.review(self.users[0], 5)
+        pending = self.review(self.users[1], 1, is_approved=False)
+        self.assertEqual(self.summary(), (1, 5, {5: 1, 4: 0, 3: 0, 2: 0, 1: 0}))
+
+        pending.is_approved = True
+        pending.save()
+        first.rating = 4
+        first.save()
+        self.assertEqual(self.summary(), (2, 5, {5: 0, 4: 1, 3: 0, 2: 0, 1: 1}))
+        self.assertEqual(
+            ProductRatingSummary.objects.get(product=self.product).average, 2.5
+        )
+
+        pending.delete()
+        self.assertEqual(self.summary()[:2], (1, 4))
+
+    def test_approve_action_is_set_wise(self):
+        for user, rating in zip(self.users, (3, 4, 5)):
+            self.review(user, rating, is_approved=False)
+        self.assertFalse(ProductRatingSummary.objects.exists())
+
+        review_admin = admin.site._registry[Review]
+        # The ids, then in a savepoint: lock, before, update, after, insert
+        # and update the summary
+        with self.assertNumQueries(9):
+            review_admin.approve_reviews(None, Review.objects.all())
+        self.assertEqual(self.summary(), (3, 12, {5: 1, 4: 1, 3: 1, 2: 0, 1: 0}))
+
+    def test_rebuild_and_listing(self):
+        self.review(self.users[0], 2)
+        Review.objects.update(rating=3)
+        out = StringIO()
+        call_command("rebuild_ratings", stdout=out)
+        self.assertIn("rating summaries of 1 products", out.getvalue())
+        self.assertEqual(self.summary()[:2], (1, 3))
 
-# Create your tests here.
+        data = self.client.get(reverse("shop:catalog_api")).json()
+        self.assertEqual(data["results"][0]["rating"], 3.0)
+        self.product.delete()
+        self.assertFalse(ProductRatingSummary.objects.exists())
@@ -11,6 +11,7 @@ urlpatterns = [
         views.product_list,
         name="product_list_by_category",
     ),
+    path("api/products/", views.catalog_api, name="catalog_api"),
     path("product/<slug:slug>/", views.product_detail, name="product_detail"),
     # Cart URLs
     path("cart/", views.cart_detail, name="cart_detail"),
@@ -1,8 +1,12 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Avg
+from django.http import JsonResponse
 from .models import Category, Product, Cart, CartItem, Wishlist
+from .catalog import PAGE_SIZE, SORTS, catalog_page, offset_page
+from .facets import CATEGORY, bitset, facet_index, filter_selection
+from .navigation import navigation_tree
+from .search import matching
 
 # Create your views here.
 
@@ -14,59 +18,126 @@ def product_list(request, category_slug=None):
 
     if category_slug:
         category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(categories=category)
+        products = products.in_category(category)
 
-    # Search functionality
+    # Search functionality: the full-text index joined onto the products,
+    # ranked unless another sort is asked for
     query = request.GET.get("q")
     if query:
-        products = products.filter(
-            Q(name__icontains=query)
-            | Q(description__icontains=query)
-            | Q(categories__name__icontains=query)
-        ).distinct()
+        products = matching(products, query)
 
     # Filtering by price
     min_price = request.GET.get("min_price")
     max_price = request.GET.get("max_price")
 
     if min_price:
-        products = products.filter(price__gte=min_price)
+        products = products.filter(effective_price__gte=min_price)
     if max_price:
-        products = products.filter(price__lte=max_price)
+        products = products.filter(effective_price__lte=max_price)
+
+    # Facets: counts for every facet value among the products found so far,
+    # given the values selected with e.g. ?availability=in_stock&price=0-25
+    index = facet_index()
+    selection = {
+        facet: request.GET.getlist(facet)
+        for facet in index.postings
+        if facet in request.GET
+    }
+    if query or min_price or max_price:
+        base = bitset(products.values_list("id", flat=True))
+    elif category:
+        base = 0
+        postings = index.postings.get(CATEGORY, {})
+        for pk in Category.objects.subtree(category).values_list("id", flat=True):
+            base |= postings.get(str(pk), 0)
+    else:
+        base = None
+    total, facets = index.counts(selection, base)
+    products = filter_selection(products, selection)
 
-    # Sorting
+    # Pagination: search results in relevance order unless another sort is
+    # asked for, otherwise by keyset on the sort key
     sort_by = request.GET.get("sort")
-    if sort_by == "price_asc":
-        products = products.order_by("price")
-    elif sort_by == "price_desc":
-        products = products.order_by("-price")
-    elif sort_by == "newest":
-        products = products.order_by("-created_at")
+    cursor = request.GET.get("after")
+    if query and sort_by not in SORTS:
+        products, next_cursor = offset_page(products, cursor)
+    else:
+        products, next_cursor = catalog_page(products, sort_by, cursor)
 
     context = {
         "category": category,
         "products": products,
-        "categories": Category.objects.filter(is_active=True),
+        "next_cursor": next_cursor,
+        "categories": navigation_tree(),
+        "facets": facets,
+        "selected_facets": selection,
+        "facet_total": total,
     }
 
     return render(request, "shop/product_list.html", context)
 
 
+def catalog_api(request):
+    """
+    A page of active products as JSON, optionally of one category and the
+    categories below it, with the cursor of the next page to pass back as
+    ``after``.
+    """
+    products = Product.objects.filter(is_active=True)
+    category_slug = request.GET.get("category")
+    if category_slug:
+        category = get_object_or_404(Category, slug=category_slug)
+        products = products.in_category(category)
+
+    size = request.GET.get("size", "")
+    products, next_cursor = catalog_page(
+        products,
+        request.GET.get("sort"),
+        request.GET.get("after"),
+        int(size) if size.isdigit() else PAGE_SIZE,
+    )
+
+    result = {"results": [], "next": next_cursor}
+    for product in products:
+        image = product.primary_images[0] if product.primary_images else None
+        summary = getattr(product, "rating_summary", None)
+        result["results"].append(
+            {
+                "id": product.id,
+                "name": product.name,
+                "slug": product.slug,
+                "price": str(product.price),
+                "effective_price": str(product.effective_price),
+                "is_on_sale": product.is_on_sale,
+                "image": image.image.url if image else None,
+                "categories": [category.slug for category in product.categories.all()],
+                "rating": summary.average if summary else None,
+                "rating_count": summary.rating_count if summary else 0,
+            }
+        )
+
+    return JsonResponse(result)
+
+
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug, is_active=True)
+    product = get_object_or_404(
+        Product.objects.select_related("rating_summary"), slug=slug, is_active=True
+    )
     related_products = (
         Product.objects.filter(categories__in=product.categories.all())
         .exclude(id=product.id)
+        .select_related("rating_summary")
         .distinct()[:4]
     )
     reviews = product.reviews.filter(is_approved=True)
-    avg_rating = reviews.aggregate(Avg("rating"))["rating__avg"]
+    rating_summary = getattr(product, "rating_summary", None)
 
     context = {
         "product": product,
         "related_products": related_products,
         "reviews": reviews,
-        "avg_rating": avg_rating,
+        "rating_summary": rating_summary,
+        "avg_rating": rating_summary.average if rating_summary else None,
     }
 
     return render(request, "shop/product_detail.html", context)
@@ -17,7 +17,8 @@ from .models import (
     ContactMessage,
 )
 from .forms import ContactForm
-from shop.models import Product, Category
+from shop.models import Product
+from shop.navigation import navigation_tree
 
 
 def get_common_context():
@@ -44,10 +45,8 @@ class HomeView(TemplateView):
             is_active=True, is_featured=True
         ).order_by("-created_at")[:8]
 
-        # Product categories
-        context["product_categories"] = Category.objects.filter(
-            is_active=True
-        ).order_by("name")
+        # Product categories, as the cached navigation tree
+        context["product_categories"] = navigation_tree()
 
         # Banners
         context["banners"] = Banner.objects.filter(